@@ -1,6 +1,41 @@
 #! /usr/bin/env python
 
 import numpy as np
+import specio
+
+def linefactors(fluxn, fluxl, fluxh, ninds):
+    """
+    This function computes the factor difference of line depth between
+    spectra of greater abundances and the spectrum of lesser abundance, and
+    its statistics.
+
+    Inputs
+    ------
+    fluxn: 1D array. Spectrum without the line.
+    fluxl: 1D array. Spectrum of lesser abundance.
+    fluxh: 1D or 2D array. Spectra of greater abundances, one per row.
+    ninds: 1D array. Indices of the channels where the line is present.
+
+    Outputs
+    -------
+    factors: 2D array. Factor of each spectrum (rows) at each channel.
+    stats  : 2D array. Mean, median, minimum, maximum, and standard deviation
+                       of the factors of each spectrum.
+    """
+    fluxh = np.atleast_2d(fluxh)
+    # Compute the factor relation of all spectra at once
+    factors = (fluxn[ninds] - fluxh[:, ninds]) / (fluxn[ninds] - fluxl[ninds])
+
+    # Stats on the factors:
+    fmean = np.mean(factors, axis=1)
+    fmedn = np.median(factors, axis=1)
+    frngl = np.amin(factors, axis=1)
+    frngh = np.amax(factors, axis=1)
+    fstdv = np.std(factors, axis=1)
+
+    stats = np.stack((fmean, fmedn, frngl, frngh, fstdv), axis=1)
+    return factors, stats
+
 
 def compabun(fnamel, fnameh, fnamen, outdir='../results/01BART/'):
     """
@@ -29,33 +64,15 @@ def compabun(fnamel, fnameh, fnamen, outdir='../results/01BART/'):
     ---------
     2017-10-24      mhimes                  Added docstring.
     """
-    # Load the spectra
-    specl = np.loadtxt(fnamel)
-    specn = np.loadtxt(fnamen)
-    ninds = np.where(specl[:,1] != np.loadtxt(fnameh[0])[:,1])[0]
-
-    # For all the spectra, store the relation in an array
-    factors = np.zeros((len(fnameh), len(ninds)), dtype=float)
-    for i in range(len(fnameh)):
-        spech = np.loadtxt(fnameh[i])
-        # Find where the spectra with lines differ
-        inds = np.where(specl[:,1] != spech[:,1])
-        # Sum the channels in which the spectra differ
-        suml = np.sum(specl[inds])
-        sumh = np.sum(spech[inds])
-        sumn = np.sum(specn[inds])
-        # Compute the factor relation
-        factors[i] = ((specn[:,1][inds] - spech[:,1][inds]) / \
-                      (specn[:,1][inds] - specl[:,1][inds]))
+    # Load the fluxes of all spectra once
+    fluxl = specio.readspectrum(fnamel, 0)[1]
+    fluxn = specio.readspectrum(fnamen, 0)[1]
+    fluxh = np.array([specio.readspectrum(fname, 0)[1] for fname in fnameh])
 
-    # Stats on the factors:
-    fmean = np.mean(factors, axis=1)
-    fmedn = np.median(factors, axis=1)
-    frngl = np.amin(factors, axis=1)
-    frngh = np.amax(factors, axis=1)
-    fstdv = np.std(factors, axis=1)
+    # Channels where the spectra with lines differ
+    ninds = np.where(fluxl != fluxh[0])[0]
 
-    stats = np.stack((fmean, fmedn, frngl, frngh, fstdv), axis=1)
+    factors, stats = linefactors(fluxn, fluxl, fluxh, ninds)
 
     np.savetxt(outdir+'f05results.txt', stats, fmt='%.6e', \
                header='The following are the factor differences of line ' + \
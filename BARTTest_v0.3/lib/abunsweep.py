@@ -0,0 +1,174 @@
+#! /usr/bin/env python
+
+import sys, os
+import numpy as np
+import runtransit as runt
+import specio
+import abuncomp
+
+"""
+This file generalizes the abundance test (f05abundance) to a sweep over any
+number of abundances.
+
+From a template .trc and .atm file, it writes one atmosphere and one
+configuration per abundance, runs Transit on them in parallel, and computes
+the line-depth factors of each spectrum as it finishes, relative to the
+lowest abundance, with abuncomp.linefactors() (see abuncomp.py and
+tests/f05abundance/README). For a linear relation the factor equals the
+abundance ratio.
+
+Usage: ./abunsweep.py lowest highest number [ncpu]
+"""
+
+def writeatm(template, atmfile, species, abundance):
+    """
+    Writes a TEA-format atmospheric file with a uniform abundance of one
+    species. The other columns are those of the template.
+
+    Inputs
+    ------
+    template : string. Path/to/template atmospheric file.
+    atmfile  : string. Path/to/output atmospheric file.
+    species  : string. Name of the species, as in the #SPECIES line.
+    abundance: float.  Mixing fraction of the species in every layer.
+    """
+    with open(template, 'r') as foo:
+        lines = foo.readlines()
+
+    # Column of the species: after radius, pressure, and temperature
+    ispec = [i for i in range(len(lines))
+             if lines[i].strip() == '#SPECIES'][0]
+    icol  = 3 + lines[ispec + 1].split().index(species)
+    idata = [i for i in range(len(lines))
+             if lines[i].strip() == '#TEADATA'][0]
+
+    for i in range(idata + 1, len(lines)):
+        fields = lines[i].split()
+        if len(fields) == 0 or fields[0][0] == '#':
+            continue
+        fields[icol] = '{:.4e}'.format(abundance)
+        lines[i] = ' ' + ' '.join(fields) + '\n'
+
+    with open(atmfile, 'w') as foo:
+        foo.writelines(lines)
+
+
+def makevariants(abundances, species, testdir, template, outdir):
+    """
+    Writes the atmospheric and configuration files of each abundance.
+
+    Inputs
+    ------
+    abundances: 1D array. Abundances of `species`.
+    species   : string. Species whose abundance varies.
+    testdir   : string. Path/to/test directory, where Transit runs.
+    template  : string. Template .trc file, in `testdir`.
+    outdir    : string. Path/to/directory for the spectra.
+
+    Outputs
+    -------
+    trcfiles  : list of strings. Configuration file of each abundance,
+                                 relative to `testdir`.
+    """
+    args     = runt.readtrc(os.path.join(testdir, template))
+    atmtmpl  = os.path.join(testdir, args['atm'])
+    specdir  = os.path.relpath(outdir, testdir)
+    geometry = {'eclipse':'emission', 
+                'transit':'transmission'}[args.get('solution', 'eclipse')]
+    trcfiles = []
+    for abundance in abundances:
+        tag     = 'sweep_{:.4e}'.format(abundance)
+        atmfile = os.path.join(os.path.dirname(args['atm']), tag + '.atm')
+        trcfile = tag + '_' + geometry + '.trc'
+        writeatm(atmtmpl, os.path.join(testdir, atmfile), species, abundance)
+        runt.writetrc(os.path.join(testdir, template),
+                      os.path.join(testdir, trcfile),
+                      {'atm'    : atmfile,
+                       'outspec': os.path.join(specdir, os.path.splitext(
+                                               trcfile)[0] + '_spectrum.dat')})
+        trcfiles.append(trcfile)
+    return trcfiles
+
+
+def abunsweep(lowest, highest, num, logspace=False, species='LG1',
+              testdir='../tests/f05abundance/',
+              template='abundance_1e-4_emission.trc',
+              outdir='../code-output/01BART/f05abundance/sweep/',
+              outfile='../results/01BART/f05sweep.txt', ncpu=None):
+    """
+    Runs an abundance sweep and compares the line depths with the
+    abundances.
+
+    Inputs
+    ------
+    lowest  : float.  Lowest abundance, the reference of the factors. > 0.
+    highest : float.  Highest abundance.
+    num     : int.    Number of abundances, including `lowest`.
+    logspace: bool.   If True, space the abundances logarithmically.
+    species : string. Species whose abundance varies.
+    testdir : string. Path/to/test directory with the templates.
+    template: string. Template .trc file, in `testdir`.
+    outdir  : string. Path/to/directory for the spectra.
+    outfile : string. Path/to/file for the results.
+    ncpu    : int.    Maximum number of Transit runs at once.
+
+    Outputs
+    -------
+    results : 2D array. For each abundance above `lowest`: abundance,
+                        expected factor, and the mean, median, minimum,
+                        maximum, and standard deviation of the factors.
+    """
+    if lowest <= 0:
+        raise ValueError("The lowest abundance must be positive.")
+    if logspace:
+        abundances = np.logspace(np.log10(lowest), np.log10(highest), num)
+    else:
+        abundances = np.linspace(lowest, highest, num)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    trcfiles = makevariants(np.concatenate(([0.0], abundances)), species,
+                            testdir, template, outdir)
+    abun     = dict(zip(trcfiles, np.concatenate(([0.0], abundances))))
+
+    # Spectra without the line and of the lowest abundance
+    spectra = {}
+    for trcfile, outspec, code in runt.runtransit(trcfiles[:2], testdir,
+                                                  ncpu):
+        if code != 0:
+            raise RuntimeError("Transit failed on " + trcfile + ".")
+        spectra[trcfile] = specio.readspectrum(outspec, 0)[1]
+    fluxn = spectra[trcfiles[0]]
+    fluxl = spectra[trcfiles[1]]
+    # Channels where the line is present
+    ninds = np.where(fluxl != fluxn)[0]
+
+    # Factors of each spectrum, as it finishes
+    results = []
+    for trcfile, outspec, code in runt.runtransit(trcfiles[2:], testdir,
+                                                  ncpu):
+        if code != 0:
+            print("Transit failed on " + trcfile + ", skipping it.")
+            continue
+        fluxh = specio.readspectrum(outspec, 0)[1]
+        stats = abuncomp.linefactors(fluxn, fluxl, fluxh, ninds)[1][0]
+        results.append([abun[trcfile], abun[trcfile]/lowest] + list(stats))
+        print("  {:.4e}: expected {:.6f}, mean factor {:.6f}".format(
+              *results[-1][:3]))
+
+    results = np.array(sorted(results))
+    np.savetxt(outfile, results, fmt='%.6e',
+               header='Line-depth factors with respect to the ' +             \
+               '{:.4e} abundance spectrum:\n'.format(lowest) +                \
+               'Abundance \t Expected \t Mean \t\t Median \t\t Min \t\t ' +   \
+               'Max \t\t Standard deviation')
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: ./abunsweep.py lowest highest number [ncpu]")
+        sys.exit(1)
+    ncpu = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    abunsweep(float(sys.argv[1]), float(sys.argv[2]), int(sys.argv[3]),
+              ncpu=ncpu)
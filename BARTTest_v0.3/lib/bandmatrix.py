@@ -0,0 +1,100 @@
+import sys
+import numpy as np
+import scipy.sparse as sp
+sys.path.append('../../BART/code/')
+import wine
+import cache
+
+"""
+This file contains functions to band-integrate a spectrum over many filters
+at once. The filter responses, resampled onto the spectrum's wavenumber grid
+by wine.resample(), and the Simpson's-rule weights of wine.bandintegrate()
+are combined into one sparse matrix (nfilters, nwavenumbers). The
+band-integrated values of all filters are then a single matrix-vector
+product.
+"""
+
+def simpsweights(x):
+    """
+    Weights of the composite Simpson's rule on a grid, as computed by
+    scipy.integrate.simps (with even='avg' for an even number of points):
+    simps(y, x) equals np.sum(simpsweights(x) * y).
+
+    Inputs
+    ------
+    x: 1D array. Increasing sample positions.
+
+    Outputs
+    -------
+    w: 1D array. Weight of each sample.
+    """
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    w = np.zeros(n)
+    if n < 2:
+        return w
+    if n == 2:
+        return np.repeat(0.5 * (x[1] - x[0]), 2)
+    if n % 2 == 0:
+        # Average of Simpson's rule on the first n-1 points plus the
+        # trapezoid on the last interval, and the other way around
+        h0, h1 = x[1] - x[0], x[-1] - x[-2]
+        w[:-1] += 0.5 * simpsweights(x[:-1])
+        w[1:]  += 0.5 * simpsweights(x[1:])
+        w[[0, 1]]   += 0.25 * h0
+        w[[-2, -1]] += 0.25 * h1
+        return w
+    h    = np.diff(x)
+    h0   = h[0::2]
+    h1   = h[1::2]
+    hsum = h0 + h1
+    w[0:-1:2] += hsum / 6. * (2. - h1 / h0)
+    w[1::2]   += hsum / 6. * hsum**2 / (h0 * h1)
+    w[2::2]   += hsum / 6. * (2. - h0 / h1)
+    return w
+
+
+def filtermatrix(filters, specwn):
+    """
+    Builds the band-integration matrix of a set of filters.
+
+    Inputs
+    ------
+    filters: list, strings. Paths/to/filter files.
+    specwn : 1D array. Wavenumber grid of the spectra to integrate.
+
+    Outputs
+    -------
+    matrix : sparse matrix. Shape (len(filters), len(specwn)).
+                            matrix.dot(spectrum)[i] equals
+                            wine.bandintegrate() of `spectrum` over filter i.
+    meanwn : 1D array. Mean wavenumber of each filter.
+    """
+    # The normalized filters do not depend on the stellar spectrum, which
+    # wine.resample() only interpolates; a flat one is passed
+    flat = np.ones(len(specwn))
+    rows, cols, vals = [], [], []
+    meanwn = np.zeros(len(filters))
+    for i in range(len(filters)):
+        filtwn, filttransm   = wine.readfilter(filters[i])
+        meanwn[i]            = np.mean(filtwn)
+        nifilt, rsSED, wnind = wine.resample(specwn, filtwn, filttransm,
+                                             specwn, flat)
+        # bandintegrate() is linear in the spectrum: the weight of each
+        # wavenumber is the filter times its Simpson's-rule weight
+        idx = np.arange(len(specwn))[wnind]
+        rows.append(np.repeat(i, len(idx)))
+        cols.append(idx)
+        vals.append(nifilt * simpsweights(specwn[idx]))
+    matrix = sp.csr_matrix((np.concatenate(vals),
+                           (np.concatenate(rows), np.concatenate(cols))),
+                           shape=(len(filters), len(specwn)))
+    return matrix, meanwn
+
+
+def cachedmatrix(filters, specwn):
+    """
+    filtermatrix(), reusing the matrix stored in the cache (see cache.py) for
+    the same filter files and grid.
+    """
+    return cache.call(filtermatrix, filters, list(filters), specwn)
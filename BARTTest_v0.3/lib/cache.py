@@ -0,0 +1,299 @@
+import sys, os
+import json
+import fcntl
+import contextlib
+import hashlib
+import inspect
+import tempfile
+import numpy as np
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+"""
+This file contains an on-disk cache for the results of expensive
+post-processing stages, such as credible regions, effective sample sizes,
+and PT-profile bands.
+
+A result is keyed by a hash of the function (name and source file), the
+source files of the project modules that the function's module imports,
+directly or through other project modules, the input files (size,
+modification time, and content digest), and the function's arguments.
+Changing any of them gives a new key. Changes outside of the project, such
+as a new numpy version, do not; clear the cache directory after them. The
+cache is bounded in size; the least recently used results are evicted first.
+
+The default cache directory is BARTTest_v0.3/cache/, or the BARTTEST_CACHE
+environment variable if set.
+
+Example
+-------
+import cache
+CRlo, CRhi = cache.call(credregions, [outputfile], posterior, percentile)
+"""
+
+CACHEDIR = os.environ.get('BARTTEST_CACHE',
+                          os.path.join(os.path.dirname(os.path.abspath(
+                                       __file__)), '..', 'cache'))
+# Modules under this directory are part of the project: BARTTest, its
+# scripts, and BART
+PROJECTDIR = os.path.dirname(os.path.dirname(os.path.dirname(
+                             os.path.abspath(__file__))))
+
+
+def _source(module):
+    # Source file of a project module, else None
+    fname = getattr(module, '__file__', None)
+    if fname is None:
+        return None
+    fname = os.path.abspath(fname)
+    if fname.endswith(('.pyc', '.pyo')):
+        fname = fname[:-1]
+    if not fname.endswith('.py') or not os.path.isfile(fname) or             \
+       not fname.startswith(os.path.join(PROJECTDIR, '')) or                  \
+       'site-packages' in fname:
+        return None
+    return fname
+
+
+def sources(module):
+    """
+    Source files of a module and of the project modules that it uses,
+    directly or through other project modules: the modules it imports, and
+    the modules of the functions and classes it imports from them.
+
+    Inputs
+    ------
+    module: module.
+
+    Outputs
+    -------
+    files : list of strings. Sorted paths/to/source files.
+    """
+    files = {}
+    stack = [module]
+    while len(stack) > 0:
+        module = stack.pop()
+        fname  = _source(module)
+        if fname is None or fname in files:
+            continue
+        files[fname] = module
+        for obj in list(vars(module).values()):
+            if not inspect.ismodule(obj):
+                name = getattr(obj, '__module__', None)
+                obj  = sys.modules.get(name) if isinstance(name, str) else None
+            if obj is not None:
+                stack.append(obj)
+    return sorted(files)
+
+
+def digest(obj, h=None):
+    """
+    Hashes (nested) function arguments. Arrays are hashed by their contents.
+
+    Inputs
+    ------
+    obj: object. Arrays, numbers, strings, None, and lists, tuples, and
+                 dicts of them.
+    h  : hashlib object. Hash to update. If None, a new one is made.
+
+    Outputs
+    -------
+    h  : hashlib object.
+    """
+    if h is None:
+        h = hashlib.sha1()
+    if isinstance(obj, np.ndarray):
+        h.update(('ndarray' + str(obj.dtype) + str(obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple)):
+        h.update((type(obj).__name__ + str(len(obj))).encode())
+        for item in obj:
+            digest(item, h)
+    elif isinstance(obj, dict):
+        h.update(('dict' + str(len(obj))).encode())
+        for key in sorted(obj, key=repr):
+            digest(key, h)
+            digest(obj[key], h)
+    else:
+        h.update((type(obj).__name__ + repr(obj)).encode())
+    return h
+
+
+class Cache(object):
+    """
+    Size-bounded, content-addressed store of pickled results.
+    """
+    def __init__(self, directory=CACHEDIR, maxsize=2**30):
+        """
+        Inputs
+        ------
+        directory: string. Path/to/directory of the cache.
+        maxsize  : int.    Maximum total size of the stored results (bytes).
+        """
+        self.directory = os.path.abspath(directory)
+        self.maxsize   = maxsize
+        self.indexfile = os.path.join(self.directory, 'files.json')
+        self.lockfile  = os.path.join(self.directory, 'files.lock')
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # Made by another process
+                pass
+
+    def _readindex(self):
+        try:
+            with open(self.indexfile, 'r') as foo:
+                return json.load(foo)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    @contextlib.contextmanager
+    def _lock(self):
+        # Exclusive lock of the index and the stored results, held across
+        # processes sharing the cache
+        with open(self.lockfile, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self, fname, data, mode='wb'):
+        # Write to a temporary file and rename it, so that readers never see
+        # a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, mode) as foo:
+            foo.write(data)
+        os.rename(tmp, fname)
+
+    def filekey(self, fname):
+        """
+        Content digest of a file. The digest is remembered along with the
+        file's size and modification time, so that an unchanged file is not
+        read again.
+
+        Inputs
+        ------
+        fname: string. Path/to/file.
+
+        Outputs
+        -------
+        key  : string. Hex digest of the file contents.
+        """
+        fname = os.path.abspath(fname)
+        stat  = os.stat(fname)
+        index = self._readindex()
+        entry = index.get(fname)
+        if entry is not None and entry[0] == stat.st_size                     \
+                             and entry[1] == stat.st_mtime:
+            return entry[2]
+
+        h = hashlib.sha1()
+        with open(fname, 'rb') as foo:
+            for block in iter(lambda: foo.read(2**20), b''):
+                h.update(block)
+        key = h.hexdigest()
+
+        # Other processes may have updated the index meanwhile
+        with self._lock():
+            index = self._readindex()
+            index[fname] = [stat.st_size, stat.st_mtime, key]
+            self._write(self.indexfile, json.dumps(index), 'w')
+        return key
+
+    def key(self, func, files, args, kwargs):
+        """
+        Key of the result of func(*args, **kwargs) with input files `files`.
+        """
+        h = hashlib.sha1()
+        h.update((func.__module__ + '.' + func.__name__).encode())
+        # Changes to the function's module, or to the project modules it
+        # uses, invalidate its results
+        module = sys.modules[func.__module__]
+        source = sources(module)
+        if len(source) == 0:
+            # Not a project module
+            source = module.__file__
+            if source.endswith(('.pyc', '.pyo')):
+                source = source[:-1]
+            source = [source]
+        for fname in source + list(files):
+            h.update(self.filekey(fname).encode())
+        digest((args, kwargs), h)
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Returns (True, result) if `key` is stored, else (False, None).
+        """
+        fname = os.path.join(self.directory, key + '.pkl')
+        try:
+            with open(fname, 'rb') as foo:
+                result = pickle.load(foo)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        # Mark as recently used
+        os.utime(fname, None)
+        return True, result
+
+    def put(self, key, result):
+        """
+        Stores `result` under `key`, and evicts the least recently used
+        results if the cache is over its size.
+        """
+        self._write(os.path.join(self.directory, key + '.pkl'),
+                    pickle.dumps(result, protocol=2))
+        with self._lock():
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used results until the cache is within
+        its size. Called with the lock held (see put()).
+        """
+        entries = []
+        for fname in os.listdir(self.directory):
+            if fname.endswith('.pkl'):
+                path = os.path.join(self.directory, fname)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum([entry[1] for entry in entries])
+        for mtime, size, path in sorted(entries):
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def call(self, func, files, *args, **kwargs):
+        """
+        Returns func(*args, **kwargs), from the cache if it was computed
+        before with the same function, input files, and arguments.
+
+        Inputs
+        ------
+        func : function. Function to call. Its result must be picklable.
+        files: list of strings. Path/to/files that the result depends on.
+        args, kwargs: arguments of `func`.
+        """
+        key = self.key(func, files, args, kwargs)
+        found, result = self.get(key)
+        if not found:
+            result = func(*args, **kwargs)
+            self.put(key, result)
+        return result
+
+
+def call(func, files, *args, **kwargs):
+    """
+    Cache.call() with the default cache.
+    """
+    return Cache().call(func, files, *args, **kwargs)
@@ -1,15 +1,64 @@
 #! /usr/bin/env python
 
-import sys
+import sys, os
+import json
 import numpy as np
-import scipy.interpolate as si
+import plotjobs
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
 from matplotlib.ticker import FormatStrFormatter
 sys.path.append("../../BART/modules/transit/scripts/")
-import readtransit as rt
+import specio
+import speccompare as sc
+import decimate as dm
 
-plt.ion()
+
+def codename(fname):
+    """
+    Name of the code that produced a spectrum file, from its directory in 
+    code-output/, e.g., 'BART' for ../code-output/01BART/.
+    """
+    dirs = fname.split('/')
+    return dirs[dirs.index('code-output')+1][2:]
+
+
+def specname(fspec1, fspec2, outname):
+    """
+    File name of the plot made by compspec(): `outname` preceded by the code 
+    names of `fspec1` and `fspec2`.
+    """
+    return codename(fspec1) + '_' + codename(fspec2) + '_' + outname
+
+
+def compnames(transit, rhd, geo, atm):
+    """
+    Title and file name of the plot made by comparison().
+
+    Inputs
+    ------
+    transit: string. path/to/file for transit spectrum data.
+    rhd    : string. path/to/file for RHD (or other RT code) spectrum data.
+    geo    : string. Viewing geometry. 'eclipse' or 'transit'
+    atm    : string. Atmosphere's PT profile. 'iso', 'inv', or 'noi'
+
+    Outputs
+    -------
+    titlenm: string. Plot title.
+    filenm : string. Plot file name, preceded by the code names.
+    """
+    geonm = {'transit':'Transmission', 'eclipse':'Emission'}
+    atmnm = {'inv':('inverted',     'inverted'), 
+             'iso':('Isothermal',   'Isothermal'), 
+             'noi':('Non-inverted', 'noninverted')}
+    if geo not in geonm:
+        raise ValueError("Wrong `geo` specification. Use 'transit' or " +
+                         "'eclipse'.")
+    if atm not in atmnm:
+        raise ValueError("Wrong `atm` specification. Use 'inv', 'iso', or " +
+                         "'noi'.")
+    titlenm = atmnm[atm][0] + ' ' + geonm[geo]
+    filenm  = atmnm[atm][1] + '_' + geonm[geo].lower() + '_comp.png'
+    return titlenm, specname(transit, rhd, filenm)
 
 
 def compspec(fspec1, fspec2, outname, outdir='../results/plots/', 
@@ -24,21 +73,23 @@ def compspec(fspec1, fspec2, outname, outdir='../results/plots/',
     fspec2 : string. Path to spectrum text file.
     outname: string. Savename of plot. The code names for `fspec1` and `fspec2` 
                      will be added to the beginning of this.
+
+    Outputs
+    -------
+    stats  : dict. Residual statistics, see speccompare.residuals().
+             `fspec2` is rebinned onto the grid of `fspec1` if they differ.
     """
     # Load spectra
-    wlength1, flux1 = rt.readspectrum(fspec1, 0)
-    wlength2, flux2 = rt.readspectrum(fspec2, 0)
+    wlength1, flux1 = specio.readspectrum(fspec1, 0)
+    wlength2, flux2 = specio.readspectrum(fspec2, 0)
 
     # Add code names to `outname`
-    cname1  = fspec1.split('/')
-    cname1  = cname1[cname1.index('code-output')+1][2:]
-    cname2  = fspec2.split('/')
-    cname2  = cname2[cname2.index('code-output')+1][2:]
-    outname = cname1 + '_' + cname2 + '_' + outname
+    cname1  = codename(fspec1)
+    cname2  = codename(fspec2)
+    outname = specname(fspec1, fspec2, outname)
 
     # Make plot
-    fig0 = plt.figure(0, (8,5))
-    plt.clf()
+    fig0 = plt.figure(figsize=(8,5))
     frame1 = fig0.add_axes((.14, .3, .8, .65))
 
     plt.xlabel(u"Wavelength  (\u03bcm)")
@@ -49,8 +100,8 @@ def compspec(fspec1, fspec2, outname, outdir='../results/plots/',
 
     frame1.set_xticklabels([])
     frame1.yaxis.set_label_coords(-0.1, 0.5)
-    plt.plot(wlength1, flux1, label=cname1)
-    plt.plot(wlength2, flux2, label=cname2)
+    dm.plot(wlength1, flux1, label=cname1)
+    dm.plot(wlength2, flux2, label=cname2)
     yticks = frame1.yaxis.get_major_ticks()
     yticks[0].label1.set_visible(False)
     plt.legend(loc='best')
@@ -58,20 +109,16 @@ def compspec(fspec1, fspec2, outname, outdir='../results/plots/',
     frame2 = fig0.add_axes((.14, .1, .8, .2))
     
     # Residuals, in units of %
-    if np.all(wlength1!=wlength2):
-        print("Wavelength arrays do not match.")
-        print("Interpolating " + fspec2 + " to the grid of " + fspec1)
-        fint  = si.interp1d(wlength2, flux2, bounds_error=False, fill_value=0)
-        flux2 = fint(wlength1)
-    resid = (flux1 - flux2) / np.max(np.concatenate((flux1, flux2))) * 100
-
-    plt.plot(wlength1, resid, "k", linestyle = ":")
+    flux2 = sc.resample(wlength2, flux2, wlength1)
+    resid, stats = sc.residuals(wlength1, flux1, flux2)
+    dm.plot(wlength1, resid, "k", linestyle = ":")
     plt.ylabel('Residuals (%)')
     plt.xlabel(u"Wavelength  (\u00b5m)")
     frame2.yaxis.set_major_locator(MaxNLocator(nbins = '5', prune='upper'))
 
     plt.savefig(outdir+outname)
     plt.close()
+    return stats
 
 
 def comparison(transit, rhd, geo, atm, outdir=None, titles=False):
@@ -88,83 +135,31 @@ def comparison(transit, rhd, geo, atm, outdir=None, titles=False):
     outdir : string. path/to/output. Default is execution directory
     titles : bool.   Determines whether to include titles on plots or not.
 
+    Outputs
+    -------
+    stats  : dict.   Residual statistics, see speccompare.residuals().
+
     Revisions
     ---------
     2017-10-16  mhimes          Initial implementation.
     2018-02-03  raechel         Improved plotting, added residuals subplot.
     2019-04-01  mhimes          Merged into BARTTest.
     """
-    # Load transit data
-    wlength, flux = rt.readspectrum(transit, 0)
-
-    # Load RHD data
-    data  = open(rhd, "r")
-    lines = data.readlines()
-
-    if geo == 'eclipse':
-        lines = lines[3:]
-        
-        wlengthb = np.zeros(len(lines), dtype=float)
-        fluxb    = np.zeros(len(lines), dtype=float)
-        
-        for i in range(len(lines)):
-            line = lines[i].split()
-            wlengthb[i] = float(line[1])
-            fluxb[i]    = float(line[2]) * 2.998e10
-    elif geo == 'transit':
-        lines = lines[3:]
-        
-        wlengthb = np.zeros(len(lines), dtype=float)
-        fluxb    = np.zeros(len(lines), dtype=float)
-        
-        for i in range(len(lines)):
-            line = lines[i].split()
-            wlengthb[i] = float(line[1])
-            fluxb[i]    = float(line[2]) / 100
-
-    # Resample code1 to code2's sampling
-    # Use a linear interpolation! Splines can cause values smaller/bigger than 
-    # the known mix and max values
-    rep    = si.interp1d(wlength, flux)
-    resamp = rep(wlengthb)
+    # Load both spectra, and rebin the high-resolution Transit spectrum onto
+    # the RHD grid, averaging it over each RHD bin
+    comp     = sc.compare(transit, rhd, geo)
+    wlength  = comp['wlength']
+    flux     = comp['flux']
+    wlengthb = comp['wlengthb']
+    fluxb    = comp['fluxb']
+    resamp   = comp['resamp']
     # Set plot title and file output name
-    if geo == 'transit':
-        if atm == 'inv':
-            titlenm = "inverted Transmission"
-            filenm  = "inverted_transmission_comp.png"
-        elif atm == 'iso':
-            titlenm = "Isothermal Transmission"
-            filenm  = "Isothermal_transmission_comp.png"
-        elif atm == 'noi':
-            titlenm = "Non-inverted Transmission"
-            filenm  = "noninverted_transmission_comp.png"
-        else:
-            print("Wrong `atm` specification. Use 'inv', 'iso', or 'noi'.\n")
-    elif geo == 'eclipse':
-        if atm == 'inv':
-            titlenm = "inverted Emission"
-            filenm  = "inverted_emission_comp.png"
-        elif atm == 'iso':
-            titlenm = "Isothermal Emission"
-            filenm  = "Isothermal_emission_comp.png"
-        elif atm == 'noi':
-            titlenm = "Non-inverted Emission"
-            filenm  = "noninverted_emission_comp.png"
-        else:
-            print("Wrong `atm` specification. Use 'inv', 'iso', or 'noi'.\n")
-    else:
-        print("Wrong `geo` specification. Use 'transit' or 'eclipse'.\n")
-        sys.exit()
-    # Add code names to `filenm`
-    cname1 = transit.split('/')
-    cname1 = cname1[cname1.index('code-output')+1][2:]
-    cname2 = rhd.split('/')
-    cname2 = cname2[cname2.index('code-output')+1][2:]
-    filenm = cname1 + '_' + cname2 + '_' + filenm
+    titlenm, filenm = compnames(transit, rhd, geo, atm)
+    cname1 = codename(transit)
+    cname2 = codename(rhd)
     
     # Plot it
-    fig0 = plt.figure(0, (8,5))
-    plt.clf()
+    fig0 = plt.figure(figsize=(8,5))
     frame1 = fig0.add_axes((.14, .3, .8, .65))
     if titles==True:
         plt.title(titlenm)
@@ -175,23 +170,24 @@ def comparison(transit, rhd, geo, atm, outdir=None, titles=False):
         resamp = 100*resamp
     if geo == 'eclipse':
         if atm == 'iso':
-            plt.plot(wlength,  flux,   "lightblue", 
-                     label=cname1 + ' - high resolution', linewidth = 10.0)
-            plt.plot(wlengthb, resamp, "royalblue", 
-                     label=cname1 + ' - resampled to ' + cname2)
-            plt.plot(wlengthb, fluxb,  "firebrick", label=cname2)
+            dm.plot(wlength,  flux,   "lightblue", 
+                    label=cname1 + ' - high resolution', linewidth = 10.0, 
+                    xscale='log')
+            dm.plot(wlengthb, resamp, "royalblue", 
+                    label=cname1 + ' - resampled to ' + cname2, xscale='log')
+            dm.plot(wlengthb, fluxb,  "firebrick", label=cname2, xscale='log')
         else:
-            plt.plot(wlength,  flux,   "lightblue", 
-                     label=cname1 + ' - high resolution')
-            plt.plot(wlengthb, resamp, "royalblue", 
-                     label=cname1 + ' - resampled to ' + cname2)
-            plt.plot(wlengthb, fluxb,  "firebrick", label=cname2)
+            dm.plot(wlength,  flux,   "lightblue", 
+                    label=cname1 + ' - high resolution', xscale='log')
+            dm.plot(wlengthb, resamp, "royalblue", 
+                    label=cname1 + ' - resampled to ' + cname2, xscale='log')
+            dm.plot(wlengthb, fluxb,  "firebrick", label=cname2, xscale='log')
     else:
-        plt.plot(wlength,  flux,   "lightblue", 
-                 label=cname1 + ' - high resolution')
-        plt.plot(wlengthb, resamp, "royalblue", 
-                 label=cname1 + ' - resampled to ' + cname2)
-        plt.plot(wlengthb, fluxb,  "firebrick", label=cname2)
+        dm.plot(wlength,  flux,   "lightblue", 
+                label=cname1 + ' - high resolution', xscale='log')
+        dm.plot(wlengthb, resamp, "royalblue", 
+                label=cname1 + ' - resampled to ' + cname2, xscale='log')
+        dm.plot(wlengthb, fluxb,  "firebrick", label=cname2, xscale='log')
 
 
     plt.xlabel(u"Wavelength  (\u03bcm)")
@@ -234,13 +230,13 @@ def comparison(transit, rhd, geo, atm, outdir=None, titles=False):
     if geo == 'eclipse':
         frame1.set_ylim(0, max(Bb2)+5000)
         if T1 != T2:
-            plt.plot(l, Bb1, "r", linestyle =':', 
-                     label="Blackbody at "+T1s, linewidth = 2.0)
-            plt.plot(l, Bb2, "b"        , linestyle =':', 
-                     label="Blackbody at "+T2s, linewidth = 2.0)
+            dm.plot(l, Bb1, "r", linestyle =':', 
+                    label="Blackbody at "+T1s, linewidth = 2.0, xscale='log')
+            dm.plot(l, Bb2, "b"        , linestyle =':', 
+                    label="Blackbody at "+T2s, linewidth = 2.0, xscale='log')
         else:
-            plt.plot(l, Bb1, "k"        , linestyle =':', 
-                     label="Blackbody at "+T2s, linewidth = 2.0)
+            dm.plot(l, Bb1, "k"        , linestyle =':', 
+                    label="Blackbody at "+T2s, linewidth = 2.0, xscale='log')
         plt.legend(loc='upper left', prop={'size':8})
     elif geo == 'transit':
         plt.legend(loc='lower right', prop={'size':8})
@@ -259,20 +255,17 @@ def comparison(transit, rhd, geo, atm, outdir=None, titles=False):
 
     frame2 = fig0.add_axes((.14, .1, .8, .2))
     
-    #residual plots
-    resid = np.zeros(len(lines), dtype=float)
-    # Residuals, in units of %
-    resid = (resamp - fluxb) / np.max(np.concatenate((resamp, fluxb))) * 100
-
-    plt.plot(wlengthb, resid, "k", linestyle = ":")
+    #residual plots, in units of %
+    resid = comp['resid']
+    dm.plot(wlengthb, resid, "k", linestyle = ":", xscale='log')
     plt.ylabel('Residuals (%)')
     plt.xlabel(u"Wavelength  (\u00b5m)")
 
     frame2.set_xscale('log')
     frame2.set_xlim(0, 11.0)
 
-    frame2.set_ylim(np.amin(resid) - 0.2*np.abs(np.amin(resid)), 
-                    np.amax(resid) + 0.2*np.abs(np.amax(resid)))
+    frame2.set_ylim(np.nanmin(resid) - 0.2*np.abs(np.nanmin(resid)), 
+                    np.nanmax(resid) + 0.2*np.abs(np.nanmax(resid)))
     
     frame2.set_xticklabels([1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11])
     frame2.yaxis.set_major_locator(MaxNLocator(nbins = '5', prune='upper'))
@@ -289,80 +282,85 @@ def comparison(transit, rhd, geo, atm, outdir=None, titles=False):
         frame3.set_xlim(3.5, 6.5)
         frame3.set_xticklabels([4, 4.5, 5, 5.5, 6])
         frame3.xaxis.set_major_locator(plt.MultipleLocator(1))
-        plt.plot(wlength,  flux,   "lightblue", linewidth = 10.0)
-        plt.plot(wlengthb, resamp, "royalblue", linewidth = 2.0)
-        plt.plot(wlengthb, fluxb,  "firebrick", linewidth = 2.0)
-        plt.plot(l, Bb1, "k", linestyle = ':',  linewidth = 4.0)
+        dm.plot(wlength,  flux,   "lightblue", linewidth = 10.0, 
+                xlim=(3.5, 6.5), xscale='log')
+        dm.plot(wlengthb, resamp, "royalblue", linewidth = 2.0, 
+                xlim=(3.5, 6.5), xscale='log')
+        dm.plot(wlengthb, fluxb,  "firebrick", linewidth = 2.0, 
+                xlim=(3.5, 6.5), xscale='log')
+        dm.plot(l, Bb1, "k", linestyle = ':',  linewidth = 4.0, 
+                xlim=(3.5, 6.5), xscale='log')
 
     if outdir!=None:
         plt.savefig(outdir+filenm)
     else:
         plt.savefig(filenm)
     plt.close()
+    return comp['stats']
 
 
-if __name__ == "__main__":
+def jobs(outdir='../results/plots/'):
     """
-    Produce the plots using the above function
+    Lists the plots of the forward (f##) and comparison (c##) tests as plot 
+    jobs (see plotjobs.py).
     """
+    job     = plotjobs.job
+    joblist = []
+
     # f01 -- f06, no f05
-    compspec('../code-output/00miniRT/f01oneline/oneline.dat', 
-             '../code-output/01BART/f01oneline/oneline_emission_spectrum.dat', 
-             'oneline_emission.png')
-
-    compspec('../code-output/00miniRT/f02fewline/fewline.dat', 
-             '../code-output/01BART/f02fewline/fewline_emission_spectrum.dat', 
-             'fewline_emission.png')
-
-    compspec('../code-output/00miniRT/f03multiline/multiline.dat', 
-             '../code-output/01BART/f03multiline/' + \
-                                      'multiline_emission_spectrum.dat', 
-             'multiline_emission.png')
-
-    compspec('../code-output/00miniRT/f04broadening/broadening.dat', 
-             '../code-output/01BART/f04broadening/' + \
-                                      'broadening_emission_spectrum.dat', 
-             'broadening_emission.png')
-
-    compspec('../code-output/00miniRT/f06blending/blending.dat', 
-             '../code-output/01BART/f06blending/' + \
-                                      'blending_emission_spectrum.dat', 
-             'blending_emission.png')
+    for test, name in [('f01oneline',    'oneline'), 
+                       ('f02fewline',    'fewline'), 
+                       ('f03multiline',  'multiline'), 
+                       ('f04broadening', 'broadening'), 
+                       ('f06blending',   'blending')]:
+        fspec1  = '../code-output/00miniRT/' + test + '/' + name + '.dat'
+        fspec2  = '../code-output/01BART/'   + test + '/' + name +            \
+                  '_emission_spectrum.dat'
+        outname = name + '_emission.png'
+        joblist.append(job('comparison.compspec', [fspec1, fspec2], 
+                           outdir + specname(fspec1, fspec2, outname), 
+                           fspec1, fspec2, outname, outdir))
+
     # c01 -- c03
-    comparison('../code-output/01BART/c03hjclearinv/' + \
-             'inv_emission_spectrum.dat', 
-             '../code-output/02DDART/full_inv_emission.dat', 
-             'eclipse', 'inv', 
-             '../results/plots/')
-
-    comparison('../code-output/01BART/c01hjcleariso/' + \
-             'iso_emission_spectrum.dat', 
-             '../code-output/02DDART/full_iso_emission.dat', 
-             'eclipse', 'iso', 
-             '../results/plots/')
-
-    comparison('../code-output/01BART/c02hjclearnoinv/' + \
-             'noinv_emission_spectrum.dat', 
-             '../code-output/02DDART/full_noinv_emission.dat', 
-             'eclipse', 'noi', 
-             '../results/plots/')
-
-    comparison('../code-output/01BART/c03hjclearinv/' + \
-             'inv_transmission_spectrum.dat', 
-             '../code-output/02DDART/full_inv_transit.dat', 
-             'transit', 'inv', 
-             '../results/plots/')
-
-    comparison('../code-output/01BART/c01hjcleariso/' + \
-             'iso_transmission_spectrum.dat', 
-             '../code-output/02DDART/full_iso_transit.dat', 
-             'transit', 'iso', 
-             '../results/plots/')
-
-    comparison('../code-output/01BART/c02hjclearnoinv/' + \
-             'noinv_transmission_spectrum.dat', 
-             '../code-output/02DDART/full_noinv_transit.dat', 
-             'transit', 'noi', 
-             '../results/plots/')
+    for test, atm, name in [('c03hjclearinv',   'inv', 'inv'), 
+                            ('c01hjcleariso',   'iso', 'iso'), 
+                            ('c02hjclearnoinv', 'noi', 'noinv')]:
+        for geo, spec, ddart in [('eclipse', 'emission',     'emission'), 
+                                 ('transit', 'transmission', 'transit')]:
+            transit = '../code-output/01BART/' + test + '/' + name + '_' +    \
+                      spec + '_spectrum.dat'
+            rhd     = '../code-output/02DDART/full_' + name + '_' + ddart +   \
+                      '.dat'
+            filenm  = compnames(transit, rhd, geo, atm)[1]
+            joblist.append(job('comparison.comparison', [transit, rhd], 
+                               outdir + filenm, 
+                               transit, rhd, geo, atm, outdir))
+    return joblist
+
+
+def summary(joblist):
+    """
+    Prints the residual statistics saved by the plot jobs (see
+    plotjobs.datafile()): the maximum absolute and RMS residuals (%) of each
+    comparison.
+    """
+    print("  Max (%)    RMS (%)    Comparison")
+    for jb in joblist:
+        try:
+            with open(plotjobs.datafile(jb), 'r') as foo:
+                stats = json.load(foo)
+        except (IOError, OSError, ValueError):
+            continue
+        print("  {:<10.4f} {:<10.4f} ".format(stats['max'], stats['rms']) +
+              os.path.basename(jb['output']))
 
 
+if __name__ == "__main__":
+    """
+    Produce the plots using the above functions
+    """
+    joblist = jobs()
+    results = plotjobs.runjobs(joblist)
+    nfail   = plotjobs.report(results)
+    summary(joblist)
+    sys.exit(int(nfail > 0))
@@ -0,0 +1,169 @@
+import numpy as np
+import matplotlib.pyplot as plt
+
+"""
+This file reduces the number of points of a curve to what a plot can show,
+before it is drawn.
+
+A spectrum at Transit's resolution has tens of thousands of points, while an
+axes is a few hundred pixels wide. minmax() keeps, for each pixel column,
+the lowest and highest point, so the drawn envelope (lines, line cores, and
+noise) is the same as with every point. lttb() keeps one point per bucket
+with the Largest-Triangle-Three-Buckets algorithm, which preserves the shape
+of smooth curves with fewer points.
+
+plot() is a drop-in replacement for plt.plot() that decimates to the width
+of the axes, in pixels at the figure's DPI, so the time to draw a curve does
+not grow with its number of points.
+"""
+
+def npixels(ax=None):
+    """
+    Width of an axes in pixels, at the DPI of its figure.
+    """
+    if ax is None:
+        ax = plt.gca()
+    return max(int(np.ceil(ax.bbox.width)), 1)
+
+
+def _coords(x, xscale):
+    # Horizontal positions on the axes, up to a linear transform
+    if xscale == 'log':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.log10(x)
+    return x
+
+
+def minmax(u, y, ncols):
+    """
+    Indices of the lowest and highest point of each of `ncols` columns of
+    equal width in `u`, and of the first and last points, in their original
+    order.
+
+    Inputs
+    ------
+    u    : 1D array. Horizontal positions.
+    y    : 1D array. Values.
+    ncols: int. Number of columns.
+
+    Outputs
+    -------
+    idx  : 1D array. Sorted indices of the points kept.
+    """
+    umin, umax = np.amin(u), np.amax(u)
+    if umax == umin:
+        col = np.zeros(len(u), dtype=int)
+    else:
+        col = np.clip(((u - umin) / (umax - umin) * ncols).astype(int),
+                      0, ncols - 1)
+    # Sorted by column, then by value: the first and last entries of each
+    # column are its minimum and maximum
+    order  = np.lexsort((y, col))
+    scol   = col[order]
+    starts = np.concatenate(([0], np.where(np.diff(scol) != 0)[0] + 1))
+    ends   = np.concatenate((starts[1:], [len(order)])) - 1
+    return np.unique(np.concatenate(([0, len(u) - 1], order[starts],
+                                     order[ends])))
+
+
+def lttb(u, y, nout):
+    """
+    Indices of the points kept by the Largest-Triangle-Three-Buckets
+    algorithm (Steinarsson 2013): the first and last points, and in each of
+    `nout` - 2 buckets of consecutive points, the point forming the largest
+    triangle with the previously kept point and the mean of the next bucket.
+
+    Inputs
+    ------
+    u   : 1D array. Horizontal positions.
+    y   : 1D array. Values.
+    nout: int. Number of points to keep.
+
+    Outputs
+    -------
+    idx : 1D array. Sorted indices of the points kept.
+    """
+    n = len(u)
+    if nout >= n or nout < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, nout - 1).astype(int)
+    idx   = np.zeros(nout, dtype=int)
+    idx[-1] = n - 1
+    a = 0
+    for i in range(nout - 2):
+        lo, hi = edges[i], max(edges[i+1], edges[i] + 1)
+        if i + 2 < len(edges):
+            uavg = np.mean(u[edges[i+1]:edges[i+2]])
+            yavg = np.mean(y[edges[i+1]:edges[i+2]])
+        else:
+            uavg, yavg = u[-1], y[-1]
+        area = np.abs((u[a] - uavg) * (y[lo:hi] - y[a]) -
+                      (u[a] - u[lo:hi]) * (yavg - y[a]))
+        a = lo + np.argmax(area)
+        idx[i+1] = a
+    return idx
+
+
+def decimate(x, y, npix, method='minmax', xlim=None, xscale='linear'):
+    """
+    Reduces a curve to the points that can be seen on an axes `npix` pixels
+    wide.
+
+    Inputs
+    ------
+    x     : 1D array. Abscissas, in increasing or decreasing order.
+    y     : 1D array. Ordinates.
+    npix  : int.    Width of the axes in pixels.
+    method: string. 'minmax' (lowest and highest point per pixel column) or
+                    'lttb' (2*`npix` points, see lttb()).
+    xlim  : tuple.  (xmin, xmax) shown on the axes. Points outside of it,
+                    except their neighbors, are dropped. Default is all.
+    xscale: string. Scale of the x axis, 'linear' or 'log'.
+
+    Outputs
+    -------
+    x, y  : 1D arrays. Decimated curve. Non-finite values are dropped.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    keep = np.isfinite(x) & np.isfinite(y)
+    if xlim is not None:
+        within = keep & (x >= min(xlim)) & (x <= max(xlim))
+        # Keep the neighbors, so that the curve reaches the edges
+        inside = within.copy()
+        inside[1:]  |= within[:-1]
+        inside[:-1] |= within[1:]
+        keep &= inside
+    x, y = x[keep], y[keep]
+    if len(x) <= 2 * npix:
+        return x, y
+
+    u = _coords(x, xscale)
+    if method == 'minmax':
+        idx = minmax(u, y, npix)
+    elif method == 'lttb':
+        idx = lttb(u, y, 2 * npix)
+    else:
+        raise ValueError("Unknown method '" + str(method) + "'. Use " +
+                         "'minmax' or 'lttb'.")
+    return x[idx], y[idx]
+
+
+def plot(x, y, *args, **kwargs):
+    """
+    Same as plt.plot(x, y, ...), decimating the curve to the width of the
+    axes first (see decimate()).
+
+    Extra keyword arguments
+    -----------------------
+    ax    : Axes to plot on. Default is the current one.
+    method: string. Decimation method, 'minmax' or 'lttb'.
+    xlim  : tuple.  X range that will be shown, if narrower than the data.
+    xscale: string. Scale the x axis will have. Default is its current one.
+    """
+    ax     = kwargs.pop('ax',     None) or plt.gca()
+    method = kwargs.pop('method', 'minmax')
+    xlim   = kwargs.pop('xlim',   None)
+    xscale = kwargs.pop('xscale', None) or ax.get_xscale()
+    x, y = decimate(x, y, npixels(ax), method, xlim, xscale)
+    return ax.plot(x, y, *args, **kwargs)
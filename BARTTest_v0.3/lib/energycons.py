@@ -1,10 +1,170 @@
 #! /usr/bin/env python
 
-import sys
+import sys, os
 import numpy as np
 #import scipy.interpolate as si
 sys.path.append("../../BART/modules/transit/scripts/")
-import readtransit as rt
+import specio
+import runtransit as runt
+
+"""
+Usage: ./energycons.py [nlayers1 nlayers2 ...]
+
+Without arguments, compares the integrated fluxes of the f09energycons 
+spectra. With arguments, runs the energy-conservation test with the 
+atmosphere resampled to each number of layers, see convergence().
+"""
+
+
+def integrate(fname, chunksize=100000):
+    """
+    Integrates a spectrum over wavenumber with the trapezoidal rule, reading 
+    it in chunks and adding the chunks with Neumaier's compensated 
+    summation, so that the rounding error does not grow with the number of 
+    samples.
+
+    Inputs
+    ------
+    fname    : string. Path/to/file of the spectrum.
+    chunksize: int.    Number of samples integrated at once.
+
+    Outputs
+    -------
+    total    : float.  Integrated flux.
+    """
+    wnums, flux = specio.readspectrum(fname)
+    total = 0.0
+    comp  = 0.0
+    # Consecutive chunks share one sample
+    for i in range(0, max(len(flux) - 1, 1), chunksize):
+        wn   = np.asarray(wnums[i:i+chunksize+1], dtype=float)
+        fl   = np.asarray(flux [i:i+chunksize+1], dtype=float)
+        part = np.sum(np.diff(wn) * (fl[1:] + fl[:-1])) / 2.
+        t    = total + part
+        if abs(total) >= abs(part):
+            comp += (total - t) + part
+        else:
+            comp += (part - t) + total
+        total = t
+    return total + comp
+
+
+def atmlayers(template, atmfile, nlayers):
+    """
+    Resamples a TEA-format atmospheric file to a number of layers, equally 
+    spaced in log(pressure) between the template's top and bottom. Every 
+    column is interpolated linearly in log(pressure).
+
+    Inputs
+    ------
+    template: string. Path/to/template atmospheric file.
+    atmfile : string. Path/to/output atmospheric file.
+    nlayers : int.    Number of layers.
+    """
+    with open(template, 'r') as foo:
+        lines = foo.readlines()
+    # Header, up to and including the column names
+    idata  = [i for i in range(len(lines)) 
+              if lines[i].strip() == '#TEADATA'][0] + 2
+    data   = np.array([line.split() for line in lines[idata:] 
+                       if line.strip() != ''], dtype=float)
+
+    logp   = np.log10(data[:,1])
+    isort  = np.argsort(logp)
+    newlogp = np.linspace(logp[0], logp[-1], nlayers)
+    newdata = np.array([np.interp(newlogp, logp[isort], data[isort, j]) 
+                        for j in range(data.shape[1])]).T
+    newdata[:,1] = 10**newlogp
+
+    with open(atmfile, 'w') as foo:
+        foo.writelines(lines[:idata])
+        for row in newdata:
+            foo.write('{:10.3f} {:.4e} {:7.2f} '.format(*row[:3]) + 
+                      ' '.join(['{:.4e}'.format(x) for x in row[3:]]) + '\n')
+
+
+def convergence(values, param='nlayers', tol=1e-3, 
+                testdir='../tests/f09energycons/', 
+                template='energycons_1_emission.trc', 
+                outdir='../code-output/01BART/f09energycons/convergence/', 
+                outfile='../results/01BART/f09convergence.txt', ncpu=None):
+    """
+    Runs Transit on variants of a configuration that differ in resolution, 
+    concurrently, and reports how the integrated flux converges.
+
+    Inputs
+    ------
+    values  : list.   Values of `param` for each variant, e.g., numbers of 
+                      layers, from cheapest to most expensive.
+    param   : string. 'nlayers' resamples the template's atmospheric file 
+                      to each number of layers, see atmlayers(). Any other 
+                      value is a Transit argument set in the configuration, 
+                      e.g., 'wndelt'.
+    tol     : float.  Tolerance on the relative difference of the integrated 
+                      flux with respect to the most expensive variant.
+    testdir : string. Path/to/test directory with the template.
+    template: string. Template .trc file, in `testdir`.
+    outdir  : string. Path/to/directory for the spectra.
+    outfile : string. Path/to/file for the report.
+    ncpu    : int.    Maximum number of Transit runs at once.
+
+    Outputs
+    -------
+    integspec: 1D array. Integrated flux of each variant (NaN if it failed).
+    cheapest : The first value of `values` from which every variant is 
+               within `tol` of the last one, or None.
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    args     = runt.readtrc(os.path.join(testdir, template))
+    specdir  = os.path.relpath(outdir, testdir)
+    trcfiles = []
+    for value in values:
+        tag  = 'convergence_' + param + '_' + str(value)
+        trc  = {'outspec': os.path.join(specdir, tag + '_spectrum.dat')}
+        if param == 'nlayers':
+            trc['atm'] = os.path.join(os.path.dirname(args['atm']), 
+                                      tag + '.atm')
+            atmlayers(os.path.join(testdir, args['atm']), 
+                      os.path.join(testdir, trc['atm']), int(value))
+        else:
+            trc[param] = value
+        runt.writetrc(os.path.join(testdir, template), 
+                      os.path.join(testdir, tag + '.trc'), trc)
+        trcfiles.append(tag + '.trc')
+
+    # Integrate each spectrum as its run finishes
+    integspec = np.zeros(len(values)) + np.nan
+    for trcfile, outspec, code in runt.runtransit(trcfiles, testdir, ncpu):
+        if code != 0:
+            print("Transit failed on " + trcfile + ".")
+            continue
+        integspec[trcfiles.index(trcfile)] = integrate(outspec)
+
+    # Relative differences with respect to the most expensive variant
+    diff = integspec / integspec[-1] - 1
+    ok   = np.abs(diff) <= tol
+    cheapest = None
+    for i in range(len(values)):
+        if np.all(ok[i:]):
+            cheapest = values[i]
+            break
+
+    with open(outfile, 'w') as foo:
+        foo.write('# Integrated flux (erg/s/cm2) vs. ' + param + 
+                  ', relative to the last variant\n')
+        foo.write('# {:>10s} {:>22s} {:>14s}\n'.format(param, 'Flux', 
+                                                       'Difference'))
+        for i in range(len(values)):
+            foo.write('  {:>10s} {:22.15e} {:14.6e}\n'.format(
+                      str(values[i]), integspec[i], diff[i]))
+        if cheapest is None:
+            foo.write('# No variant converged to within ' + str(tol) + '\n')
+        else:
+            foo.write('# Converged to within ' + str(tol) + ' from ' + 
+                      param + ' = ' + str(cheapest) + '\n')
+    return integspec, cheapest
+
 
 def energycons(spectra, outfile):
     """
@@ -21,8 +181,7 @@ def energycons(spectra, outfile):
 
     # Load each spectrum, integrate it
     for i in range(len(spectra)):
-        wnums, flux  = rt.readspectrum(spectra[i])
-        integspec[i] = np.trapz(flux, x=wnums)
+        integspec[i] = integrate(spectra[i])
         # Cubic spline returns roughly same value
         #integspec[i] = si.InterpolatedUnivariateSpline(wnums, flux, 
         #                                 k=3).integral(wnums[0], wnums[-1])
@@ -38,6 +197,13 @@ def energycons(spectra, outfile):
 
 
 if __name__ == "__main__":
+    # With arguments, check the convergence against the number of layers
+    if len(sys.argv) > 1:
+        nlayers = [int(n) for n in sys.argv[1:]]
+        integspec, cheapest = convergence(nlayers)
+        print("Converged from nlayers = " + str(cheapest))
+        sys.exit(0)
+
     spectra = ['../code-output/01BART/f09energycons/' + \
                 'energycons_1_emission_spectrum.dat',
                '../code-output/01BART/f09energycons/' + \
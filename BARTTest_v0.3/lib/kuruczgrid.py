@@ -0,0 +1,243 @@
+#! /usr/bin/env python
+
+import sys, os
+import tempfile
+from collections import OrderedDict
+import numpy as np
+sys.path.append('../../BART/code/')
+import wine
+
+"""
+This file converts a Kurucz stellar flux grid (.pck ASCII file) into binary
+files once, and reads stellar spectra from them.
+
+kuruczbin() writes <prefix>_flux.npy, the (nmodels, nwavenumbers) fluxes,
+which is memory-mapped when read, and <prefix>_grid.npz, with the effective
+temperature and log(g) of each model and the wavenumbers. The fluxes are
+those returned by wine.readkurucz(), so they have the same units and order.
+The .pck file is read once; each model is passed to wine.readkurucz() as a
+small file holding only its own block (see kuruczbin()).
+
+KuruczGrid returns the spectrum at a (Teff, log g), and keeps the recently
+requested ones in memory. readkurucz() is a drop-in replacement for
+wine.readkurucz() that uses it.
+
+Usage: ./kuruczgrid.py kuruczfile [outprefix]
+"""
+
+def _readblocks(kfile):
+    # Lines of a Kurucz grid, and the line index, effective temperature,
+    # and log(g) of each model header
+    with open(kfile, 'r') as foo:
+        lines = foo.readlines()
+    iheader, teff, logg = [], [], []
+    for i in range(len(lines)):
+        if 'TEFF' in lines[i] and 'GRAVITY' in lines[i]:
+            fields = lines[i].split()
+            iheader.append(i)
+            teff.append(float(fields[fields.index('TEFF')    + 1]))
+            logg.append(float(fields[fields.index('GRAVITY') + 1]))
+    return lines, iheader, np.array(teff), np.array(logg)
+
+
+def kuruczheaders(kfile):
+    """
+    Reads the effective temperature and log(g) of each model of a Kurucz
+    grid, from the 'TEFF ... GRAVITY ...' model headers.
+
+    Inputs
+    ------
+    kfile: string. Path/to/Kurucz .pck file.
+
+    Outputs
+    -------
+    teff : 1D array. Effective temperature of each model (K).
+    logg : 1D array. log10 of the surface gravity of each model (cgs).
+    """
+    lines, iheader, teff, logg = _readblocks(kfile)
+    return teff, logg
+
+
+def kuruczbin(kfile, outprefix=None):
+    """
+    Converts a Kurucz .pck grid into binary files.
+
+    The file is read once. Each model is then converted by wine.readkurucz()
+    from a temporary file with the file's preamble, the model's block, and
+    one neighboring block (wine.readkurucz() sizes the blocks from the
+    distance between the first two headers), so the fluxes have the units
+    and order of wine.readkurucz() and the conversion is linear in the size
+    of the grid.
+
+    Inputs
+    ------
+    kfile    : string. Path/to/Kurucz .pck file.
+    outprefix: string. Prefix of the output files. Default is `kfile`
+                       without its extension.
+
+    Outputs
+    -------
+    outprefix: string. Prefix of the files written.
+    """
+    if outprefix is None:
+        outprefix = os.path.splitext(kfile)[0]
+    lines, iheader, teff, logg = _readblocks(kfile)
+    if len(iheader) < 2:
+        raise ValueError("'" + kfile + "' holds fewer than two models.")
+    preamble = ''.join(lines[:iheader[0]])
+    nblock   = iheader[1] - iheader[0]
+    block    = lambda i: ''.join(lines[iheader[i]:iheader[i] + nblock])
+
+    fd, tmpfile = tempfile.mkstemp(suffix='.pck',
+                                   dir=os.path.dirname(os.path.abspath(
+                                                       outprefix)))
+    os.close(fd)
+    flux = None
+    try:
+        for i in range(len(teff)):
+            j = i + 1 if i + 1 < len(teff) else i - 1
+            with open(tmpfile, 'w') as foo:
+                foo.write(preamble + block(i) + block(j))
+            # The model closest to a grid point is that grid point
+            fl, wn, tmodel, gmodel = wine.readkurucz(tmpfile, teff[i],
+                                                     logg[i])
+            if (tmodel, gmodel) != (teff[i], logg[i]):
+                raise ValueError("Model " + str(i) + " of '" + kfile +
+                                 "' was not read back.")
+            if flux is None:
+                flux = np.lib.format.open_memmap(outprefix + '_flux.npy',
+                                                 'w+', np.double,
+                                                 (len(teff), len(fl)))
+            flux[i] = fl
+    finally:
+        os.remove(tmpfile)
+    flux.flush()
+    del flux
+    np.savez(outprefix + '_grid.npz', teff=teff, logg=logg, wn=wn)
+    return outprefix
+
+
+class KuruczGrid(object):
+    """
+    Stellar spectra from a binary Kurucz grid. The .pck file is converted
+    with kuruczbin() the first time, or when it is newer than the binary
+    files.
+
+    Example
+    -------
+    >>> grid = KuruczGrid('hd189733b-fp00k2odfnew.pck')
+    >>> flux, wn, tmodel, gmodel = grid(5000., 4.5)
+    """
+    def __init__(self, kfile, outprefix=None, cachesize=16):
+        """
+        Inputs
+        ------
+        kfile    : string. Path/to/Kurucz .pck file.
+        outprefix: string. Prefix of the binary files. See kuruczbin().
+        cachesize: int.    Maximum number of spectra kept in memory.
+        """
+        if outprefix is None:
+            outprefix = os.path.splitext(kfile)[0]
+        fluxfile = outprefix + '_flux.npy'
+        gridfile = outprefix + '_grid.npz'
+        if not (os.path.isfile(fluxfile) and os.path.isfile(gridfile)) or    \
+           os.path.getmtime(kfile) > min(os.path.getmtime(fluxfile),
+                                         os.path.getmtime(gridfile)):
+            kuruczbin(kfile, outprefix)
+        grid = np.load(gridfile)
+        self.teff      = grid['teff']
+        self.logg      = grid['logg']
+        self.wn        = grid['wn']
+        self.flux      = np.load(fluxfile, mmap_mode='r')
+        self.cachesize = cachesize
+        self.cache     = OrderedDict()
+
+    def nearest(self, temp, logg):
+        """
+        Index of the model chosen by wine.readkurucz(): the closest
+        temperature, then the lowest gravity not below the closest one.
+        """
+        bestT = self.teff[np.argmin(np.abs(self.teff - temp))]
+        bestg = self.logg[np.argmin(np.abs(self.logg - logg))]
+        imodel = np.where((self.teff == bestT) & (self.logg >= bestg))[0]
+        if len(imodel) == 0:
+            imodel = np.where(self.teff == bestT)[0]
+        return imodel[np.argmin(self.logg[imodel])]
+
+    def linear(self, temp, logg):
+        """
+        Bilinear interpolation in (Teff, log g) between the four models that
+        surround the point.
+        """
+        temps = np.unique(self.teff)
+        gravs = np.unique(self.logg)
+        it = np.clip(np.searchsorted(temps, temp), 1, len(temps)-1)
+        ig = np.clip(np.searchsorted(gravs, logg), 1, len(gravs)-1)
+        flux = 0.0
+        for T, wT in [(temps[it-1], temps[it] - temp),
+                      (temps[it],   temp - temps[it-1])]:
+            for g, wg in [(gravs[ig-1], gravs[ig] - logg),
+                          (gravs[ig],   logg - gravs[ig-1])]:
+                imodel = np.where((self.teff == T) & (self.logg == g))[0]
+                if len(imodel) == 0:
+                    raise ValueError("The grid has no model at Teff=" +
+                                     str(T) + " K, log(g)=" + str(g) + ".")
+                flux = flux + wT * wg * self.flux[imodel[0]]
+        return flux / ((temps[it] - temps[it-1]) * (gravs[ig] - gravs[ig-1]))
+
+    def __call__(self, temp, logg, method='nearest'):
+        """
+        Inputs
+        ------
+        temp  : float. Effective temperature (K).
+        logg  : float. log10 of the surface gravity (cgs).
+        method: string. 'nearest' returns the model that wine.readkurucz()
+                        returns. 'linear' interpolates between models.
+
+        Outputs
+        -------
+        flux  : 1D array. Stellar flux, as from wine.readkurucz().
+        wn    : 1D array. Wavenumbers (cm-1).
+        tmodel: float. Temperature of the model (`temp` if interpolated).
+        gmodel: float. log(g) of the model (`logg` if interpolated).
+        """
+        key = (temp, logg, method)
+        if key in self.cache:
+            spectrum = self.cache.pop(key)
+        elif method == 'nearest':
+            imodel   = self.nearest(temp, logg)
+            spectrum = (np.array(self.flux[imodel]), self.wn,
+                        self.teff[imodel], self.logg[imodel])
+        elif method == 'linear':
+            spectrum = (self.linear(temp, logg), self.wn, temp, logg)
+        else:
+            raise ValueError("Unknown method '" + str(method) + "'. Use " +
+                             "'nearest' or 'linear'.")
+        # Most recently used spectra are kept at the end
+        self.cache[key] = spectrum
+        while len(self.cache) > self.cachesize:
+            self.cache.popitem(last=False)
+        flux, wn, tmodel, gmodel = spectrum
+        return flux.copy(), wn.copy(), tmodel, gmodel
+
+
+# Open grids, by file name
+_grids = {}
+
+def readkurucz(kfile, temp, logg, method='nearest'):
+    """
+    Same as wine.readkurucz(), but reads the binary grid of `kfile`,
+    converting it first if needed. See KuruczGrid.
+    """
+    if kfile not in _grids:
+        _grids[kfile] = KuruczGrid(kfile)
+    return _grids[kfile](temp, logg, method)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: ./kuruczgrid.py kuruczfile [outprefix]")
+        sys.exit(1)
+    outprefix = kuruczbin(*sys.argv[1:3])
+    print("Binary grid written to " + outprefix + "_flux.npy, " +
+          outprefix + "_grid.npz")
@@ -5,9 +5,10 @@ import numpy as np
 import scipy.interpolate as si
 import astropy.constants as const
 sys.path.append('../../BART/code/')
-import readtransit as rt
+import specio
 import kurucz_inten as ki
-import wine
+import bandmatrix
+import kuruczgrid
 
 
 '''
@@ -21,7 +22,7 @@ filterfiles->filters
 
 def noiseup(kuruczfile, planetfile, filters, geometry, outdir, outpre, 
             mass=0.806, radius=0.756, temp=5000., planetrad=1.138, 
-            distance=19.3, diameter=650., ecltime=1.827, seed=0):
+            distance=19.3, diameter=650., ecltime=1.827, seed=0, nreal=0):
     """
     This function takes an input star and planet spectrum and computes 
     transit/eclipse depths with photon noise, as observed by a 
@@ -43,6 +44,8 @@ def noiseup(kuruczfile, planetfile, filters, geometry, outdir, outpre,
     diameter  : float.  Telescope diameter [cm]
     ecltime   : float.  Duration of the secondary eclipse [hours]
     seed      : int.    Seed for random number generation.
+    nreal     : int.    If > 0, also save `nreal` independent noise 
+                        realizations of the depths, see noiserealizations().
 
     Outputs
     -------
@@ -51,6 +54,8 @@ def noiseup(kuruczfile, planetfile, filters, geometry, outdir, outpre,
     - 
     - 
     - 
+    If `nreal` > 0, <outpre>ecl_realizations.npz (or tra_) is also saved, 
+    with arrays `depths` (nreal, nfilters), `noiseless`, `unc`, and `seed`.
 
     Notes
     -----
@@ -90,12 +95,10 @@ def noiseup(kuruczfile, planetfile, filters, geometry, outdir, outpre,
     # Temperature and log(g) of star
     logg = np.log10(G * mass / radius**2) #log g (cm/s2)
 
-    # Read and interpolate Kurucz grid, planet spectrum
-    starfl, starwn, tmodel, gmodel = wine.readkurucz(kuruczfile, temp, logg)
-    planetwn, planetfl             = rt.readspectrum(planetfile)
-
-    nifilter  = []
-    wnindices = []
+    # Read Kurucz grid (binary copy, converted on first use), planet spectrum
+    starfl, starwn, tmodel, gmodel = kuruczgrid.readkurucz(kuruczfile, 
+                                                           temp, logg)
+    planetwn, planetfl             = specio.readspectrum(planetfile)
 
     # Multiply by 4pi steradians, surface area
     # Planetary spectrum is already integrated over steradians
@@ -123,39 +126,19 @@ def noiseup(kuruczfile, planetfile, filters, geometry, outdir, outpre,
         starflinterp = si.interp1d(starwn, starfl)
         istarfl      = starflinterp(planetwn)
 
-    # Initialize arrays for band-integrated energy and mean wavelength
-    bandintegratedstar   = np.zeros(len(filters))
-    bandintegratedplanet = np.zeros(len(filters))
-    meanwn               = np.zeros(len(filters))
-
-    # Read filters. Resample to planetwn
-    for i in np.arange(len(filters)):
-        filtwn, filttransm   = wine.readfilter(filters[i])
-        meanwn[i]            = np.mean(filtwn)
-        nifilt, rsSED, wnind = wine.resample(planetwn, filtwn, filttransm, 
-                                             starwn, sSED)
-        nifilter.append(nifilt)
-        wnindices.append(wnind)
-
-    # Loop over each filter file, read the file, interpolate to the
-    # wavelength array, and integrate over the bandpass, weighted by the
-    # filter. 
-    for i in np.arange(len(filters)):
-        # integrate over the bandpass
-        bandintegratedstar[i]       = wine.bandintegrate(
-                                           isSED[wnindices[i][0]], planetwn, 
-                                           nifilter[i], wnindices[i])
-        if   geometry == 'eclipse':
-            bandintegratedplanet[i] = wine.bandintegrate(
-                                           pSED[wnindices[i][0]], 
-                                           planetwn, nifilter[i], wnindices[i])
-        elif geometry == 'transit':
-            bandintegratedplanet[i] = wine.bandintegrate(
-                                           planetfl[wnindices[i][0]], 
-                                           planetwn, nifilter[i], wnindices[i])
-        else:
-            print("Invalid `geometry` specification.\n")
-            sys.exit()
+    # Band-integration matrix of the filters on planetwn, built once per
+    # filter set and grid
+    bandmat, meanwn = bandmatrix.cachedmatrix(filters, planetwn)
+
+    # Integrate over each bandpass, weighted by the filter
+    bandintegratedstar       = bandmat.dot(isSED)
+    if   geometry == 'eclipse':
+        bandintegratedplanet = bandmat.dot(pSED)
+    elif geometry == 'transit':
+        bandintegratedplanet = bandmat.dot(planetfl)
+    else:
+        print("Invalid `geometry` specification.\n")
+        sys.exit()
 
     # Divide by photon energy to get number of photons (counts)
     # Find total photon signal
@@ -225,6 +208,44 @@ def noiseup(kuruczfile, planetfile, filters, geometry, outdir, outpre,
             for i in range(len(filters)):
                 f.write(str(bandintegratedplanet[i]) + '\n')
 
+    # Ensemble of noise realizations of the same noiseless depths
+    if nreal > 0:
+        if geometry == 'eclipse':
+            noiseless = pphotons / phot_tot
+            sigma     = poisson_tot / phot_tot
+        else:
+            noiseless = bandintegratedplanet
+            sigma     = poisson_tot_rat / phot_tot_rat
+        ensemble = noiseless + noiserealizations(sigma, nreal, seed)
+        np.savez(outdir + outpre + geometry[:3] + '_realizations.npz', 
+                 depths=ensemble, noiseless=noiseless, unc=unc, seed=seed)
+
+
+def noiserealizations(sigma, nreal, seed=0):
+    """
+    Draws independent Gaussian noise realizations. Realization i uses its 
+    own generator, seeded by the i-th child of SeedSequence(seed), so any 
+    realization can be reproduced alone and ensembles made with larger 
+    `nreal` extend smaller ones.
+
+    Inputs
+    ------
+    sigma: 1D array. Standard deviation of the noise in each filter.
+    nreal: int.      Number of realizations.
+    seed : int.      Seed of the ensemble.
+
+    Outputs
+    -------
+    noise: 2D array. Shape (nreal, len(sigma)).
+    """
+    sigma    = np.asarray(sigma)
+    children = np.random.SeedSequence(seed).spawn(nreal)
+    noise    = np.empty((nreal, len(sigma)))
+    for i in range(nreal):
+        noise[i] = np.random.default_rng(children[i]).standard_normal(
+                                                                len(sigma))
+    return noise * sigma
+
 
 if __name__ == '__main__':
     # Set paths
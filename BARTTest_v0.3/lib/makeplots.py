@@ -1,17 +1,20 @@
 #! /usr/bin/env python
 
 import numpy as np
+import plotjobs
 import matplotlib.pyplot as plt
 import sys, os
 sys.path.append("../../BART/modules/transit/scripts/")
-import readtransit as rt
+import specio
 import scipy.constants as const
 import voigtcomp
+import decimate as dm
 
 """
 This file contains three functions used to produce plots of spectra, and 
-a main function to produce plots for each test. An output directory is 
-specified in main().
+a main function to produce plots for each test. The plots of each test, and 
+their output directory, are listed in jobs(); main() renders them in 
+parallel with plotjobs.py.
 
 plotspectrum() is used to plot the entire spectrum produced by Transit.
 plotspeczoom() is used to plot a small part of the spectrum.
@@ -53,21 +56,17 @@ def plotspectrum(fname, geo, wl=True, oname=False, title=False):
     >>> plotspectrum('fewline/fewline_emission_spectrum.dat', 'eclipse')
     """
     # Load the data
-    try:
-        if wl==True:
-            wlength, flux = rt.readspectrum(fname, 0)
-        else:
-            wlength, flux = rt.readspectrum(fname)
-    except:
-        return
+    if wl==True:
+        wlength, flux = specio.readspectrum(fname, 0)
+    else:
+        wlength, flux = specio.readspectrum(fname)
 
     # Get test name
     testname = fname.split('/')[-1].split('_')[0]
 
     # Plot the data
-    plt.figure(0, (8,5))
-    plt.clf()
-    plt.plot(wlength, flux, "b")
+    plt.figure(figsize=(8,5))
+    dm.plot(wlength, flux, "b")
     
     # Set title and plot filename based on the geometry
     if geo=='eclipse':
@@ -95,7 +94,7 @@ def plotspectrum(fname, geo, wl=True, oname=False, title=False):
         plt.savefig(fname.split('/')[0] + '/' + plotname)
     else:
         plt.savefig(oname)
-    plt.clf()
+    plt.close()
 
 
 def plotspeczoom(fname, geo, loc, wl=True, xlims=False, oname=False, 
@@ -129,16 +128,13 @@ def plotspeczoom(fname, geo, loc, wl=True, xlims=False, oname=False,
     >>> plotspeczoom('fewline/fewline_emission_spectrum.dat', 'eclipse', 2.5)
     """
     # Load the data
-    try:
-        if wl==True:
-            wlength, flux = rt.readspectrum(fname, 0)
-            # File is ordered by decreasing wavelength--reverse it
-            wlength = wlength[::-1]
-            flux    = flux   [::-1]
-        else:
-            wlength, flux = rt.readspectrum(fname)
-    except:
-        return
+    if wl==True:
+        wlength, flux = specio.readspectrum(fname, 0)
+        # File is ordered by decreasing wavelength--reverse it
+        wlength = wlength[::-1]
+        flux    = flux   [::-1]
+    else:
+        wlength, flux = specio.readspectrum(fname)
 
     # Get test name
     testname = fname.split('/')[-1].split('_')[0]
@@ -149,9 +145,8 @@ def plotspeczoom(fname, geo, loc, wl=True, xlims=False, oname=False,
     fluxtrim = flux   [len(hi) - 33 : len(hi) + 33] # above
     
     # Plot the data
-    plt.figure(0, (8,5))
-    plt.clf()
-    plt.plot(wlentrim, fluxtrim, "b")
+    plt.figure(figsize=(8,5))
+    dm.plot(wlentrim, fluxtrim, "b")
     
     # Set title and plot filename based on the geometry
     if geo=='eclipse':
@@ -181,7 +176,7 @@ def plotspeczoom(fname, geo, loc, wl=True, xlims=False, oname=False,
         plt.savefig(fname.split('/')[0] + '/' + plotname + '.png')
     else:
         plt.savefig(oname)
-    plt.clf()
+    plt.close()
 
 
 def plotspeciso(fname, atm, geo, wl=True, oname=False, title=False):
@@ -242,23 +237,18 @@ def plotspeciso(fname, atm, geo, wl=True, oname=False, title=False):
         bgtemp = np.unique(temparr)
 
     # Load the data
-    try:
-        if wl:
-            wlength, flux = rt.readspectrum(fname, 0)
-        else:
-            wlength, flux = rt.readspectrum(fname)
-    except:
-        print("Isothermal plot: invalid specification for the data file name.\n")
-        return
+    if wl:
+        wlength, flux = specio.readspectrum(fname, 0)
+    else:
+        wlength, flux = specio.readspectrum(fname)
 
     # Get test name
     testname = fname.split('/')[-1].split('_')[0]
 
     # Plot the data
-    plt.clf()
-    fig1   = plt.figure(1)
+    fig1   = plt.figure()
     frame1 = fig1.add_axes((.1, .3, .8, .6))
-    plt.plot(wlength, flux, color="k", lw=2, label='Transit')
+    dm.plot(wlength, flux, color="k", lw=2, label='Transit')
     
     # Set title and plot filename based on the geometry
     if geo=='eclipse':
@@ -282,20 +272,20 @@ def plotspeciso(fname, atm, geo, wl=True, oname=False, title=False):
                  (const.k*1e7) / bgtemp) - 1)
         # Plot it. Multiply Planck by pi because of how Transit calcs flux
         # Reverse Planck to match wlength
-        plt.plot(wlength, np.pi*planck, color='#ffff00', lw=2, ls="--", 
-                 label='Planck')
+        dm.plot(wlength, np.pi*planck, color='#ffff00', lw=2, ls="--", 
+                label='Planck')
     else:
         planck = 2. * const.h*1e7 * (wlength**3) * (const.c*100)**2 /   \
                  (np.exp(const.h*1e7 * wlength * const.c*100 /          \
                  (const.k*1e7) / bgtemp) - 1)
-        plt.plot(wlength, np.pi*planck, color='#ffff00', lw=2, ls="--", 
-                 label='Planck')
+        dm.plot(wlength, np.pi*planck, color='#ffff00', lw=2, ls="--", 
+                label='Planck')
 
     frame1.set_xticklabels([])
 
     # Residuals
     frame2 = fig1.add_axes((.1, .1, .8, .2))
-    plt.plot(wlength, 100*(flux - (np.pi*planck)) / (np.pi*planck))
+    dm.plot(wlength, 100*(flux - (np.pi*planck)) / (np.pi*planck))
     plt.ylabel('Residuals (%)', fontsize=14)
     yticks = frame2.yaxis.get_major_ticks()
     yticks[-1].label1.set_visible(False)
@@ -313,7 +303,7 @@ def plotspeciso(fname, atm, geo, wl=True, oname=False, title=False):
         plt.savefig(fname.split('/')[0] + '/' + plotname, bbox_inches='tight')
     else:
         plt.savefig(oname, bbox_inches='tight')
-    plt.clf()
+    plt.close()
 
 
 
@@ -343,17 +333,18 @@ def plotspecabun(fnames, base, geo='eclipse', xlims=(2.28905,2.28945),
       abundance_emission_spectra.png
     """
     # Load and plot spectrum w/ line moved
-    wl, fl = rt.readspectrum(base, 0)
-    plt.plot(wl, fl, label='No line', color=(0,0,0))
+    wl, fl = specio.readspectrum(base, 0)
+    plt.figure()
+    dm.plot(wl, fl, label='No line', color=(0,0,0), xlim=xlims)
 
     # Loop over list of files
     for fn in range(len(fnames)):
         # Load data
-        wlength, flux = rt.readspectrum(fnames[fn], 0)
+        wlength, flux = specio.readspectrum(fnames[fn], 0)
         col = float(fn)/float(len(fnames))
         # Plot it, with label and no repeat colors
-        plt.plot(wlength, flux, label=fnames[fn].split('/')[-1].split('_')[1], \
-                 color=(col, 0, 1-col))
+        dm.plot(wlength, flux, label=fnames[fn].split('/')[-1].split('_')[1], \
+                color=(col, 0, 1-col), xlim=xlims)
 
     # Set axis limits for the plot
     plt.xlim(xlims[0], xlims[1])
@@ -371,113 +362,79 @@ def plotspecabun(fnames, base, geo='eclipse', xlims=(2.28905,2.28945),
                     bbox_inches='tight')
     else:
         plt.savefig(oname, bbox_inches='tight')
-    plt.clf()
+    plt.close()
 
 
-def main():
+def jobs():
     """
-    This function produces plots of the spectra produced in the tests.
+    This function lists the plots of the spectra produced in the tests, as 
+    plot jobs (see plotjobs.py).
     """
-    print("Producing plots of spectra...")
-
     odir = '../code-output/01BART/'
     rdir = '../results/01BART/'
-    
-    # oneline
-    try:
-        plotspectrum(odir+'f01oneline/oneline_emission_spectrum.dat', 
-                     'eclipse', 
-                     oname=rdir+'f01oneline_emission_spectrum.png')
-    except Exception as e:
-        print(e)
-        pass
-
-    # fewline
-    try:
-        plotspectrum(odir+'f02fewline/fewline_emission_spectrum.dat', 
-                     'eclipse', 
-                     oname=rdir+'f02fewline_emission_spectrum.png')
-        plotspectrum(odir+'f02fewline/fewline_transmission_spectrum.dat', 
-                     'transit', 
-                     oname=rdir+'f02fewline_transmission_spectrum.png')
-    except Exception as e:
-        print(e)
-        pass
-
-    # multiline
-    try:
-        plotspectrum(odir+'f03multiline/multiline_emission_spectrum.dat', 
-                     'eclipse', 
-                     oname=rdir+'f03multiline_emission_spectrum.png')
-        plotspectrum(odir+'f03multiline/multiline_transmission_spectrum.dat', 
-                     'transit', 
-                     oname=rdir+'f03multiline_transmission_spectrum.png')
-    except Exception as e:
-        print(e)
-        pass
+    job  = plotjobs.job
+
+    # Single spectra: spectrum file, geometry, plot name
+    spectra = [('f01oneline/oneline_emission',           'eclipse', 
+                'f01oneline_emission'),
+               ('f02fewline/fewline_emission',           'eclipse', 
+                'f02fewline_emission'),
+               ('f02fewline/fewline_transmission',       'transit', 
+                'f02fewline_transmission'),
+               ('f03multiline/multiline_emission',       'eclipse', 
+                'f03multiline_emission'),
+               ('f03multiline/multiline_transmission',   'transit', 
+                'f03multiline_transmission'),
+               ('f04broadening/broadening_emission',     'eclipse', 
+                'f04broadening_emission'),
+               ('f06blending/blending_emission',         'eclipse', 
+                'f06blending_emission'),
+               ('f07multicia/noCIA_emission',            'eclipse', 
+                'f07noCIA_emission'),
+               ('f07multicia/oneCIA_emission',           'eclipse', 
+                'f07oneCIA_emission'),
+               ('f07multicia/twoCIA_emission',           'eclipse', 
+                'f07twoCIA_emission')]
+    joblist = []
+    for spec, geo, name in spectra:
+        fname = odir + spec + '_spectrum.dat'
+        oname = rdir + name + '_spectrum.png'
+        joblist.append(job('makeplots.plotspectrum', [fname], oname, 
+                           fname, geo, oname=oname))
 
     # broadening
-    try:
-        plotspectrum(odir+'f04broadening/broadening_emission_spectrum.dat', 
-                     'eclipse', 
-                     oname=rdir+'f04broadening_emission_spectrum.png')
-        voigtcomp.comp()
-    except Exception as e:
-        print(e)
-        pass
+    opacity  = odir + 'f04broadening/broadening.opt'
+    savename = rdir + 'f04voigt_comp'
+    joblist.append(job('voigtcomp.comp', [opacity], savename + '.png', 
+                       opacity=opacity, savename=savename))
 
     # abundance
-    fnames = [odir+'f05abundance/abundance_1e-4_emission_spectrum.dat',
-              odir+'f05abundance/abundance_2e-4_emission_spectrum.dat',
-              odir+'f05abundance/abundance_3e-4_emission_spectrum.dat',
-              odir+'f05abundance/abundance_4e-4_emission_spectrum.dat',
-              odir+'f05abundance/abundance_5e-4_emission_spectrum.dat',
-              odir+'f05abundance/abundance_6e-4_emission_spectrum.dat',
-              odir+'f05abundance/abundance_7e-4_emission_spectrum.dat',
-              odir+'f05abundance/abundance_8e-4_emission_spectrum.dat',
-              odir+'f05abundance/abundance_9e-4_emission_spectrum.dat',
-              odir+'f05abundance/abundance_1e-3_emission_spectrum.dat']
-    try:
-        plotspecabun(fnames, 
-                     odir+'f05abundance/abundance_0_emission_spectrum.dat', 
-                     oname=rdir+'f05abundance_emission_spectra.png')
-    except Exception as e:
-        print(e)
-        pass
-
-    # blending
-    try:
-        plotspectrum(odir+'f06blending/blending_emission_spectrum.dat', 
-                     'eclipse', 
-                     oname=rdir+'f06blending_emission_spectrum.png')
-    except Exception as e:
-        print(e)
-        pass
-
-    # multicia
-    try:
-        plotspectrum(odir+'f07multicia/noCIA_emission_spectrum.dat',  'eclipse', 
-                     oname=rdir+'f07noCIA_emission_spectrum.png')
-        plotspectrum(odir+'f07multicia/oneCIA_emission_spectrum.dat', 'eclipse', 
-                     oname=rdir+'f07oneCIA_emission_spectrum.png')
-        plotspectrum(odir+'f07multicia/twoCIA_emission_spectrum.dat', 'eclipse', 
-                     oname=rdir+'f07twoCIA_emission_spectrum.png')
-    except Exception as e:
-        print(e)
-        pass
-    
+    fnames = [odir+'f05abundance/abundance_'+abun+'_emission_spectrum.dat'
+              for abun in ['1e-4', '2e-4', '3e-4', '4e-4', '5e-4', 
+                           '6e-4', '7e-4', '8e-4', '9e-4', '1e-3']]
+    base   = odir + 'f05abundance/abundance_0_emission_spectrum.dat'
+    oname  = rdir + 'f05abundance_emission_spectra.png'
+    joblist.append(job('makeplots.plotspecabun', fnames + [base], oname, 
+                       fnames, base, oname=oname))
+
     # isothermal
-    try:
-        plotspeciso(odir+'f08isothermal/isothermal_emission_spectrum.dat', 
-                    '../tests/f08isothermal/isothermal.atm', 'eclipse', 
-                    oname=rdir+'f08isothermal_emission_spectrum.png')
-    except Exception as e:
-        print(e)
-        pass
+    fname = odir + 'f08isothermal/isothermal_emission_spectrum.dat'
+    atm   = '../tests/f08isothermal/isothermal.atm'
+    oname = rdir + 'f08isothermal_emission_spectrum.png'
+    joblist.append(job('makeplots.plotspeciso', [fname, atm], oname, 
+                       fname, atm, 'eclipse', oname=oname))
 
-    
+    return joblist
+
+
+def main(ncpu=None, force=False):
+    """
+    This function produces plots of the spectra produced in the tests.
+    """
+    print("Producing plots of spectra...")
+    return plotjobs.report(plotjobs.runjobs(jobs(), ncpu, force=force))
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(int(main() > 0))
 
@@ -0,0 +1,72 @@
+import numpy as np
+
+"""
+This file contains functions to access the posterior stored in an MC3
+output.npy file, of shape (nchains, nparams, niterations), without loading
+it all into memory.
+
+load()    memory-maps the file and discards the burn-in.
+flatten() stacks the chains into one (nparams, nsamples) array.
+chunks()  yields the stacked posterior in pieces of bounded size.
+"""
+
+def load(output, burnin=0, thin=1):
+    """
+    Memory-maps an MC3 output.npy file, discarding the burn-in.
+
+    Inputs
+    ------
+    output: string. Path/to/output.npy file from MC3.
+    burnin: int.    Number of burned iterations per chain.
+    thin  : int.    Keep every `thin`-th iteration.
+
+    Outputs
+    -------
+    data  : read-only array. View of the file with shape
+                             (nchains, nparams, niter), no data is copied.
+                             data.transpose(1, 0, 2) is a (nparams, nchains,
+                             niter) view of the same samples.
+    """
+    data = np.load(output, mmap_mode='r')
+    return data[:, :, burnin::thin]
+
+
+def flatten(data):
+    """
+    Stacks the chains of `data` into a single posterior, in the same order
+    as concatenating the chains one after the other.
+
+    Inputs
+    ------
+    data     : array. Shape (nchains, nparams, niter). See load().
+
+    Outputs
+    -------
+    posterior: array. Shape (nparams, nchains*niter). Allocated once.
+    """
+    nchains, npars, niter = data.shape
+    posterior = np.empty((npars, nchains*niter), dtype=data.dtype)
+    for c in range(nchains):
+        posterior[:, c*niter:(c+1)*niter] = data[c]
+    return posterior
+
+
+def chunks(data, chunksize=100000):
+    """
+    Yields the stacked posterior of `data` in pieces, in the same order as
+    flatten().
+
+    Inputs
+    ------
+    data     : array. Shape (nchains, nparams, niter). See load().
+    chunksize: int.   Maximum number of samples per piece.
+
+    Outputs
+    -------
+    chunk    : array. Shape (nparams, <=chunksize). Views into `data`.
+    """
+    nchains, npars, niter = data.shape
+    for c in range(nchains):
+        for i in range(0, niter, chunksize):
+            yield data[c, :, i:i+chunksize]
+
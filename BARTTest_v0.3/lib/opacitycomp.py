@@ -0,0 +1,428 @@
+#! /usr/bin/env python
+
+import sys, os
+import multiprocessing as mp
+import numpy as np
+import scipy.constants as const
+from opacityconv import OpacityTable
+import voigt
+
+"""
+This file recomputes the theoretical opacities of many lines from a HITRAN
+line list at every (layer, temperature) cell of a Transit opacity table, and
+compares them with the table. It generalizes the single-line comparison in
+voigtcomp.py, so that whole opacity grids can be checked before a retrieval.
+
+The masses and ratios of the isotopes come from the HITRAN definition file
+(litran.dat), and the molar masses and collision diameters of the molecules
+from the molecular information file (molecules.dat). The species that
+broaden the lines, and their abundances, have to be given, as there is no
+default atmosphere:
+
+Usage: ./opacitycomp.py parfile opacityfile pffile --atm NAME:abundance,...
+                        [--isofile file] [--molfile file] [--imol index]
+                        [--ncpu N]
+
+where the columns of pffile are the partition functions of the first
+isotopes of the molecule, in the order of the definition file. E.g.:
+./opacitycomp.py ../tests/00inputs/par/oneline.par                          \
+                 ../code-output/01BART/f04broadening/broadening.opt pf.dat    \
+                 --atm LG1:1e-4,CG3:0.9999
+"""
+
+# Default HITRAN definition and molecular information files
+INPUTS  = os.path.join(os.path.dirname(os.path.dirname(                       \
+                       os.path.abspath(__file__))), 'tests', '00inputs')
+ISOFILE = os.path.join(INPUTS, 'litran.dat')
+MOLFILE = os.path.join(INPUTS, 'molecules.dat')
+
+# scipy constants, cgs units
+c    = const.c   * 100 #cm s-1
+k    = const.k   * 1e7
+e    = const.e   *  10. * const.c #Coulomb --> statC
+me   = const.m_e * 1000.
+h    = const.h   * 1e7
+amu  = const.physical_constants['atomic mass constant'][0] * 1000
+Nava = const.N_A
+# HITRAN reference temperature
+T0   = 296.
+
+
+def readpar(parfile, wnrange=None):
+    """
+    Reads the wavenumber, line intensity, lower-state energy, molecule, and
+    isotope of each line in a HITRAN-format (.par) line list.
+
+    Inputs
+    ------
+    parfile: string. Path/to/file of the line list.
+    wnrange: tuple.  If not None, only keep lines within (lo, hi) cm-1.
+
+    Outputs
+    -------
+    wn     : array. Line wavenumbers (cm-1).
+    S      : array. Line intensities at 296 K (cm molecule-1).
+    Elow   : array. Lower-state energies (cm-1).
+    mol    : array. HITRAN molecule IDs.
+    iso    : array. HITRAN isotope IDs.
+    """
+    # Fixed-width fields: molecule, isotope, wavenumber, intensity, Einstein
+    # A, air- and self-broadened widths, lower-state energy
+    data = np.genfromtxt(parfile, delimiter=(2, 1, 12, 10, 10, 5, 5, 10),
+                         usecols=(0, 1, 2, 3, 7), ndmin=2)
+    # Skip blank or incomplete lines
+    data = data[~np.any(np.isnan(data), axis=1)]
+    if wnrange is not None:
+        data = data[(data[:,2] >= wnrange[0]) & (data[:,2] <= wnrange[1])]
+    mol, iso, wn, S, Elow = data.T
+    return wn, S, Elow, mol.astype(int), iso.astype(int)
+
+
+def readpf(pf):
+    """
+    Reads a partition function table.
+
+    Inputs
+    ------
+    pf: string or array. Path/to/file, or array, with a column of temperature
+                         (K) and one column of partition function per
+                         isotope.
+
+    Outputs
+    -------
+    pf: 2D array. Temperatures and partition functions, to be linearly
+                  interpolated.
+    """
+    if isinstance(pf, str):
+        pf = np.loadtxt(pf, ndmin=2)
+    pf = np.asarray(pf, dtype=float)
+    if pf.ndim != 2 or pf.shape[1] < 2:
+        raise ValueError("The partition function table needs a column of " +
+                         "temperatures and one column per isotope.")
+    return pf
+
+
+def readisotopes(isofile, molid, niso=None):
+    """
+    Reads the isotopes of a molecule from a HITRAN definition file.
+
+    Inputs
+    ------
+    isofile: string. Path/to/file, with columns of HITRAN molecule ID,
+                     molecule name, isotope code, statistical weight,
+                     isotopic ratio, and isotopic mass.
+    molid  : int.    HITRAN molecule ID.
+    niso   : int.    Number of isotopes to keep, in the order of the file.
+                     Default is all of them.
+
+    Outputs
+    -------
+    name   : string. Name of the molecule.
+    isotopes: list.  HITRAN isotope IDs (1 -- 9, then 0 for the tenth).
+    molmass: array.  Molar mass of each isotope.
+    ratio  : array.  Ratio of each isotope.
+    """
+    name, molmass, ratio = None, [], []
+    with open(isofile, 'r') as foo:
+        for line in foo:
+            fields = line.split()
+            if len(fields) < 6 or line.lstrip().startswith('#'):
+                continue
+            if int(fields[0]) == molid:
+                name = fields[1]
+                ratio  .append(float(fields[4]))
+                molmass.append(float(fields[5]))
+    if name is None:
+        raise ValueError("Molecule " + str(molid) + " is not in '" +
+                         isofile + "'.")
+    niso = min(niso or len(ratio), len(ratio), 10)
+    # HITRAN numbers the isotopes of a molecule in the order of the file
+    isotopes = [(i + 1) % 10 for i in range(niso)]
+    return name, isotopes, np.array(molmass[:niso]), np.array(ratio[:niso])
+
+
+def readmolecule(molfile, name):
+    """
+    Reads a molecule from a Transit molecular information file.
+
+    Inputs
+    ------
+    molfile: string. Path/to/file, with columns of ID, name, molar mass
+                     (g mol-1), and collision diameter (Angstrom).
+    name   : string. Name of the molecule.
+
+    Outputs
+    -------
+    molid  : int.   Transit molecule ID.
+    mass   : float. Molar mass (g mol-1).
+    dia    : float. Collision diameter (cm).
+    """
+    with open(molfile, 'r') as foo:
+        for line in foo:
+            fields = line.split()
+            if len(fields) >= 4 and not line.lstrip().startswith('#') and    \
+               fields[1] == name:
+                return int(fields[0]), float(fields[2]), float(fields[3])*1e-8
+    raise ValueError("Molecule '" + name + "' is not in '" + molfile + "'.")
+
+
+def theoryopacity(wns, press, temp, wn, gf, Elow, Z, molmass, dia, atm,
+                  ratio, nwidth, meanmass=None):
+    """
+    Computes the theoretical opacity of a set of lines on a wavenumber grid,
+    with the same equations as voigtcomp.comp().
+
+    Inputs
+    ------
+    wns    : array. Wavenumber grid (cm-1).
+    press  : float. Pressure of the layer (bar).
+    temp   : float. Temperature of the layer (K).
+    wn     : array. Line wavenumbers (cm-1).
+    gf     : array. Weighted oscillator strengths.
+    Elow   : array. Lower-state energies (cm-1).
+    Z      : float or array. Partition function at `temp`, of each line's
+                             isotope.
+    molmass: float or array. Molar mass of each line's isotope.
+    ratio  : float or array. Ratio of each line's isotope.
+    meanmass: float. Molar mass of the molecule, which converts extinction
+                     to opacity. Default is `molmass`.
+    See opacitycomp() for the rest.
+
+    Outputs
+    -------
+    opacity: array. Opacity at `wns` (cm2 g-1).
+    """
+    if meanmass is None:
+        meanmass = molmass
+    mass     = molmass * amu        # mass in g
+    presscgs = press * 1000000      # pressure in cgs units
+    nd       = presscgs/(k*temp)    # number density in cm-3
+
+    # Doppler HWHM of each line
+    alpha = wn/c * (2.*k*temp*np.log(2)/mass)**0.5
+    # Lorentzian HWHM, the same for every line of an isotope
+    gamma = np.sum((dia[0]/2. + dia/2.)**2 *                                  \
+                   (2. * k * temp / np.pi)**0.5 / c *                         \
+                   nd * atm[:,0] *                                            \
+                   (1./np.atleast_1d(mass)[:,None] +                          \
+                    1./(atm[:,1] * amu))**0.5, axis=1)
+    # Extinction coefficient of each line
+    K = const.pi * e**2 / c**2 / me            *                              \
+        nd * ratio                             *                              \
+        gf / Z * np.exp(-h*c*Elow/k/temp)      *                              \
+        (1 - np.exp(-h*c*wn/k/temp))
+
+    prof = voigt.Vlines(wns, alpha, gamma, wn, K, nwidth=nwidth)
+    # Divide by density -- extinction --> opacity
+    return prof / (presscgs * meanmass / k / temp / Nava)
+
+
+# Shared by the worker processes, set by _init()
+_args = {}
+
+def _init(args):
+    _args.update(args)
+    _args['table'] = OpacityTable(args['opacity'])
+
+
+def _cell(cell):
+    """
+    Relative errors of the opacity table at one (layer, temperature) cell.
+    """
+    ilayer, itemp = cell
+    a     = _args
+    table = a['table']
+    temp  = table.temp [itemp]
+    press = table.press[ilayer]
+    # Partition function of each line's isotope
+    Z     = np.array([np.interp(temp, a['pf'][:,0], a['pf'][:,j+1])
+                      for j in range(a['pf'].shape[1] - 1)])[a['liso']]
+    opa   = table.read(ilayer, itemp, a['imol'])[0,0,0]
+    prof  = theoryopacity(table.wns, press, temp, a['wn'], a['gf'], a['Elow'],
+                          Z, a['molmass'][a['liso']], a['dia'], a['atm'],
+                          a['ratio'][a['liso']], a['nwidth'], a['meanmass'])
+    good  = (opa != 0) & (prof > 0)
+    if not np.any(good):
+        return np.nan, np.nan
+    err   = np.abs((prof[good] - opa[good]) / prof[good])
+    return np.amax(err), np.median(err)
+
+
+def opacitycomp(parfile, opacity, pf, molmass, dia, atm, ratio, imol,
+                isotopes=None, nwidth=20, ncpu=None,
+                outfile='../results/01BART/opacitycomp.txt'):
+    """
+    Compares the opacities of every (layer, temperature) cell of a Transit
+    opacity table with the theoretical opacities of the lines in a line list.
+
+    Inputs
+    ------
+    parfile: string. Path/to/file of the HITRAN-format line list.
+    opacity: string. Path/to/file of the binary opacity file produced by
+                     Transit.
+    pf     : string or array. Partition functions of the isotopes, see
+                              readpf().
+    molmass: float or array. Molar mass of each isotope.
+    dia    : array.  Collision diameters of the molecule and the others in
+                     `atm`.
+    atm    : array.  Contains the abundance and molar mass of each molecule
+                     present in the layers. Shape is (n_molecules, 2)
+    ratio  : float or array. Ratio of each isotope.
+    imol   : int.    Index of the molecule in the opacity table.
+    isotopes: list of ints. HITRAN isotope IDs, in the order of `molmass`,
+                     `ratio`, and the columns of `pf`. Default is the only
+                     isotope in `parfile`.
+    nwidth : float.  Profile half width, in units of the larger HWHM.
+    ncpu   : int.    Number of processes. Default is all CPUs.
+    outfile: string. Path/to/file for the text report. None to skip it.
+
+    Outputs
+    -------
+    errors : array. Maximum and median relative error of each cell. Shape is
+                    (Nlayer, Ntemp, 2). NaN where there is no opacity.
+    """
+    table = OpacityTable(opacity)
+    pf    = readpf(pf)
+
+    # Lines that can reach the table's wavenumber range
+    wn, S, Elow, mol, iso = readpar(parfile, (table.wns[0] - 10,
+                                              table.wns[-1] + 10))
+    if len(np.unique(mol)) > 1:
+        raise ValueError("The line list holds more than one molecule: " +
+                         str(np.unique(mol)) + ".")
+    if isotopes is None:
+        if len(np.unique(iso)) > 1:
+            raise ValueError("The line list holds isotopes " +
+                             str(np.unique(iso)) + ". Give their IDs in " +
+                             "`isotopes`, with their `molmass`, `ratio`, " +
+                             "and partition functions.")
+        isotopes = np.unique(iso)[:1] if len(iso) > 0 else [0]
+    isotopes = list(isotopes)
+    molmass  = np.atleast_1d(np.asarray(molmass, dtype=float))
+    ratio    = np.atleast_1d(np.asarray(ratio,   dtype=float))
+    if len(molmass) != len(isotopes) or len(ratio) != len(isotopes) or       \
+       pf.shape[1] - 1 != len(isotopes):
+        raise ValueError("`molmass`, `ratio`, and the partition functions " +
+                         "need one value (column) per isotope.")
+    missing = set(iso) - set(isotopes)
+    if len(missing) > 0:
+        raise ValueError("Isotopes " + str(sorted(missing)) + " of the " +
+                         "line list are not in `isotopes`.")
+    # Index of each line's isotope
+    liso = np.array([isotopes.index(i) for i in iso], dtype=int)
+    # Mean molar mass of the molecule's isotopic mix
+    meanmass = np.sum(ratio * molmass) / np.sum(ratio)
+
+    # Convert the HITRAN intensity to gf
+    Z0 = np.array([np.interp(T0, pf[:,0], pf[:,j+1])
+                   for j in range(len(isotopes))])[liso]
+    gf = S * Z0 * c**2 * me / (const.pi * e**2) /                             \
+         (ratio[liso] * np.exp(-h*c*Elow/k/T0) * (1 - np.exp(-h*c*wn/k/T0)))
+
+    args  = {'opacity':opacity, 'wn':wn, 'gf':gf, 'Elow':Elow, 'pf':pf,
+             'molmass':molmass, 'dia':dia, 'atm':atm, 'ratio':ratio,
+             'liso':liso, 'meanmass':meanmass, 'imol':imol,
+             'nwidth':nwidth}
+    cells = [(i, j) for i in range(table.Nlayer) for j in range(table.Ntemp)]
+
+    pool = mp.Pool(ncpu, initializer=_init, initargs=(args,))
+    try:
+        errors = pool.map(_cell, cells)
+    finally:
+        pool.close()
+        pool.join()
+    errors = np.array(errors).reshape(table.Nlayer, table.Ntemp, 2)
+
+    if outfile is not None:
+        ilayer, itemp = np.array(cells).T
+        report = np.column_stack((ilayer, itemp, table.press[ilayer],
+                                  table.temp[itemp], errors.reshape(-1, 2)))
+        np.savetxt(outfile, report, fmt='%4d %4d %.6e %.2f %.6e %.6e',
+                   header='Relative errors of the opacity table with ' +      \
+                   'respect to the theoretical opacities of\n' + parfile +    \
+                   ' (' + str(len(wn)) + ' lines):\n' +                       \
+                   'Layer  Temp  Pressure (bar)  Temperature (K)  ' +         \
+                   'Max error  Median error')
+
+    return errors
+
+
+def molparams(parfile, pf, atmspec, isofile=ISOFILE, molfile=MOLFILE):
+    """
+    Looks up the parameters of opacitycomp() for the molecule of a line
+    list.
+
+    Inputs
+    ------
+    parfile: string. Path/to/file of the HITRAN-format line list.
+    pf     : string or array. Partition functions, see readpf(). Their
+                              number of columns sets the isotopes.
+    atmspec: string. Species of the atmosphere and their abundances, as
+                     'NAME:abundance,NAME:abundance,...'. It must hold the
+                     molecule of the line list.
+    isofile: string. Path/to/HITRAN definition file.
+    molfile: string. Path/to/molecular information file.
+
+    Outputs
+    -------
+    params : dict. The molmass, dia, atm, ratio, and isotopes arguments of
+                   opacitycomp(), and the Transit ID of the molecule
+                   ('molid').
+    """
+    mol = np.unique(readpar(parfile)[3])
+    if len(mol) != 1:
+        raise ValueError("The line list must hold one molecule, not " +
+                         str(mol) + ".")
+    name, isotopes, molmass, ratio = readisotopes(isofile, mol[0],
+                                                  readpf(pf).shape[1] - 1)
+    species = [spec.split(':') for spec in atmspec.split(',')]
+    names   = [spec[0] for spec in species]
+    if name not in names:
+        raise ValueError("The atmosphere needs the abundance of " + name +
+                         ", the molecule of the line list.")
+    # The molecule of the line list goes first
+    species.insert(0, species.pop(names.index(name)))
+    atm, dia = [], []
+    for spec, abun in species:
+        molid, mass, diameter = readmolecule(molfile, spec)
+        atm.append([float(abun), mass])
+        dia.append(diameter)
+    return {'molmass':molmass, 'dia':np.array(dia), 'atm':np.array(atm),
+            'ratio':ratio, 'isotopes':isotopes,
+            'molid':readmolecule(molfile, name)[0]}
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    opts = {'--atm':None, '--isofile':ISOFILE, '--molfile':MOLFILE,
+            '--imol':None, '--ncpu':None}
+    for opt in opts:
+        if opt in args:
+            i = args.index(opt)
+            opts[opt] = args[i+1]
+            del args[i:i+2]
+    # There is no default molecule or atmosphere to fall back to
+    if len(args) != 3 or opts['--atm'] is None:
+        print("Usage: ./opacitycomp.py parfile opacityfile pffile "
+              "--atm NAME:abundance,...\n"
+              "       [--isofile file] [--molfile file] [--imol index] "
+              "[--ncpu N]")
+        sys.exit(1)
+    parfile, opacity, pf = args
+    params = molparams(parfile, pf, opts['--atm'], opts['--isofile'],
+                       opts['--molfile'])
+    molid  = params.pop('molid')
+    if opts['--imol'] is not None:
+        imol = int(opts['--imol'])
+    else:
+        table = OpacityTable(opacity)
+        if molid not in table.molID:
+            print("Molecule " + str(molid) + " is not in the opacity table " +
+                  "(molecules " + str(table.molID) + "). Give its index " +
+                  "with --imol.")
+            sys.exit(1)
+        imol = table.index('mol', molid)[0]
+    ncpu   = int(opts['--ncpu']) if opts['--ncpu'] is not None else None
+    errors = opacitycomp(parfile, opacity, pf, imol=imol, ncpu=ncpu, **params)
+    print("Maximum relative error:   " + str(np.nanmax(errors[:,:,0])))
+    print("Median of median errors:  " + str(np.nanmedian(errors[:,:,1])))
@@ -1,17 +1,57 @@
 import numpy as np
-import struct
+from collections import OrderedDict
 
-def bin2np(foo, output='opacity'):
+
+def readheader(foo):
     """
-    This function takes an opacity file (binary) produced by transit and 
+    This function reads the header of an opacity file (binary) produced by
+    transit, without touching the opacity table itself.
+
+    Inputs
+    -------
+    foo   : String. Transit opacity file.
+
+    Outputs
+    -------
+    header : Numpy array. Nmol, Ntemp, Nlayer, Nwave values.
+    molID  : Numpy array. Molecule isotopologue.
+    temp   : Numpy array. Array of temperatures for opacity table.
+    press  : Numpy array. Array of pressures for opacity table.
+    wns    : Numpy array. Array of wavenumbers for opacity table.
+    offset : int.         Byte offset where the opacity table begins.
+    """
+    with open(foo, 'rb') as foop:
+        # Read header values: Nmol, Ntemp, Nlayer, Nwave
+        header = np.fromfile(foop, dtype=np.int64,   count=4)
+        Nmol, Ntemp, Nlayer, Nwave = header
+        # Read in mol ID, temp, pressure, and wavenumber arrays
+        molID  = np.fromfile(foop, dtype=np.int32,   count=Nmol)
+        temp   = np.fromfile(foop, dtype=np.float64, count=Ntemp)
+        press  = np.fromfile(foop, dtype=np.float64, count=Nlayer)
+        wns    = np.fromfile(foop, dtype=np.float64, count=Nwave)
+        offset = foop.tell()
+
+    # All values are 1e6 larger than actual
+    press = press * 1e-6
+
+    return header, molID, temp, press, wns, offset
+
+
+def bin2np(foo, output=None):
+    """
+    This function takes an opacity file (binary) produced by transit and
     converts it to Numpy arrays.
 
+    The opacity table is memory-mapped rather than read into memory, so only
+    the parts of it that are actually used get paged in from disk.
+
     Inputs
     -------
     foo   : String. Transit opacity file.
-    output: String. path/to/filename for saved Numpy arrays. Do not include 
-                    extension, but DO include a file name. 
-                    Default file name is opacity(.npz)
+    output: String. path/to/filename for saved Numpy arrays. Do not include
+                    extension, but DO include a file name.
+                    Default is None, which does not save the arrays. Note
+                    that saving reads the entire opacity table.
 
     Outputs
     -------
@@ -20,7 +60,8 @@ def bin2np(foo, output='opacity'):
     temp   : Numpy array. Array of temperatures for opacity table.
     press  : Numpy array. Array of pressures for opacity table.
     wns    : Numpy array. Array of wavenumbers for opacity table.
-    optable: Numpy array. Opacity table.
+    optable: Numpy memmap. Opacity table, read-only.
+                           Shape is (Nlayer, Ntemp, Nmol, Nwave).
 
     Example
     -------
@@ -31,46 +72,299 @@ def bin2np(foo, output='opacity'):
     ---------
     2017-10-24      mhimes                  Added example and revisions to doc
     """
-    # Load all binary data
-    with open(foo, 'rb') as foop:
-        filecontent = foop.read()
-
-    # Read header values: Nmol, Ntemp, Nlayer, Nwave
-    hlen = 4*8 #4 values, 8 bytes each
-    header = struct.unpack("llll", filecontent[:hlen])
-    header = np.asarray(header)
+    header, molID, temp, press, wns, offset = readheader(foo)
     Nmol, Ntemp, Nlayer, Nwave = header
 
-    # Read in mol ID array
-    mlen = hlen + Nmol*4 #Nmol values, 4 bytes each
-    molID = struct.unpack("i" * Nmol, filecontent[hlen:mlen])
-    molID = np.asarray(molID)
+    # Map the opacity table, no copy is made
+    optable = np.memmap(foo, dtype=np.float64, mode='r', offset=offset,
+                        shape=(Nlayer, Ntemp, Nmol, Nwave))
 
-    # Read in temp array
-    tlen = mlen + Ntemp*8 #Ntemp values, 8 bytes each
-    temp = struct.unpack("d" * Ntemp, filecontent[mlen:tlen])
-    temp = np.asarray(temp)
+    # Save arrays to Numpy file
+    if output is not None:
+        np.savez(output+'.npz', header=header, molID=molID, temp=temp,        \
+                 press=press, wns=wns, optable=optable)
 
-    # Read in pressure array
-    plen = tlen + Nlayer*8 #Nlayer values, 8 bytes each
-    press = struct.unpack("d" * Nlayer, filecontent[tlen:plen])
-    press = np.asarray(press)
-    # All values are 1e6 larger than actual
-    press = press * 1e-6
+    # Return arrays
+    return (header, molID, temp, press, wns, optable)
 
-    # Read in wavenumber array
-    wlen = plen + Nwave*8 #Nwave values, 8 bytes each
-    wns = struct.unpack("d" * Nwave, filecontent[plen:wlen])
-    wns = np.asarray(wns)
 
-    # Read in opacity table, then reshape
-    optable = struct.unpack("d"*Nwave*Nmol*Ntemp*Nlayer, filecontent[wlen:])
-    optable = np.asarray(optable).reshape(Nlayer, Ntemp, Nmol, Nwave)
+class OpacityTable(object):
+    """
+    Sliced access to an opacity file (binary) produced by transit.
 
-    # Save arrays to Numpy file
-    np.savez(output+'.npz', header=header, molID=molID, temp=temp,            \
-             press=press, wns=wns, optable=optable)
+    Only the header is read when the object is created.  Selections are
+    mapped onto byte offsets within the file, and only the requested runs of
+    the opacity table are read from disk.
 
-    # Return arrays
-    return (header, molID, temp, press, wns, optable)
+    Example
+    -------
+    >>> table = OpacityTable('./opacity.opt')
+    >>> opa   = table.sel(press=0.335, temp=1442.58, mol=101,
+                          wn=(4367.5, 4368.5))
+    """
+    def __init__(self, foo):
+        self.filename = foo
+        self.header, self.molID, self.temp, self.press, self.wns,             \
+                     self.offset = readheader(foo)
+        self.Nmol, self.Ntemp, self.Nlayer, self.Nwave = self.header
+        self.shape = (self.Nlayer, self.Ntemp, self.Nmol, self.Nwave)
+
+    def index(self, axis, value=None, method='nearest'):
+        """
+        Finds the indices along an axis of the opacity table.
+
+        Inputs
+        ------
+        axis  : string. 'press', 'temp', or 'mol'.
+        value : float, array, or None. Value(s) to look up. Pressures in bar,
+                                       temperatures in K, molecule IDs as in
+                                       `molID`. None selects the whole axis.
+        method: string. 'nearest' gives the closest grid value for each
+                        value. 'bracket' gives the two grid values on either
+                        side of each value. Molecules are always matched
+                        exactly.
+
+        Outputs
+        -------
+        idx   : 1D int array. Sorted, unique indices along `axis`.
+                              Molecule indices are in the order of
+                              `value`.
+        """
+        grid = {'press':self.press, 'temp':self.temp, 'mol':self.molID}[axis]
+        if value is None:
+            return np.arange(len(grid))
+        value = np.atleast_1d(value)
+
+        if axis == 'mol':
+            idx = np.array([np.where(self.molID == v)[0][0]
+                            if v in self.molID else -1 for v in value])
+            if np.any(idx < 0):
+                raise ValueError("Molecule ID(s) " + str(value[idx < 0]) +
+                                 " not in the opacity table.")
+            return idx
+
+        if len(grid) == 1:
+            return np.array([0])
+        # Pressures are log-spaced
+        if axis == 'press':
+            grid  = np.log(grid)
+            value = np.log(value)
+        # Sort the grid, keep track of the original indices
+        isort = np.argsort(grid)
+        sgrid = grid[isort]
+        ihi   = np.clip(np.searchsorted(sgrid, value), 1, len(sgrid)-1)
+        ilo   = ihi - 1
+        if method == 'bracket':
+            idx = np.concatenate((isort[ilo], isort[ihi]))
+        elif method == 'nearest':
+            near = np.abs(value - sgrid[ilo]) <= np.abs(sgrid[ihi] - value)
+            idx  = np.where(near, isort[ilo], isort[ihi])
+        else:
+            raise ValueError("Invalid `method`. Use 'nearest' or 'bracket'.")
+
+        return np.unique(idx)
+
+    def wnslice(self, wn=None):
+        """
+        Converts a wavenumber range (lo, hi), in cm-1, into a slice of the
+        wavenumber array.  None selects all wavenumbers.
+        """
+        if wn is None:
+            return slice(0, self.Nwave)
+        lo, hi = np.searchsorted(self.wns, wn[0], side='left'),               \
+                 np.searchsorted(self.wns, wn[1], side='right')
+        return slice(lo, hi)
+
+    def read(self, ilayer, itemp, imol, wnslice=slice(None)):
+        """
+        Reads part of the opacity table from disk.
+
+        Inputs
+        ------
+        ilayer : int or array of ints. Layer indices.
+        itemp  : int or array of ints. Temperature indices.
+        imol   : int or array of ints. Molecule indices.
+        wnslice: slice.                Contiguous range of wavenumber indices.
+
+        Outputs
+        -------
+        opacity: 4D array. Shape is (len(ilayer), len(itemp), len(imol), nwn).
+        """
+        ilayer = np.atleast_1d(ilayer)
+        itemp  = np.atleast_1d(itemp)
+        imol   = np.atleast_1d(imol)
+        wlo, whi, wstep = wnslice.indices(self.Nwave)
+        if wstep != 1:
+            raise ValueError("`wnslice` must be contiguous.")
+        nwn = max(whi - wlo, 0)
+
+        opacity = np.zeros((len(ilayer), len(itemp), len(imol), nwn))
+        if nwn == 0:
+            return opacity
+        # All molecules at all wavenumbers are one contiguous run
+        allmol = nwn == self.Nwave and np.array_equal(imol,
+                                                      np.arange(self.Nmol))
+        with open(self.filename, 'rb') as foop:
+            for i in range(len(ilayer)):
+                for j in range(len(itemp)):
+                    # Byte offset of (ilayer, itemp, 0, 0)
+                    start = ((ilayer[i]*self.Ntemp + itemp[j]) *              \
+                              self.Nmol * self.Nwave)
+                    if allmol:
+                        foop.seek(self.offset + 8*start)
+                        opacity[i, j] = np.fromfile(foop, dtype=np.float64,
+                                count=self.Nmol*self.Nwave).reshape(self.Nmol,
+                                                                    self.Nwave)
+                        continue
+                    for k in range(len(imol)):
+                        foop.seek(self.offset +                               \
+                                  8*(start + imol[k]*self.Nwave + wlo))
+                        opacity[i, j, k] = np.fromfile(foop, dtype=np.float64,
+                                                       count=nwn)
+        return opacity
+
+    def sel(self, press=None, temp=None, mol=None, wn=None, method='nearest'):
+        """
+        Selects part of the opacity table by value.
+
+        Inputs
+        ------
+        press : float, array, or None. Pressure(s) in bar.
+        temp  : float, array, or None. Temperature(s) in K.
+        mol   : int,   array, or None. Molecule ID(s), as in `molID`.
+        wn    : tuple or None.         Wavenumber range (lo, hi) in cm-1.
+        method: string. 'nearest' or 'bracket'. See index().
+
+        Outputs
+        -------
+        opacity: array. Opacities in cm2 g-1, in (layer, temp, mol, wn)
+                        order. Axes selected with a scalar and
+                        method='nearest' are dropped.
+        """
+        ilayer  = self.index('press', press, method)
+        itemp   = self.index('temp',  temp,  method)
+        imol    = self.index('mol',   mol)
+        opacity = self.read(ilayer, itemp, imol, self.wnslice(wn))
+
+        # Drop axes selected by a single value
+        drop = []
+        if method == 'nearest' and press is not None and np.ndim(press) == 0:
+            drop.append(0)
+        if method == 'nearest' and temp  is not None and np.ndim(temp)  == 0:
+            drop.append(1)
+        if mol is not None and np.ndim(mol) == 0:
+            drop.append(2)
+        if len(drop) == 0:
+            return opacity
+        return np.squeeze(opacity, axis=tuple(drop))
+
+
+class OpacityInterpolator(object):
+    """
+    Interpolates an opacity table in pressure and temperature for many
+    (pressure, temperature) points at once, e.g., a whole PT profile or a
+    stack of posterior PT profiles.
+
+    Interpolation is linear in log(pressure) and in temperature, and is done
+    for every selected molecule and wavenumber.  Points outside the grid are
+    clamped to its edges.  The (layer, temperature) slabs read from disk are
+    kept in a least-recently-used cache, so repeated queries near the same
+    conditions do not read the file again.
+
+    Example
+    -------
+    >>> interp = OpacityInterpolator('./opacity.opt', wn=(4367.5, 4368.5))
+    >>> opa    = interp(pressure, temperature)
+    """
+    def __init__(self, table, mol=None, wn=None, cachesize=64):
+        """
+        Inputs
+        ------
+        table    : OpacityTable, or string path/to/opacity file.
+        mol      : int, array, or None. Molecule ID(s) to interpolate.
+                                        None uses all molecules.
+        wn       : tuple or None.       Wavenumber range (lo, hi) in cm-1.
+        cachesize: int.                 Maximum number of (layer, temperature)
+                                        slabs kept in memory.
+        """
+        if not isinstance(table, OpacityTable):
+            table = OpacityTable(table)
+        self.table     = table
+        self.imol      = table.index('mol', mol)
+        self.wnslice   = table.wnslice(wn)
+        self.wns       = table.wns[self.wnslice]
+        self.cachesize = cachesize
+        self.cache     = OrderedDict()
+
+    def bracket(self, grid, value):
+        """
+        Finds the grid indices on either side of each value, and the
+        fractional distance of each value between them.
+        """
+        isort = np.argsort(grid)
+        sgrid = grid[isort]
+        if len(sgrid) == 1:
+            zeros = np.zeros(len(value), dtype=int)
+            return isort[zeros], isort[zeros], np.zeros(len(value))
+        value  = np.clip(value, sgrid[0], sgrid[-1])
+        ihi    = np.clip(np.searchsorted(sgrid, value), 1, len(sgrid)-1)
+        ilo    = ihi - 1
+        weight = (value - sgrid[ilo]) / (sgrid[ihi] - sgrid[ilo])
+        return isort[ilo], isort[ihi], weight
+
+    def slab(self, ilayer, itemp):
+        """
+        Returns the (nmol, nwn) opacities at a layer and temperature index,
+        reading them from disk only if they are not cached.
+        """
+        key = (ilayer, itemp)
+        if key in self.cache:
+            slab = self.cache.pop(key)
+        else:
+            slab = self.table.read(ilayer, itemp, self.imol,
+                                   self.wnslice)[0, 0]
+        # Most recently used slabs are kept at the end
+        self.cache[key] = slab
+        while len(self.cache) > self.cachesize:
+            self.cache.popitem(last=False)
+        return slab
+
+    def __call__(self, press, temp):
+        """
+        Inputs
+        ------
+        press: float or array. Pressure(s) in bar.
+        temp : float or array. Temperature(s) in K. Broadcast against `press`.
+
+        Outputs
+        -------
+        opacity: array. Opacities in cm2 g-1. Shape is the broadcast shape of
+                        `press` and `temp`, followed by (nmol, nwn).
+        """
+        press, temp = np.broadcast_arrays(np.asarray(press, dtype=float),
+                                          np.asarray(temp,  dtype=float))
+        shape = press.shape
+        press = press.ravel()
+        temp  = temp .ravel()
+
+        ip0, ip1, wp = self.bracket(np.log(self.table.press), np.log(press))
+        it0, it1, wt = self.bracket(self.table.temp, temp)
+
+        # The four (layer, temperature) corners around each point
+        layers  = np.concatenate((ip0, ip0, ip1, ip1))
+        temps   = np.concatenate((it0, it1, it0, it1))
+        weights = np.concatenate(((1-wp)*(1-wt), (1-wp)*wt,
+                                     wp *(1-wt),    wp *wt))
+        # Each distinct slab is fetched once
+        keys, inv = np.unique(layers*self.table.Ntemp + temps,
+                              return_inverse=True)
+        slabs = np.array([self.slab(k // self.table.Ntemp,
+                                    k %  self.table.Ntemp) for k in keys])
+        inv     = inv    .reshape(4, len(press))
+        weights = weights.reshape(4, len(press))
+        # Weighted sum over the corners
+        opacity = np.zeros((len(press), len(self.imol), len(self.wns)))
+        for c in range(4):
+            opacity += weights[c, :, None, None] * slabs[inv[c]]
 
+        return opacity.reshape(shape + opacity.shape[1:])
@@ -0,0 +1,230 @@
+#! /usr/bin/env python
+
+import sys, os
+import json
+import time
+import traceback
+import importlib
+import multiprocessing as mp
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+import matplotlib
+matplotlib.use('Agg')
+
+"""
+This file renders plots as independent jobs, in parallel and without a
+display.
+
+A job describes one plot: the function that draws it ('module.function',
+e.g., 'makeplots.plotspectrum'), its arguments, the data files it reads, and
+the PNG it writes. Each job runs in its own process with the non-interactive
+Agg backend, at most `ncpu` at a time, and is stopped if it takes longer than
+`timeout` seconds. Jobs whose PNG is newer than all of their data files are
+skipped, so rerunning only redraws what changed. A plotting function may
+also return data, such as the residual statistics of the comparisons; it is
+saved as JSON next to the PNG (see datafile()).
+
+The plotting modules (makeplots.py, comparison.py, retrievalplots.py) list
+their plots in a jobs() function.
+
+Usage: ./plotjobs.py [module ...] [--ncpu N] [--timeout T] [--force]
+"""
+
+# Modules whose plots are made by default
+MODULES = ['makeplots', 'comparison', 'retrievalplots']
+
+
+def job(func, inputs, output, *args, **kwargs):
+    """
+    Describes a plot.
+
+    Inputs
+    ------
+    func  : string. Function that draws the plot, as 'module.function'.
+    inputs: list of strings. Paths/to/data files read by the plot.
+    output: string. Path/to/PNG file written by the plot.
+    args  : Positional arguments of `func`.
+    kwargs: Keyword arguments of `func`.
+
+    Outputs
+    -------
+    job   : dict. Keys 'func', 'inputs', 'output', 'args', and 'kwargs'.
+    """
+    return {'func'  : func,
+            'inputs': list(inputs),
+            'output': output,
+            'args'  : args,
+            'kwargs': kwargs}
+
+
+def status(job):
+    """
+    Returns 'missing' if a data file of a job does not exist, 'uptodate' if
+    its PNG is newer than all of its data files, and 'stale' otherwise.
+    """
+    for fname in job['inputs']:
+        if not os.path.exists(fname):
+            return 'missing'
+    if not os.path.isfile(job['output']):
+        return 'stale'
+    mtime = os.path.getmtime(job['output'])
+    for fname in job['inputs']:
+        if os.path.getmtime(fname) > mtime:
+            return 'stale'
+    return 'uptodate'
+
+
+def datafile(job):
+    """
+    Path/to/JSON file with the data returned by the function of a job: its
+    PNG with a .json extension.
+    """
+    return os.path.splitext(job['output'])[0] + '.json'
+
+
+def render(job):
+    """
+    Draws the plot of a job, in the current process. Saves what the
+    function returns, if not None, to datafile(job).
+    """
+    module, func = job['func'].rsplit('.', 1)
+    outdir = os.path.dirname(job['output'])
+    if outdir != '' and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    result = getattr(importlib.import_module(module), func)(*job['args'],
+                                                            **job['kwargs'])
+    if result is not None:
+        with open(datafile(job), 'w') as foo:
+            json.dump(result, foo, indent=1, sort_keys=True)
+    return result
+
+
+def _worker(job, queue):
+    try:
+        render(job)
+        queue.put((job['output'], None))
+    except Exception:
+        queue.put((job['output'], traceback.format_exc()))
+
+
+def _collect(queue, results):
+    # Messages of the finished jobs
+    while True:
+        try:
+            output, error = queue.get(timeout=0.05)
+        except Empty:
+            return
+        results[output] = 'done' if error is None else error
+
+
+def runjobs(jobs, ncpu=None, timeout=600, force=False):
+    """
+    Renders the plots of a list of jobs in parallel.
+
+    Inputs
+    ------
+    jobs   : list of dicts. Jobs, see job().
+    ncpu   : int.   Maximum number of plots drawn at once. Default is the
+                    number of CPUs.
+    timeout: float. Seconds after which a plot is stopped.
+    force  : bool.  If True, redraw up-to-date plots too.
+
+    Outputs
+    -------
+    results: dict. For the output of each job: 'done', 'uptodate', 'missing'
+                   (a data file does not exist), 'timeout', or the error
+                   message.
+    """
+    if ncpu is None:
+        ncpu = mp.cpu_count()
+
+    results = {}
+    pending = []
+    for jb in jobs:
+        stat = status(jb)
+        if stat == 'missing' or (stat == 'uptodate' and not force):
+            results[jb['output']] = stat
+        else:
+            pending.append(jb)
+    pending.reverse()
+
+    queue   = mp.Queue()
+    running = {}
+    while len(pending) > 0 or len(running) > 0:
+        # Start jobs up to the limit
+        while len(pending) > 0 and len(running) < ncpu:
+            jb   = pending.pop()
+            proc = mp.Process(target=_worker, args=(jb, queue))
+            proc.daemon = True
+            proc.start()
+            running[proc] = (jb, time.time())
+
+        _collect(queue, results)
+        for proc in list(running.keys()):
+            jb, start = running[proc]
+            if not proc.is_alive():
+                proc.join()
+                del running[proc]
+                _collect(queue, results)
+                if jb['output'] not in results:
+                    results[jb['output']] = 'exit code ' + str(proc.exitcode)
+            elif time.time() - start > timeout:
+                proc.terminate()
+                proc.join()
+                del running[proc]
+                results[jb['output']] = 'timeout'
+    return results
+
+
+def report(results):
+    """
+    Prints the result of each job. Returns the number of failed jobs.
+    """
+    nfail = 0
+    for output in sorted(results):
+        res = results[output]
+        if res in ['done', 'uptodate', 'missing']:
+            print("  " + res.ljust(8) + " " + output)
+        else:
+            nfail += 1
+            print("  failed   " + output + ": " + res.strip())
+    return nfail
+
+
+def main(modules=MODULES, ncpu=None, timeout=600, force=False):
+    """
+    Renders the plots listed by the jobs() function of each module, and
+    prints the summary of the modules that have a summary() function.
+    Returns the number of failed jobs.
+    """
+    jobs = {}
+    for module in modules:
+        jobs[module] = importlib.import_module(module).jobs()
+    results = runjobs([jb for module in modules for jb in jobs[module]],
+                      ncpu, timeout, force)
+    nfail   = report(results)
+    for module in modules:
+        if hasattr(sys.modules[module], 'summary'):
+            sys.modules[module].summary(jobs[module])
+    return nfail
+
+
+if __name__ == '__main__':
+    args    = sys.argv[1:]
+    ncpu    = None
+    timeout = 600
+    force   = '--force' in args
+    if force:
+        args.remove('--force')
+    if '--ncpu' in args:
+        i    = args.index('--ncpu')
+        ncpu = int(args[i+1])
+        del args[i:i+2]
+    if '--timeout' in args:
+        i       = args.index('--timeout')
+        timeout = float(args[i+1])
+        del args[i:i+2]
+    nfail = main(args or MODULES, ncpu, timeout, force)
+    sys.exit(int(nfail > 0))
@@ -0,0 +1,106 @@
+import numpy as np
+
+"""
+This file contains a class to compute percentiles along the first axis of
+data that arrive in chunks, e.g., the PT profiles of an MCMC posterior read
+with mc3out.chunks().
+
+In exact mode the chunks are kept and the percentiles are computed with a
+single partition of the data. In approximate mode each column is binned into
+a histogram of fixed bin width `tol`, so that memory does not depend on the
+number of samples and each percentile is off by at most `tol`.
+"""
+
+class StreamQuantiles(object):
+    """
+    Percentiles of a stream of (nsamples, ncols) chunks, for each column.
+
+    Example
+    -------
+    sq = StreamQuantiles([2.5, 16, 50, 84, 97.5], tol=0.5)
+    for chunk in chunks:
+        sq.update(chunk)
+    low2, low1, median, hi1, hi2 = sq.result()
+    """
+    def __init__(self, q=(2.5, 16.0, 50.0, 84.0, 97.5), tol=None):
+        """
+        Inputs
+        ------
+        q  : array. Percentiles to compute, between 0 and 100.
+        tol: float. Bin width of the histograms, in units of the data. Each
+                    percentile is within `tol` of the exact one. If None,
+                    compute exact percentiles (memory grows with the number
+                    of samples).
+        """
+        self.q      = np.atleast_1d(np.asarray(q, dtype=float))
+        self.tol    = tol
+        self.n      = 0
+        self.chunks = []
+        # Histogram: counts[j, i] is the number of samples of column j in
+        # [(lo+i)*tol, (lo+i+1)*tol)
+        self.counts = None
+        self.lo     = 0
+
+    def update(self, chunk):
+        """
+        Adds a chunk of samples.
+
+        Inputs
+        ------
+        chunk: 2D array. Shape (nsamples, ncols).
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        if chunk.ndim == 1:
+            chunk = chunk[:, None]
+        if len(chunk) == 0:
+            return
+        self.n += len(chunk)
+        if self.tol is None:
+            self.chunks.append(chunk)
+            return
+
+        ncols = chunk.shape[1]
+        ibin  = np.floor(chunk / self.tol).astype(np.int64)
+        lo, hi = ibin.min(), ibin.max() + 1
+        # Grow the histograms to cover the new range
+        if self.counts is None:
+            self.counts = np.zeros((ncols, hi - lo), np.int64)
+            self.lo     = lo
+        elif lo < self.lo or hi > self.lo + self.counts.shape[1]:
+            newlo  = min(lo, self.lo)
+            newhi  = max(hi, self.lo + self.counts.shape[1])
+            counts = np.zeros((ncols, newhi - newlo), np.int64)
+            start  = self.lo - newlo
+            counts[:, start:start+self.counts.shape[1]] = self.counts
+            self.counts, self.lo = counts, newlo
+
+        nbins = self.counts.shape[1]
+        flat  = (ibin - self.lo) + np.arange(ncols) * nbins
+        self.counts += np.bincount(flat.ravel(),
+                                   minlength=ncols*nbins).reshape(ncols, nbins)
+
+    def result(self):
+        """
+        Computes the percentiles of all samples added so far.
+
+        Outputs
+        -------
+        percentiles: 2D array. Shape (len(q), ncols).
+        """
+        if self.n == 0:
+            raise ValueError("No samples were added.")
+        if self.tol is None:
+            if len(self.chunks) > 1:
+                self.chunks = [np.concatenate(self.chunks)]
+            return np.percentile(self.chunks[0], self.q, axis=0)
+
+        # Interpolate linearly within the bin that holds each percentile
+        cumul  = np.cumsum(self.counts, axis=1)
+        target = self.q[:, None, None] / 100. * self.n
+        ibin   = np.sum(cumul[None] < target, axis=2)
+        ibin   = np.minimum(ibin, self.counts.shape[1] - 1)
+        cols   = np.arange(self.counts.shape[0])
+        count  = self.counts[cols, ibin]
+        before = cumul[cols, ibin] - count
+        frac   = np.clip((target[:,:,0] - before) / np.maximum(count, 1), 0, 1)
+        return (self.lo + ibin + frac) * self.tol
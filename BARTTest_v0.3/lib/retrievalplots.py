@@ -2,6 +2,7 @@
 
 import sys, os
 import numpy as np
+import plotjobs
 import matplotlib.pyplot as plt
 import scipy.constants as const
 sys.path.append("../../BART/code/")
@@ -10,9 +11,9 @@ import constants as c
 import bestFit as bf
 import makeatm as ma
 import PT as pt
-
-
-plt.ion()
+import mc3out
+import quantiles
+import cache
 
 
 def readatm(atmfile):
@@ -26,11 +27,8 @@ def readatm(atmfile):
     # Find where the layer data starts
     for i in range(len(lines)):
         line = lines[i].split()
-        try:
-            if line[0] == '#Radius':
-                break
-        except:
-            continue
+        if len(line) > 0 and line[0] == '#Radius':
+            break
 
     # Trim atm file
     lines = lines[i + 1:]
@@ -55,8 +53,137 @@ def readatm(atmfile):
     return mols, atminfo
 
 
+def batchPT(pressure, PTparams, R_star, T_star, T_int, sma, grav, 
+            chunksize=100000):
+    """
+    Evaluates the Line et al. (2013) PT profile for many sets of parameters 
+    in one broadcast computation per chunk.
+
+    Inputs
+    ------
+    pressure : 1D array. Pressure of each layer (bars).
+    PTparams : 2D array. Shape (nsamples, 5). log10(kappa), log10(gamma1), 
+                         log10(gamma2), alpha, and beta of each sample.
+    R_star, T_star, T_int, sma, grav: floats. As for PT.PT_line().
+    chunksize: int.      Maximum number of samples evaluated at once, to 
+                         bound the size of the temporary arrays.
+
+    Outputs
+    -------
+    PTprofiles: 2D array. Shape (nsamples, nlayers). Temperature of each 
+                          layer for each sample.
+    """
+    PTprofiles = np.zeros((len(PTparams), len(pressure)))
+    for i in range(0, len(PTparams), chunksize):
+        PTprofiles[i:i+chunksize] = chunkPT(pressure, PTparams[i:i+chunksize], 
+                                            R_star, T_star, T_int, sma, grav)
+    return PTprofiles
+
+
+def chunkPT(pressure, PTparams, R_star, T_star, T_int, sma, grav):
+    """
+    Evaluates the Line et al. (2013) PT profile for a chunk of samples. 
+    PT.PT_line() is elementwise, so passing the parameters as columns 
+    broadcasts it over all samples and layers at once.
+
+    Inputs and outputs are as for batchPT().
+    """
+    kappa, gamma1, gamma2, alpha, beta = [np.asarray(par)[:, None] 
+                                          for par in np.transpose(PTparams)]
+    return pt.PT_line(pressure, kappa,  gamma1, gamma2, alpha, beta, 
+                      R_star,   T_star, T_int,  sma,    grav)
+
+
+def iterPT(pressure, chunks, R_star, T_star, T_int, sma, grav):
+    """
+    Yields the PT profiles of a stream of posterior chunks, e.g., from 
+    mc3out.chunks(), so that memory stays bounded.
+
+    Inputs
+    ------
+    chunks: iterable. Arrays of shape (nparams, nsamples) whose first 5 rows 
+                      are the PT parameters.
+    See batchPT() for the rest.
+
+    Outputs
+    -------
+    PTprofiles: 2D array. Shape (nsamples, nlayers) for each chunk.
+    """
+    for chunk in chunks:
+        yield chunkPT(pressure, np.transpose(chunk[:5]), 
+                      R_star, T_star, T_int, sma, grav)
+
+
+def PTbands(data, pressure, R_star, T_star, T_int, sma, grav, tol=None):
+    """
+    Computes the 2.5, 16, 50, 84, and 97.5 percentiles of the posterior PT 
+    profiles at each layer.
+
+    Inputs
+    ------
+    data    : 3D array. Shape (nchains, 5, niter). PT parameters of the 
+                        posterior, see mc3out.load(). A 2D array of shape 
+                        (5, nsamples) is an already-stacked posterior, see 
+                        mc3out.flatten().
+    pressure: 1D array. Pressure of each layer (bars).
+    R_star, T_star, T_int, sma, grav: floats. As for PT.PT_line().
+    tol     : float.    If not None, estimate the percentiles from a stream 
+                        of posterior chunks, to within `tol` K, without 
+                        holding every PT profile in memory. Default is exact.
+
+    Outputs
+    -------
+    bands   : 2D array. Shape (5, nlayers).
+    """
+    if np.ndim(data) == 2:
+        # One stacked chain
+        data = data[None]
+    if tol is None:
+        # Make datacube of the PT parameters from MCMC data
+        data_stack = data[0] if len(data) == 1 else mc3out.flatten(data)
+        PTprofiles = [batchPT(pressure, data_stack.T, 
+                              R_star, T_star, T_int, sma, grav)]
+    else:
+        PTprofiles = iterPT(pressure, mc3out.chunks(data), 
+                            R_star, T_star, T_int, sma, grav)
+
+    bands = quantiles.StreamQuantiles([2.5, 16.0, 50.0, 84.0, 97.5], tol)
+    for profiles in PTprofiles:
+        bands.update(profiles)
+    return bands.result()
+
+
+def PTbandsfile(output, burnin, nPTparams, pressure, 
+                R_star, T_star, T_int, sma, grav, tol=None):
+    """
+    PTbands() of the posterior in an MC3 output.npy file.
+
+    Inputs
+    ------
+    output   : string. Path/to/output.npy file from MC3.
+    burnin   : int.    Number of burned iterations per chain.
+    nPTparams: int.    Number of PT parameters, the first ones of the file.
+    See PTbands() for the rest.
+    """
+    data = mc3out.load(output, burnin)
+    return PTbands(data[:, :nPTparams], pressure, 
+                   R_star, T_star, T_int, sma, grav, tol)
+
+
+def resultsdir(datadir):
+    """
+    Results directory of BARTTest corresponding to a data directory within 
+    code-output/.
+    """
+    if 'code-output' not in datadir:
+        raise ValueError("Data directory not located within BARTTest. " +
+                         "Please specify an output directory `outdir`.")
+    outdir = 'results'.join(datadir.rsplit('code-output', 1))
+    return outdir.rsplit('/', 2)[0] + '/'
+
+
 def retrievedPT(datadir, atmfile, tepfile, nmol, solution, 
-                outname, outdir=None, T_int=100.):
+                outname, outdir=None, T_int=100., tol=None):
     """
     Inputs
     ------
@@ -70,20 +197,17 @@ def retrievedPT(datadir, atmfile, tepfile, nmol, solution,
                       to the results directory of BARTTest if `datadir` is 
                       within BARTTest.
     T_int:    float.  Internal planetary temperature. Default is 100 K.
+    tol:      float.  If not None, estimate the credible regions from a 
+                      stream of posterior chunks, to within `tol` K, without 
+                      holding every PT profile in memory. Default is exact.
     """
     # Set outdir if not specified
     if outdir == None:
-        try:
-            if datadir[-1] != '/':
-                datadir = datadir + '/'
-            outdir = 'results'.join(datadir.rsplit('code-output',            \
-                                                   1)).rsplit('/', 2)[0] + '/'
-            if not os.path.isdir(outdir):
-                os.makedirs(outdir)
-        except:
-            print("Data directory not located within BARTTest.")
-            print("Please specify an output directory `outdir` and try again.")
-            sys.exit(1)
+        if datadir[-1] != '/':
+            datadir = datadir + '/'
+        outdir = resultsdir(datadir)
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
 
     # Read g_surf and R_planet from TEP file
     grav, Rp = ma.get_g(tepfile)
@@ -103,7 +227,7 @@ def retrievedPT(datadir, atmfile, tepfile, nmol, solution,
     foo   = open(MCfile, 'r')
     lines = foo.readlines()
     foo.close()
-    line = filter(lambda x: " Burned in iterations per chain:" in x, lines)
+    line = [x for x in lines if " Burned in iterations per chain:" in x]
     burnin = int(line[0].split()[-1])
 
     # Figure out number of parameters
@@ -117,42 +241,15 @@ def retrievedPT(datadir, atmfile, tepfile, nmol, solution,
     best_T = pt.PT_line(pressure, kappa,  gamma1, gamma2, alpha, beta, 
                         R_star,   T_star, T_int,  sma,    grav*1e2)
 
-    # Load MCMC data
+    # Get percentiles (for 1, 2-sigma boundaries), reusing cached results
     MCMCdata = datadir + 'output.npy'
-    data     = np.load(MCMCdata)
-    nchains, npars, niter = np.shape(data)
-
-    # Make datacube from MCMC data
-    data_stack = data[0,:,burnin:]
-    for c in np.arange(1, nchains):
-        data_stack = np.hstack((data_stack, data[c, :, burnin:]))
-
-    # Datacube of PT profiles
-    PTprofiles = np.zeros((np.shape(data_stack)[1], len(pressure)))
-
-    curr_PTparams = PTparams
-
-    for k in np.arange(0, np.shape(data_stack)[1]):
-        j = 0
-        for i in np.arange(len(PTparams)):
-            curr_PTparams[i] = data_stack[j,k]
-            j +=1
-        kappa, gamma1, gamma2, alpha, beta = curr_PTparams
-        PTprofiles[k] = pt.PT_line(pressure, 
-                                   kappa,  gamma1, gamma2, alpha, beta,
-                                   R_star, T_star, T_int,  sma,   grav*1e2)
-
-
-    # Get percentiles (for 1, 2-sigma boundaries):
-    low1 = np.percentile(PTprofiles, 16.0, axis=0)
-    hi1  = np.percentile(PTprofiles, 84.0, axis=0)
-    low2 = np.percentile(PTprofiles,  2.5, axis=0)
-    hi2  = np.percentile(PTprofiles, 97.5, axis=0)
-    median = np.median(PTprofiles, axis=0)
+    low2, low1, median, hi1, hi2 = cache.call(PTbandsfile, [MCMCdata], 
+                                              MCMCdata, burnin, nPTparams, 
+                                              pressure, R_star, T_star, 
+                                              T_int, sma, grav*1e2, tol)
 
     # Plot and save figure
-    plt.figure(2)
-    plt.clf()
+    plt.figure()
     ax=plt.subplot(111)
     ax.fill_betweenx(pressure, low2, hi2, facecolor="#62B1FF", edgecolor="0.5")
     ax.fill_betweenx(pressure, low1, hi1, facecolor="#1873CC",
@@ -188,13 +285,7 @@ def retrievedabun(datadir, outname, atminput,
         datadir = datadir + '/'
     # Set outdir if not specified. If it is, ensure trailing /
     if outdir == None:
-        try:
-            outdir = 'results'.join(datadir.rsplit('code-output',            \
-                                                   1)).rsplit('/', 2)[0] + '/'
-        except:
-            print("Data directory not located within BARTTest.")
-            print("Please specify an output directory `outdir` and try again.")
-            sys.exit(1)
+        outdir = resultsdir(datadir)
     elif outdir[-1] != '/':
         outdir = outdir + '/'
     # Ensure outdir exists
@@ -213,13 +304,11 @@ def retrievedabun(datadir, outname, atminput,
             'green', 'blue', 'red', 'purple', 'lime', 'black', 'maroon', 'aqua']
 
     # Plot abundances
+    plt.figure()
     for i in range(len(molrs)):
-        if molrs[i] in ignore:
-            continue
-        try:
-            ind = molin.index(molrs[i])
-        except:
+        if molrs[i] in ignore or molrs[i] not in molin:
             continue
+        ind = molin.index(molrs[i])
         plt.plot(atmin[:,ind+3], atmin[:,1], ls='--', lw=2, \
                  color=cols[i], label='Input '+molin[ind])
         plt.plot(atmrs[:,i  +3], atmrs[:,1], ls='-', lw=2, color=cols[i], \
@@ -236,122 +325,38 @@ def retrievedabun(datadir, outname, atminput,
     plt.close()
 
 
-if __name__ == '__main__':
-    # Common inputs
-    datadirbase = '../code-output/01BART/'
-    testdirbase = '../tests/'
-    tepfile     = '../tests/00inputs/HD189733b.tep'
-    outdir      = '../results/01BART/'
-    # Make the plots
-    print('Plotting the PT profiles...\n')
-    try:
-        print('  s01hjcleariso...\n')
-        retrievedPT(datadirbase+'s01hjcleariso-ecl/', 
-                    testdirbase+'c01hjcleariso/iso.tea', 
-                    tepfile, 5, 'eclipse', 's01hjcleariso-ecl-PT.png', outdir)
-    except Exception as e:
-        print(e)
-        pass
-
-    try:
-        retrievedPT(datadirbase+'s01hjcleariso-tra/', 
-                    testdirbase+'c01hjcleariso/iso.tea', 
-                    tepfile, 5, 'transit', 's01hjcleariso-tra-PT.png', outdir)
-    except Exception as e:
-        print(e)
-        pass
-
-    try:
-        print('  s02hjclearnoinv...\n')
-        retrievedPT(datadirbase+'s02hjclearnoinv-ecl/', 
-                    testdirbase+'c02hjclearnoinv/noinv.tea', 
-                    tepfile, 5, 'eclipse', 's02hjclearnoinv-ecl-PT.png', outdir)
-    except Exception as e:
-        print(e)
-        pass
-
-    try:
-        retrievedPT(datadirbase+'s02hjclearnoinv-tra/', 
-                    testdirbase+'c02hjclearnoinv/noinv.tea', 
-                    tepfile, 5, 'transit', 's02hjclearnoinv-tra-PT.png', outdir)
-    except Exception as e:
-        print(e)
-        pass
-
-    try:
-        print('  s03hjclearinv...\n')
-        retrievedPT(datadirbase+'s03hjclearinv-ecl/', 
-                    testdirbase+'c03hjclearinv/inv.tea', 
-                    tepfile, 5, 'eclipse', 's03hjclearinv-ecl-PT.png', outdir)
-    except Exception as e:
-        print(e)
-        pass
-
-    try:
-        retrievedPT(datadirbase+'s03hjclearinv-tra/', 
-                    testdirbase+'c03hjclearinv/inv.tea', 
-                    tepfile, 5, 'transit', 's03hjclearinv-tra-PT.png', outdir)
-    except Exception as e:
-        print(e)
-        pass
-
-    print('Plotting the vertical abundance profiles...\n')
-
-    try:
-        print('  s01hjcleariso...\n')
-        retrievedabun(datadirbase+'s01hjcleariso-ecl/', 
-                      's01hjcleariso-ecl-abun.png', 
-                      testdirbase+'c01hjcleariso/iso.tea', 
-                      outdir=outdir)
-    except Exception as e:
-        print(e)
-        pass
-
-    try:
-        retrievedabun(datadirbase+'s01hjcleariso-tra/', 
-                      's01hjcleariso-tra-abun.png', 
-                      testdirbase+'c01hjcleariso/iso.tea', 
-                      outdir=outdir)
-    except Exception as e:
-        print(e)
-        pass
-
-    try:
-        print('  s02hjclearnoinv...\n')
-        retrievedabun(datadirbase+'s02hjclearnoinv-ecl/', 
-                      's02hjclearnoinv-ecl-abun.png', 
-                      testdirbase+'c02hjclearnoinv/noinv.tea', 
-                      outdir=outdir)
-    except Exception as e:
-        print(e)
-        pass
-
-    try:
-        retrievedabun(datadirbase+'s02hjclearnoinv-tra/', 
-                      's02hjclearnoinv-tra-abun.png', 
-                      testdirbase+'c02hjclearnoinv/noinv.tea', 
-                      outdir=outdir)
-    except Exception as e:
-        print(e)
-        pass
-
-    try:
-        print('  s03hjclearinv...\n')
-        retrievedabun(datadirbase+'s03hjclearinv-ecl/', 
-                      's03hjclearinv-ecl-abun.png', 
-                      testdirbase+'c03hjclearinv/inv.tea', 
-                      outdir=outdir)
-    except Exception as e:
-        print(e)
-        pass
-
-    try:
-        retrievedabun(datadirbase+'s03hjclearinv-tra/', 
-                      's03hjclearinv-tra-abun.png', 
-                      testdirbase+'c03hjclearinv/inv.tea', 
-                      outdir=outdir)
-    except Exception as e:
-        print(e)
-        pass
+def jobs(datadirbase='../code-output/01BART/', testdirbase='../tests/', 
+         tepfile='../tests/00inputs/HD189733b.tep', 
+         outdir='../results/01BART/'):
+    """
+    Lists the PT and abundance profile plots of the synthetic retrievals as 
+    plot jobs (see plotjobs.py).
+    """
+    job     = plotjobs.job
+    joblist = []
+    for test, atm in [('s01hjcleariso',   'c01hjcleariso/iso.tea'), 
+                      ('s02hjclearnoinv', 'c02hjclearnoinv/noinv.tea'), 
+                      ('s03hjclearinv',   'c03hjclearinv/inv.tea')]:
+        for geo, solution in [('ecl', 'eclipse'), ('tra', 'transit')]:
+            name    = test + '-' + geo
+            datadir = datadirbase + name + '/'
+            atmfile = testdirbase + atm
+            joblist.append(job('retrievalplots.retrievedPT', 
+                               [datadir + 'output.npy', datadir + 'MCMC.log', 
+                                atmfile, tepfile], 
+                               outdir + name + '-PT.png', 
+                               datadir, atmfile, tepfile, 5, solution, 
+                               name + '-PT.png', outdir))
+            joblist.append(job('retrievalplots.retrievedabun', 
+                               [datadir + 'bestFit.atm', atmfile], 
+                               outdir + name + '-abun.png', 
+                               datadir, name + '-abun.png', atmfile, 
+                               outdir=outdir))
+    return joblist
 
 
+if __name__ == '__main__':
+    # Make the plots
+    print('Plotting the PT and vertical abundance profiles...\n')
+    results = plotjobs.runjobs(jobs())
+    sys.exit(int(plotjobs.report(results) > 0))
@@ -0,0 +1,110 @@
+import os
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+"""
+This file contains functions to read and write Transit configuration (.trc)
+files, and to run many Transit instances in parallel.
+
+Each Transit run is an external process; a pool of `ncpu` threads bounds how
+many of them run at once. runtransit() yields each run as it finishes, so
+that its spectrum can be analyzed while the others are still running.
+"""
+
+# Transit executable
+TRANSIT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '../../BART/modules/transit/transit/transit')
+
+
+def readtrc(trcfile):
+    """
+    Reads the arguments of a Transit configuration file.
+
+    Inputs
+    ------
+    trcfile: string. Path/to/.trc file.
+
+    Outputs
+    -------
+    args   : dict. Value (as a string) of each argument set in the file.
+    """
+    args = {}
+    with open(trcfile, 'r') as foo:
+        for line in foo:
+            fields = line.split(None, 1)
+            if len(fields) == 0 or fields[0][0] in '#;':
+                continue
+            args[fields[0]] = fields[1].strip() if len(fields) > 1 else ''
+    return args
+
+
+def writetrc(template, trcfile, args):
+    """
+    Writes a Transit configuration file from a template, replacing the
+    values of some arguments. Arguments missing from the template are added
+    at the end.
+
+    Inputs
+    ------
+    template: string. Path/to/template .trc file.
+    trcfile : string. Path/to/output .trc file.
+    args    : dict.   New value of each argument to replace.
+    """
+    missing = dict(args)
+    lines   = []
+    with open(template, 'r') as foo:
+        for line in foo:
+            fields = line.split(None, 1)
+            if len(fields) > 0 and fields[0] in args:
+                width = len(line) - len(line.lstrip()) + len(fields[0])
+                gap   = len(line[width:]) - len(line[width:].lstrip())
+                line  = line[:width] + ' '*max(gap, 1) +                      \
+                        str(args[fields[0]]) + '\n'
+                missing.pop(fields[0], None)
+            lines.append(line)
+    for key in missing:
+        lines.append(key + ' ' + str(missing[key]) + '\n')
+    with open(trcfile, 'w') as foo:
+        foo.writelines(lines)
+
+
+def _run(job):
+    trcfile, cwd, transit, logfile = job
+    with open(logfile, 'w') as log:
+        code = subprocess.call([transit, '-c', trcfile], cwd=cwd,
+                               stdout=log, stderr=subprocess.STDOUT)
+    return trcfile, code
+
+
+def runtransit(trcfiles, cwd='.', ncpu=None, transit=TRANSIT):
+    """
+    Runs Transit on several configuration files in parallel.
+
+    Inputs
+    ------
+    trcfiles: list of strings. Configuration files, relative to `cwd`.
+    cwd     : string. Directory where Transit runs (paths in the
+                       configuration files are relative to it).
+    ncpu    : int.    Maximum number of Transit runs at once. Default is
+                      the number of CPUs.
+    transit : string. Path/to/Transit executable.
+
+    Outputs
+    -------
+    Yields (trcfile, outspec, returncode) of each run as it finishes.
+    `outspec` is the path of the output spectrum, relative to the current
+    directory. The output of each run is logged to <trcfile>.log in `cwd`.
+    """
+    jobs = [(trcfile, cwd, os.path.abspath(transit),
+             os.path.join(cwd, os.path.splitext(trcfile)[0] + '.log'))
+            for trcfile in trcfiles]
+    pool = ThreadPool(ncpu)
+    try:
+        for trcfile, code in pool.imap_unordered(_run, jobs):
+            outspec = readtrc(os.path.join(cwd, trcfile)).get('outspec')
+            if outspec is not None:
+                outspec = os.path.normpath(os.path.join(cwd, outspec))
+            yield trcfile, outspec, code
+    finally:
+        pool.close()
+        pool.join()
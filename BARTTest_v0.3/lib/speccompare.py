@@ -0,0 +1,215 @@
+import numpy as np
+import specio
+
+"""
+This file contains the engine of the cross-code spectrum comparisons (see
+comparison.py): vectorized readers of each code's output, a flux-conserving
+rebinning of a high-resolution spectrum onto a coarser grid, and residual
+statistics returned as data.
+
+rebin() averages the spectrum over each bin of the new grid, using the exact
+integral of its linear interpolant, instead of sampling it at the bin
+centers. At Transit's resolution (thousands of samples per DDART bin), point
+sampling picks up whatever line happens to fall on the bin center, while the
+bin average is what the coarser code computes.
+"""
+
+# Speed of light (cm/s), converts DDART fluxes per Hz to fluxes per cm-1
+C = 2.998e10
+
+
+def readddart(fname, geo='eclipse'):
+    """
+    Reads a DDART spectrum: three header lines, then the index, wavelength,
+    and flux of each sample.
+
+    Inputs
+    ------
+    fname: string. Path/to/DDART spectrum file.
+    geo  : string. Viewing geometry. 'eclipse' or 'transit'
+
+    Outputs
+    -------
+    wlength: 1D array. Wavelengths (um).
+    flux   : 1D array. Fluxes (erg s-1 cm-1), or modulation for transit.
+    """
+    wlength, flux = np.loadtxt(fname, skiprows=3, usecols=(1, 2), unpack=True,
+                               ndmin=2)
+    if geo == 'eclipse':
+        flux = flux * C
+    elif geo == 'transit':
+        flux = flux / 100.
+    else:
+        raise ValueError("Wrong `geo` specification. Use 'transit' or " +
+                         "'eclipse'.")
+    return wlength, flux
+
+
+def readtransit(fname):
+    """
+    Reads a Transit spectrum (wavelengths in um, and fluxes). See specio.py.
+    """
+    return specio.readspectrum(fname, 0)
+
+
+def binedges(grid):
+    """
+    Edges of the bins centered on each point of a grid: the midpoints
+    between neighbors, and half a step beyond the first and last points.
+
+    Inputs
+    ------
+    grid : 1D array. Increasing bin centers.
+
+    Outputs
+    -------
+    edges: 1D array. len(grid) + 1 bin edges.
+    """
+    mid = 0.5 * (grid[1:] + grid[:-1])
+    return np.concatenate(([grid[0] - (mid[0] - grid[0])], mid,
+                           [grid[-1] + (grid[-1] - mid[-1])]))
+
+
+def cumintegral(x, y, xnew):
+    """
+    Integral from x[0] to each `xnew` of the linear interpolant of (x, y).
+
+    Inputs
+    ------
+    x   : 1D array. Increasing abscissas.
+    y   : 1D array. Values at `x`.
+    xnew: 1D array. Upper limits of the integrals, within [x[0], x[-1]].
+
+    Outputs
+    -------
+    integ: 1D array. Integrals at `xnew`.
+    """
+    dx    = np.diff(x)
+    cumul = np.concatenate(([0.0], np.cumsum(0.5 * dx * (y[1:] + y[:-1]))))
+    i     = np.clip(np.searchsorted(x, xnew, side='right') - 1, 0, len(x) - 2)
+    slope = (y[i+1] - y[i]) / dx[i]
+    d     = xnew - x[i]
+    return cumul[i] + d * (y[i] + 0.5 * slope * d)
+
+
+def rebin(wave, flux, newwave):
+    """
+    Flux-conserving rebinning: the average of the linear interpolant of a
+    spectrum over each bin of a new grid (see binedges()). Bins that extend
+    beyond the spectrum are averaged over the part it covers; bins outside
+    of it are NaN.
+
+    Inputs
+    ------
+    wave   : 1D array. Wavelengths (or wavenumbers) of the spectrum, in
+                       either order.
+    flux   : 1D array. Spectrum.
+    newwave: 1D array. Bin centers of the new grid, in either order.
+
+    Outputs
+    -------
+    newflux: 1D array. Spectrum averaged in each bin of `newwave`, in the
+                       order of `newwave`.
+    """
+    isort = np.argsort(wave)
+    wave  = np.asarray(wave, dtype=float)[isort]
+    flux  = np.asarray(flux, dtype=float)[isort]
+    jsort = np.argsort(newwave)
+    edges = np.clip(binedges(np.asarray(newwave, dtype=float)[jsort]),
+                    wave[0], wave[-1])
+
+    integ = cumintegral(wave, flux, edges)
+    width = np.diff(edges)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg = np.where(width > 0, np.diff(integ) / width, np.nan)
+
+    newflux        = np.empty(len(avg))
+    newflux[jsort] = avg
+    return newflux
+
+
+def resample(wave, flux, newwave, rtol=1e-6):
+    """
+    Returns `flux` on the grid `newwave`: unchanged if the grids match to
+    `rtol`, else rebinned with rebin().
+    """
+    if len(wave) == len(newwave) and np.allclose(wave, newwave, rtol=rtol,
+                                                 atol=0):
+        return np.asarray(flux, dtype=float)
+    return rebin(wave, flux, newwave)
+
+
+def residuals(wave, flux1, flux2, bands=None):
+    """
+    Residuals between two spectra on the same grid, in % of the maximum of
+    both spectra, and their statistics.
+
+    Inputs
+    ------
+    wave : 1D array. Wavelengths (um).
+    flux1: 1D array. First spectrum.
+    flux2: 1D array. Second spectrum.
+    bands: list of (lo, hi) wavelength ranges for the per-band statistics.
+           Default is 1 um bands covering `wave`.
+
+    Outputs
+    -------
+    resid: 1D array. (flux1 - flux2) / max * 100. NaN where either spectrum
+                     is undefined.
+    stats: dict. 'max' (largest absolute residual), 'rms', and 'mean' of
+                 the residuals, 'npts' compared, and 'bands': a list with
+                 the same statistics for each band plus its 'lo' and 'hi'.
+    """
+    resid = (flux1 - flux2) / np.nanmax(np.concatenate((flux1, flux2))) * 100
+    good  = np.isfinite(resid)
+
+    if bands is None:
+        edges = np.arange(np.floor(np.nanmin(wave)),
+                          np.ceil(np.nanmax(wave)) + 1)
+        bands = list(zip(edges[:-1], edges[1:]))
+
+    stats = _stats(resid[good])
+    stats['bands'] = []
+    for lo, hi in bands:
+        band = _stats(resid[good & (wave >= lo) & (wave < hi)])
+        band['lo'] = float(lo)
+        band['hi'] = float(hi)
+        stats['bands'].append(band)
+    return resid, stats
+
+
+def _stats(resid):
+    if len(resid) == 0:
+        return {'max':np.nan, 'rms':np.nan, 'mean':np.nan, 'npts':0}
+    return {'max' : float(np.amax(np.abs(resid))),
+            'rms' : float(np.sqrt(np.mean(resid**2))),
+            'mean': float(np.mean(resid)),
+            'npts': int(len(resid))}
+
+
+def compare(transit, other, geo='eclipse', bands=None):
+    """
+    Compares a Transit spectrum with a DDART (or other RT code) spectrum,
+    rebinning the Transit spectrum onto the other code's grid.
+
+    Inputs
+    ------
+    transit: string. path/to/file for transit spectrum data.
+    other  : string. path/to/file for DDART spectrum data.
+    geo    : string. Viewing geometry. 'eclipse' or 'transit'
+    bands  : list of (lo, hi) wavelength ranges (um). See residuals().
+
+    Outputs
+    -------
+    result : dict. 'wlength' and 'flux' of the Transit spectrum, 'wlengthb'
+                   and 'fluxb' of the other spectrum, 'resamp' (the Transit
+                   spectrum rebinned onto `wlengthb`), 'resid', and 'stats'
+                   (see residuals()).
+    """
+    wlength,  flux  = readtransit(transit)
+    wlengthb, fluxb = readddart(other, geo)
+    resamp       = resample(wlength, flux, wlengthb)
+    resid, stats = residuals(wlengthb, resamp, fluxb, bands)
+    return {'wlength' :wlength,  'flux' :flux,
+            'wlengthb':wlengthb, 'fluxb':fluxb,
+            'resamp'  :resamp,   'resid':resid, 'stats':stats}
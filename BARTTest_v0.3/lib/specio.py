@@ -0,0 +1,118 @@
+import sys, os
+import json
+import tempfile
+import numpy as np
+sys.path.append("../../BART/modules/transit/scripts/")
+import readtransit as rt
+
+"""
+This file contains a reader for Transit spectrum files that keeps a binary
+copy of each spectrum, so that the text is parsed only once.
+
+The first time a spectrum, e.g., iso_emission_spectrum.dat, is read, it is
+parsed with readtransit.readspectrum() and saved next to it as
+iso_emission_spectrum.dat.npy, a (2, nwave) array of wavelengths (um) and
+fluxes, plus iso_emission_spectrum.dat.json, with the header, units, and
+geometry. Later reads memory-map the .npy file. The binary copy is remade
+when the text file is newer. If it cannot be written, the text is read as
+before. Both files are written under temporary names and renamed, the .npy
+last, so that a concurrent reader never maps a partial array, nor finds a
+new array next to an old sidecar.
+"""
+
+def binfiles(fname):
+    """
+    Paths of the binary copy and its sidecar for a spectrum text file.
+    """
+    return fname + '.npy', fname + '.json'
+
+
+def _write(fname, write):
+    # Write with write(fileobject) to a temporary file in the same directory,
+    # then rename it, so that readers never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fname)),
+                               prefix='.' + os.path.basename(fname) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as foo:
+            write(foo)
+        os.rename(tmp, fname)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def spectobin(fname):
+    """
+    Converts a Transit spectrum text file to its binary copy.
+
+    Inputs
+    ------
+    fname: string. Path/to/spectrum file.
+
+    Outputs
+    -------
+    spectrum: 2D array. Shape (2, nwave). Wavelengths (um) and fluxes.
+    """
+    wlength, flux = rt.readspectrum(fname, 0)
+    spectrum = np.array([wlength, flux], dtype=float)
+
+    with open(fname, 'r') as foo:
+        header = foo.readline().strip()
+    units = header.lstrip('#').split(None, 2)
+    meta  = {'source'   : os.path.basename(fname),
+             'header'   : header,
+             'columns'  : ['wavelength', 'flux'],
+             'wlunits'  : 'um',
+             'fluxunits': units[-1] if len(units) == 3 else '',
+             'geometry' : 'transit' if 'modulation' in header else 'eclipse'}
+
+    npyfile, jsonfile = binfiles(fname)
+    # The sidecar first: an up-to-date .npy implies an up-to-date sidecar
+    _write(jsonfile, lambda foo: foo.write(json.dumps(meta, indent=1).encode()))
+    _write(npyfile,  lambda foo: np.save(foo, spectrum))
+    return spectrum
+
+
+def readmeta(fname):
+    """
+    Reads the sidecar of a spectrum (header, units, and geometry),
+    converting the spectrum first if needed.
+    """
+    readspectrum(fname)
+    with open(binfiles(fname)[1], 'r') as foo:
+        return json.load(foo)
+
+
+def readspectrum(fname, wn=True):
+    """
+    Same as readtransit.readspectrum(), reading the binary copy of the
+    spectrum when it is up to date.
+
+    Inputs
+    ------
+    fname: string. Path/to/spectrum file.
+    wn   : bool.   If True, return wavenumbers (cm-1), else wavelengths (um).
+
+    Outputs
+    -------
+    wave : 1D array. Wavenumbers or wavelengths.
+    flux : 1D array. Fluxes.
+    """
+    npyfile, jsonfile = binfiles(fname)
+    try:
+        if os.path.getmtime(npyfile) < os.path.getmtime(fname) or            \
+           not os.path.isfile(jsonfile):
+            raise OSError
+        # Copy-on-write, so that callers may modify the arrays
+        spectrum = np.load(npyfile, mmap_mode='c')
+    except (IOError, OSError, ValueError):
+        try:
+            spectrum = spectobin(fname)
+        except (IOError, OSError):
+            # Cannot write the binary copy
+            return rt.readspectrum(fname, wn)
+
+    wlength, flux = spectrum
+    if wn:
+        return 1e4/wlength, flux
+    return wlength, flux
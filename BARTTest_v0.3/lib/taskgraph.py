@@ -0,0 +1,515 @@
+#! /usr/bin/env python
+
+import sys, os
+import json
+import time
+import hashlib
+import tempfile
+import subprocess
+import threading
+import multiprocessing as mp
+from collections import OrderedDict
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+import cache
+import runtransit as runt
+import tliregistry as tlireg
+
+"""
+This file runs the BARTTest tests as a graph of tasks, redoing only what
+changed since the last run, with independent tasks running concurrently.
+
+Each stage is a task with declared input and output files: pylineread turns
+line lists into a TLI file (from a .plc file), Transit computes a spectrum
+(from a .trc file), BART runs a retrieval (from a .brt file), and the
+analysis scripts and plots read the spectra. The inputs and outputs of the
+first three are read from their configuration files, so a task depends on
+the tasks that make its inputs.
+
+A task is up to date when its outputs exist and neither its command, nor
+the contents of its inputs (including its configuration file), nor its
+outputs changed since it last succeeded. The content digests are kept in
+cache/taskgraph.json. Tasks run as soon as their dependencies finish, as
+long as the sum of their CPUs is within the budget.
+
+The targets have the same names as in the Makefile.
+
+Usage: ./taskgraph.py [target ...] [--ncpu N] [--dry-run]
+"""
+
+# BARTTest directory, and executables
+ROOT       = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIBDIR     = os.path.join(ROOT, 'lib')
+TESTDIR    = os.path.join(ROOT, 'tests')
+TRANSIT    = os.path.normpath(runt.TRANSIT)
+BART       = os.path.normpath(os.path.join(ROOT, '..', 'BART', 'BART.py'))
+
+# Digests of the last successful run of each task, and logs of the tasks
+STATEFILE = os.path.join(cache.CACHEDIR, 'taskgraph.json')
+LOGDIR    = os.path.join(cache.CACHEDIR, 'logs')
+
+
+def _split(value, sep=None):
+    return [v for v in value.replace(',', ' ').split(sep) if v != '']
+
+
+def readconfig(cfgfile, section):
+    """
+    Reads a section of a .brt (ConfigParser) file as a dict.
+    """
+    config = configparser.RawConfigParser()
+    config.read(cfgfile)
+    return dict(config.items(section))
+
+
+class Task(object):
+    """
+    A command with declared input and output files.
+    """
+    def __init__(self, name, cmd, cwd, inputs=(), outputs=(), deps=(),
+                 ncpu=1, always=False, clean=True):
+        """
+        Inputs
+        ------
+        name   : string. Unique name of the task.
+        cmd    : list of strings. Command to run.
+        cwd    : string. Directory where the command runs.
+        inputs : list of strings. Files read by the command.
+        outputs: list of strings. Files written by the command.
+        deps   : list of strings. Names of tasks that must run first, besides
+                                  those that make the inputs.
+        ncpu   : int.  Number of CPUs used by the command.
+        always : bool. If True, the task always runs (e.g., it is
+                       incremental by itself).
+        clean  : bool. If True, the outputs are deleted before the command
+                       runs, so that it cannot reuse stale ones (e.g.,
+                       Transit reads an existing opacity file instead of
+                       recomputing it).
+        """
+        self.name    = name
+        self.cmd     = list(cmd)
+        self.cwd     = os.path.abspath(cwd)
+        self.inputs  = [os.path.abspath(f) for f in inputs]
+        self.outputs = [os.path.abspath(f) for f in outputs]
+        self.deps    = list(deps)
+        self.ncpu    = ncpu
+        self.always  = always
+        self.clean   = clean
+
+    def signature(self, hasher):
+        """
+        Digest of the command and of the contents of the inputs.
+
+        Inputs
+        ------
+        hasher: cache.Cache. Gives the content digest of a file.
+        """
+        h = hashlib.sha1()
+        cache.digest([self.cmd, os.path.relpath(self.cwd, ROOT)], h)
+        for fname in sorted(self.inputs):
+            # A missing input counts as a change once it appears
+            key = hasher.filekey(fname) if os.path.isfile(fname) else None
+            cache.digest([os.path.relpath(fname, ROOT), key], h)
+        return h.hexdigest()
+
+
+def plctask(plcfile):
+    """
+    Task that makes the TLI file of a pylineread configuration file, through
+    the registry of TLI files (see tliregistry.py). The registry replaces the
+    output itself, and may store an existing TLI file, so it is not deleted
+    beforehand.
+    """
+    plcdir = os.path.dirname(os.path.abspath(plcfile))
+    args   = tlireg.readplc(plcfile)
+    inputs = [plcfile] + args['db_list'] + [f for f in args['part_list']
+                                            if f != 'implicit']
+    if 'defn' in args:
+        inputs.append(args['defn'])
+    # The registry rebuilds the TLI file when pylineread changes
+    inputs += tlireg.sources()
+    return Task('tli:' + os.path.relpath(args['output'], ROOT),
+                [os.path.relpath(os.path.join(LIBDIR, 'tliregistry.py'),
+                                 plcdir), os.path.basename(plcfile)],
+                plcdir, inputs, [args['output']], clean=False)
+
+
+def trctask(trcfile):
+    """
+    Task that computes the spectrum of a Transit configuration file.
+    """
+    trcdir = os.path.dirname(os.path.abspath(trcfile))
+    args   = runt.readtrc(trcfile)
+    path   = lambda f: os.path.join(trcdir, f)
+    inputs = [trcfile] + [path(args[key]) for key in ['atm', 'linedb',
+                                                      'molfile']
+                          if key in args]
+    inputs += [path(f) for f in _split(args.get('csfile', ''))]
+    outputs = [path(args[key]) for key in ['outspec', 'outtoomuch',
+                                           'outsample', 'opacityfile']
+               if key in args]
+    return Task('spec:' + os.path.relpath(outputs[0], ROOT),
+                [os.path.relpath(TRANSIT, trcdir), '-c',
+                 os.path.basename(trcfile)], trcdir, inputs, outputs)
+
+
+def brttask(brtfile):
+    """
+    Task that runs the retrieval of a BART configuration file.
+    """
+    brtdir = os.path.dirname(os.path.abspath(brtfile))
+    args   = readconfig(brtfile, 'MCMC')
+    path   = lambda f: os.path.join(brtdir, f)
+    inputs = [brtfile]
+    for key in ['tep_name', 'kurucz', 'atmfile', 'linedb', 'abun_basic']:
+        if key in args:
+            inputs.append(path(args[key].strip()))
+    for key in ['csfile', 'filters']:
+        inputs += [path(f) for f in _split(args.get(key, ''))]
+    locdir  = path(args['loc_dir'])
+    outputs = [os.path.join(locdir, 'output.npy'),
+               os.path.join(locdir, args.get('logfile', 'MCMC.log'))]
+    return Task('brt:' + os.path.relpath(locdir, ROOT),
+                [os.path.relpath(BART, brtdir), '-c',
+                 os.path.basename(brtfile)], brtdir, inputs, outputs,
+                ncpu=int(float(args.get('nchains', 1))))
+
+
+class TaskGraph(object):
+    """
+    Tasks, the targets that group them, and the runner.
+    """
+    def __init__(self, statefile=STATEFILE, logdir=LOGDIR):
+        self.tasks     = OrderedDict()
+        self.targets   = OrderedDict()
+        self.producer  = {}
+        self.statefile = statefile
+        self.logdir    = logdir
+        self.hasher    = cache.Cache(os.path.dirname(statefile))
+
+    def add(self, task, target=None):
+        """
+        Adds a task, and lists it in `target`. A task whose outputs are
+        already made by another task is not added again; the existing task
+        is listed instead.
+        """
+        for output in task.outputs:
+            if output in self.producer:
+                task = self.tasks[self.producer[output]]
+                break
+        else:
+            self.tasks[task.name] = task
+            for output in task.outputs:
+                self.producer[output] = task.name
+        if target is not None:
+            self.targets.setdefault(target, [])
+            if task.name not in self.targets[target]:
+                self.targets[target].append(task.name)
+        return task
+
+    def group(self, target, members):
+        """
+        Defines a target as the union of other targets.
+        """
+        self.targets[target] = []
+        for member in members:
+            for name in self.targets[member]:
+                if name not in self.targets[target]:
+                    self.targets[target].append(name)
+
+    def depends(self, task):
+        """
+        Names of the tasks that must finish before `task` runs.
+        """
+        deps = list(task.deps)
+        for fname in task.inputs:
+            if fname in self.producer and self.producer[fname] not in deps:
+                deps.append(self.producer[fname])
+        return deps
+
+    def closure(self, targets):
+        """
+        Names of the tasks of `targets` and of everything they depend on, in
+        the order they were added.
+        """
+        needed = set()
+        stack  = []
+        for target in targets:
+            if target in self.targets:
+                stack += self.targets[target]
+            elif target in self.tasks:
+                stack.append(target)
+            else:
+                raise ValueError("Unknown target '" + target + "'.")
+        while len(stack) > 0:
+            name = stack.pop()
+            if name not in needed:
+                needed.add(name)
+                stack += self.depends(self.tasks[name])
+        return [name for name in self.tasks if name in needed]
+
+    def readstate(self):
+        try:
+            with open(self.statefile, 'r') as foo:
+                return json.load(foo)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def writestate(self, state):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.statefile))
+        with os.fdopen(fd, 'w') as foo:
+            json.dump(state, foo, indent=1, sort_keys=True)
+        os.rename(tmp, self.statefile)
+
+    def uptodate(self, task, state):
+        """
+        Returns True if the outputs of `task` exist and neither its command,
+        inputs, nor outputs changed since its last successful run.
+        """
+        if task.always or task.name not in state:
+            return False
+        for fname in task.outputs:
+            if not os.path.exists(fname):
+                return False
+        entry = state[task.name]
+        if entry['signature'] != task.signature(self.hasher):
+            return False
+        for fname in task.outputs:
+            if entry['outputs'].get(os.path.relpath(fname, ROOT)) !=         \
+               self.hasher.filekey(fname):
+                return False
+        return True
+
+    def record(self, task, state):
+        state[task.name] = {'signature': task.signature(self.hasher),
+                            'outputs'  : dict(
+                                (os.path.relpath(fname, ROOT),
+                                 self.hasher.filekey(fname))
+                                for fname in task.outputs)}
+        self.writestate(state)
+
+    def _execute(self, task, done):
+        logfile = os.path.join(self.logdir,
+                               task.name.replace('/', '_').replace(':', '-') +
+                               '.log')
+        start = time.time()
+        try:
+            for fname in task.outputs:
+                if task.clean and os.path.lexists(fname):
+                    os.remove(fname)
+                if not os.path.isdir(os.path.dirname(fname)):
+                    try:
+                        os.makedirs(os.path.dirname(fname))
+                    except OSError:
+                        # Made by another task
+                        pass
+            with open(logfile, 'w') as log:
+                code = subprocess.call(task.cmd, cwd=task.cwd, stdout=log,
+                                       stderr=subprocess.STDOUT)
+        except (IOError, OSError) as e:
+            code = str(e)
+        done.put((task.name, code, time.time() - start, logfile))
+
+    def run(self, targets, ncpu=None, dryrun=False):
+        """
+        Runs the tasks of `targets` that are not up to date.
+
+        Inputs
+        ------
+        targets: list of strings. Target or task names.
+        ncpu   : int.  CPU budget. Default is the number of CPUs. A task
+                       that needs more than the budget runs alone.
+        dryrun : bool. If True, only print the tasks that would run.
+
+        Outputs
+        -------
+        status : dict. For each task: 'uptodate', 'done', 'failed', or
+                       'blocked' (a dependency failed).
+        """
+        if ncpu is None:
+            ncpu = mp.cpu_count()
+        if not os.path.isdir(self.logdir):
+            os.makedirs(self.logdir)
+        names   = self.closure(targets)
+        deps    = dict((name, self.depends(self.tasks[name]))
+                       for name in names)
+        state   = self.readstate()
+        status  = {}
+        pending = list(names)
+        done    = Queue()
+        used    = 0
+
+        while len(pending) > 0 or used > 0:
+            progress = False
+            for name in list(pending):
+                task = self.tasks[name]
+                if any(status.get(d) in ['failed', 'blocked']
+                       for d in deps[name]):
+                    status[name] = 'blocked'
+                    pending.remove(name)
+                    progress = True
+                    print("  blocked  " + name)
+                    continue
+                if not all(status.get(d) in ['uptodate', 'done']
+                           for d in deps[name]):
+                    continue
+                if self.uptodate(task, state):
+                    status[name] = 'uptodate'
+                    pending.remove(name)
+                    progress = True
+                    continue
+                cost = min(task.ncpu, ncpu)
+                if used + cost > ncpu:
+                    continue
+                pending.remove(name)
+                progress = True
+                print("  running  " + name)
+                if dryrun:
+                    status[name] = 'done'
+                    continue
+                used += cost
+                thread = threading.Thread(target=self._execute,
+                                          args=(task, done))
+                thread.daemon = True
+                thread.start()
+            if used == 0:
+                if progress:
+                    continue
+                # Nothing runs, and nothing else can start
+                break
+
+            name, code, elapsed, logfile = done.get()
+            task  = self.tasks[name]
+            used -= min(task.ncpu, ncpu)
+            if code == 0 and all(os.path.exists(f) for f in task.outputs):
+                status[name] = 'done'
+                self.record(task, state)
+                print("  done     " + name + " ({:.1f} s)".format(elapsed))
+            else:
+                status[name] = 'failed'
+                print("  failed   " + name + ", see " + logfile)
+
+        for name in pending:
+            status[name] = 'blocked'
+        return status
+
+
+def graph():
+    """
+    The BARTTest tests as a TaskGraph, with the targets of the Makefile.
+    """
+    tg = TaskGraph()
+    test = lambda *f: os.path.join(TESTDIR, *f)
+    out  = lambda *f: os.path.join(ROOT, 'code-output', '01BART', *f)
+    res  = lambda *f: os.path.join(ROOT, 'results', '01BART', *f)
+
+    # Forward and comparison tests: target, directory, .plc, .trc files
+    tests = [
+      ('oneline',    'f01oneline',    ['oneline.plc'],
+                     ['oneline_emission.trc']),
+      ('fewline',    'f02fewline',    ['fewline.plc'],
+                     ['fewline_emission.trc', 'fewline_transmission.trc']),
+      ('multiline',  'f03multiline',  ['multiline.plc'],
+                     ['multiline_emission.trc',
+                      'multiline_transmission.trc']),
+      ('broadening', 'f04broadening', ['broadening.plc'],
+                     ['broadening_emission.trc']),
+      ('abundance',  'f05abundance',  ['abundance.plc'],
+                     ['abundance_' + a + '_emission.trc' for a in
+                      ['0', '1e-4', '2e-4', '3e-4', '4e-4', '5e-4', '6e-4',
+                       '7e-4', '8e-4', '9e-4', '1e-3']]),
+      ('blending',   'f06blending',   ['blending.plc'],
+                     ['blending_emission.trc']),
+      ('multicia',   'f07multicia',   ['multicia.plc'],
+                     ['noCIA_emission.trc', 'oneCIA_emission.trc',
+                      'twoCIA_emission.trc']),
+      ('isothermal', 'f08isothermal', ['isothermal.plc'],
+                     ['isothermal_emission.trc']),
+      ('energycons', 'f09energycons', ['energycons.plc'],
+                     ['energycons_1_emission.trc',
+                      'energycons_5_emission.trc',
+                      'energycons_10_emission.trc']),
+      ('comparison_iso',   'c01hjcleariso',   ['comparison.plc'],
+                           ['iso_emission.trc', 'iso_transmission.trc']),
+      ('comparison_noinv', 'c02hjclearnoinv', ['comparison.plc'],
+                           ['noinv_emission.trc', 'noinv_transmission.trc']),
+      ('comparison_inv',   'c03hjclearinv',   ['comparison.plc'],
+                           ['inv_emission.trc', 'inv_transmission.trc'])]
+    for target, tdir, plcs, trcs in tests:
+        for plc in plcs:
+            tg.add(plctask(test(tdir, plc)), target)
+        for trc in trcs:
+            tg.add(trctask(test(tdir, trc)), target)
+
+    # Analysis of the spectra: target, script, outputs, and inputs besides
+    # the spectra of the target. There is no energycons_2_emission.trc; the
+    # 2-layer spectrum is committed under code-output/.
+    analyses = [('broadening', 'voigtcomp.py',  [res('f04voigt_comp.png')],
+                 []),
+                ('abundance',  'abuncomp.py',   [res('f05results.txt')], []),
+                ('energycons', 'energycons.py', [res('f09energycons.txt')],
+                 [out('f09energycons', 'energycons_2_emission_spectrum.dat')])]
+    for target, script, outputs, static in analyses:
+        inputs = [os.path.join(LIBDIR, script)] + static
+        for name in tg.targets[target]:
+            if name.startswith('spec:'):
+                inputs += tg.tasks[name].outputs
+        tg.add(Task(script, ['./' + script], LIBDIR, inputs, outputs),
+               target)
+
+    # Synthetic and real retrievals
+    retrievals = [('retrieval_iso_e',   's01hjcleariso',   'iso_emission'),
+                  ('retrieval_iso_t',   's01hjcleariso',   'iso_transmission'),
+                  ('retrieval_noinv_e', 's02hjclearnoinv', 'noinv_emission'),
+                  ('retrieval_noinv_t', 's02hjclearnoinv',
+                                        'noinv_transmission'),
+                  ('retrieval_inv_e',   's03hjclearinv',   'inv_emission'),
+                  ('retrieval_inv_t',   's03hjclearinv',   'inv_transmission'),
+                  ('hd189_retrieval',   'r01hd189733b',    'HD189733b')]
+    tg.add(plctask(test('s01hjcleariso', 'retrievals.plc')), 'retrieval_tli')
+    tg.add(plctask(test('r01hd189733b', 'pyline.plc')), 'hd189_tli')
+    for target, tdir, brt in retrievals:
+        tg.add(brttask(test(tdir, brt + '.brt')), target)
+
+    # Groups of tests, as in the Makefile
+    forward = ['oneline', 'fewline', 'multiline', 'broadening', 'abundance',
+               'blending', 'multicia', 'isothermal', 'energycons']
+    comparison = ['comparison_iso', 'comparison_noinv', 'comparison_inv']
+    synthetic  = ['retrieval_iso_e', 'retrieval_iso_t', 'retrieval_noinv_e',
+                  'retrieval_noinv_t', 'retrieval_inv_e', 'retrieval_inv_t']
+    tg.group('forwardtests', forward)
+    tg.group('synthretrievals', synthetic)
+    tg.group('hd189', ['hd189_tli', 'hd189_retrieval'])
+
+    # Plots redraw only what changed by themselves (see plotjobs.py)
+    plots = [('plots',            'makeplots',      forward),
+             ('comparison_plots', 'comparison',     comparison),
+             ('retrievalplots',   'retrievalplots', synthetic)]
+    for target, module, members in plots:
+        deps = [name for member in members for name in tg.targets[member]]
+        tg.add(Task(target, ['./plotjobs.py', module], LIBDIR, deps=deps,
+                    always=True), target)
+    tg.group('comparisontests', comparison + ['comparison_plots'])
+    tg.group('all', ['forwardtests', 'comparisontests', 'plots'])
+    return tg
+
+
+if __name__ == '__main__':
+    args   = sys.argv[1:]
+    ncpu   = None
+    dryrun = '--dry-run' in args or '-n' in args
+    args   = [a for a in args if a not in ['--dry-run', '-n']]
+    if '--ncpu' in args:
+        i    = args.index('--ncpu')
+        ncpu = int(args[i+1])
+        del args[i:i+2]
+    status = graph().run(args or ['all'], ncpu, dryrun)
+    nfail  = len([s for s in status.values() if s in ['failed', 'blocked']])
+    print(str(len(status)) + " tasks: " + str(nfail) + " failed or blocked.")
+    sys.exit(int(nfail > 0))
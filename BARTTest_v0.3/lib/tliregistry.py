@@ -0,0 +1,256 @@
+#! /usr/bin/env python
+
+import sys, os
+import re
+import fnmatch
+import errno
+import fcntl
+import hashlib
+import subprocess
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+import cache
+
+"""
+This file builds each distinct TLI file once, and shares it among the tests.
+
+Several tests make the same TLI file from different .plc files (e.g.,
+comparison.plc and retrievals.plc, or isothermal.plc and energycons.plc),
+and a conversion of the HITRAN/HITEMP line lists takes hours. A TLI file is
+keyed by the inputs that determine its contents: the contents of the line
+lists, partition-function files, and definition file, the database types,
+the wavelength range, and the pylineread source tree, which includes the
+database drivers and the partition functions (TIPS) that pylineread uses
+for 'implicit' partition functions. Comments, the verbosity, and the output
+name of the .plc file do not count.
+
+Each TLI file is stored once as tests/00inputs/TLI/store/<key>.tli, and the
+output of each .plc file is a symbolic link to it. A .plc file whose key is
+already stored is linked without running pylineread. Builds of the same key
+hold a lock on it, so that a second build waits for the first one and then
+links to its result.
+
+A TLI file made before the registry, i.e., a regular file at the output of
+a .plc file whose key is not stored yet, is moved into the store instead of
+being rebuilt. Delete it beforehand to rebuild it.
+
+Usage: ./tliregistry.py file.plc [file.plc ...]
+"""
+
+# BARTTest directory, pylineread, and the store of TLI files
+ROOT       = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PYLINEREAD = os.path.normpath(os.path.join(ROOT, '..', 'BART', 'modules',
+                              'transit', 'pylineread', 'src',
+                              'pylineread.py'))
+STOREDIR   = os.path.join(ROOT, 'tests', '00inputs', 'TLI', 'store')
+# Compiled files of the pylineread source tree, which do not count
+BUILDFILES = ['*.pyc', '*.pyo', '*.o', '*.so', '__pycache__', 'build']
+
+
+def readplc(plcfile):
+    """
+    Reads the [Parameters] section of a pylineread configuration file.
+
+    Inputs
+    ------
+    plcfile: string. Path/to/.plc file.
+
+    Outputs
+    -------
+    args   : dict. The parameters, with 'db_list', 'part_list', and 'dbtype'
+                   split into lists, and paths relative to the directory of
+                   `plcfile` made absolute.
+    """
+    config = configparser.RawConfigParser()
+    if len(config.read(plcfile)) == 0:
+        raise ValueError("Cannot read '" + plcfile + "'.")
+    args   = dict(config.items('Parameters'))
+    plcdir = os.path.dirname(os.path.abspath(plcfile))
+    path   = lambda f: os.path.normpath(os.path.join(plcdir, f))
+
+    args['db_list']   = [path(f) for f in args['db_list'].split()]
+    args['part_list'] = [f if f == 'implicit' else path(f)
+                         for f in args.get('part_list', '').split()]
+    args['dbtype']    = args.get('dbtype', '').split()
+    if 'defn' in args:
+        args['defn'] = path(args['defn'].strip())
+    args['output'] = path(args['output'].strip())
+    return args
+
+
+def sources(pylineread=PYLINEREAD):
+    """
+    Files of the pylineread source tree, i.e., of the directory of
+    pylineread.py and its subdirectories, besides compiled files.
+
+    Inputs
+    ------
+    pylineread: string. Path/to/pylineread.py.
+
+    Outputs
+    -------
+    files     : list of strings. Sorted paths/to/files. Empty if `pylineread`
+                                 does not exist.
+    """
+    if not os.path.isfile(pylineread):
+        return []
+    skipped = lambda name: any([fnmatch.fnmatch(name, pattern)
+                                for pattern in BUILDFILES])
+    files = []
+    for dirpath, dirnames, filenames in os.walk(os.path.dirname(pylineread)):
+        dirnames[:] = sorted([d for d in dirnames if not skipped(d)])
+        files += [os.path.join(dirpath, f) for f in sorted(filenames)
+                  if not skipped(f)]
+    return files
+
+
+def _pathkey(path, hasher):
+    # Content digest of a file, or of the files in a directory
+    if os.path.isfile(path):
+        return hasher.filekey(path)
+    if os.path.isdir(path):
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for fname in sorted(filenames):
+                full = os.path.join(dirpath, fname)
+                keys.append([os.path.relpath(full, path),
+                             hasher.filekey(full)])
+        return keys
+    raise ValueError("Input '" + path + "' does not exist.")
+
+
+def fingerprint(plcfile, hasher=None, pylineread=PYLINEREAD):
+    """
+    Key of the TLI file of a .plc file: a digest of the inputs that
+    determine its contents.
+
+    Inputs
+    ------
+    plcfile   : string. Path/to/.plc file.
+    hasher    : cache.Cache. Gives the content digest of a file. Default is
+                             the post-processing cache.
+    pylineread: string. Path/to/pylineread.py. Its source tree is part of
+                        the key if it exists, see sources().
+
+    Outputs
+    -------
+    key       : string. Hex digest.
+    """
+    if hasher is None:
+        hasher = cache.Cache()
+    args = readplc(plcfile)
+
+    h = hashlib.sha1()
+    # The line lists, in order, with their types and partition functions
+    for i in range(len(args['db_list'])):
+        part = args['part_list'][i] if i < len(args['part_list'])            \
+               else 'implicit'
+        cache.digest([_pathkey(args['db_list'][i], hasher),
+                      args['dbtype'][i] if i < len(args['dbtype']) else None,
+                      part if part == 'implicit' else _pathkey(part, hasher)],
+                     h)
+    cache.digest([_pathkey(args['defn'], hasher) if 'defn' in args else None,
+                  float(args['iwav']), float(args['fwav'])], h)
+    srcdir = os.path.dirname(pylineread)
+    cache.digest([[os.path.relpath(f, srcdir), hasher.filekey(f)]
+                  for f in sources(pylineread)], h)
+    return h.hexdigest()
+
+
+def link(target, fname):
+    """
+    Makes `fname` a relative symbolic link to `target`, replacing whatever
+    `fname` was.
+    """
+    outdir = os.path.dirname(fname)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    tmp = fname + '.' + str(os.getpid()) + '.link'
+    os.symlink(os.path.relpath(target, outdir), tmp)
+    os.rename(tmp, fname)
+
+
+def writeplc(plcfile, newfile, output):
+    """
+    Copies a .plc file, replacing its output.
+    """
+    with open(plcfile, 'r') as foo:
+        text = foo.read()
+    text, nsub = re.subn(r'(?m)^output\s*=.*$', 'output = ' + output, text)
+    if nsub != 1:
+        raise ValueError("No output parameter in '" + plcfile + "'.")
+    with open(newfile, 'w') as foo:
+        foo.write(text)
+
+
+def build(plcfile, pylineread=PYLINEREAD, storedir=STOREDIR, hasher=None):
+    """
+    Makes the TLI file of a .plc file: links its output to the stored TLI
+    file of the same key. If there is none, the output is stored if it is a
+    regular file (made before the registry), else pylineread makes it.
+
+    Inputs
+    ------
+    plcfile   : string. Path/to/.plc file.
+    pylineread: string. Path/to/pylineread.py.
+    storedir  : string. Path/to/directory of the stored TLI files.
+    hasher    : cache.Cache. See fingerprint().
+
+    Outputs
+    -------
+    tlifile   : string. Path/to/stored TLI file.
+    built     : bool.   True if pylineread ran, False if the file was
+                        already stored or made before.
+    """
+    key     = fingerprint(plcfile, hasher, pylineread)
+    tlifile = os.path.join(storedir, key + '.tli')
+    output  = readplc(plcfile)['output']
+    if not os.path.isdir(storedir):
+        try:
+            os.makedirs(storedir)
+        except OSError as e:
+            # Made by another build
+            if e.errno != errno.EEXIST:
+                raise
+
+    built = False
+    with open(os.path.join(storedir, key + '.lock'), 'w') as lock:
+        # Waits while another process builds the same key
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.isfile(tlifile) and os.path.isfile(output) and        \
+           not os.path.islink(output):
+            # Made before the registry, e.g., by an older Makefile
+            os.rename(output, tlifile)
+        elif not os.path.isfile(tlifile):
+            plcdir  = os.path.dirname(os.path.abspath(plcfile))
+            partial = tlifile + '.part'
+            tmpplc  = os.path.join(plcdir, '.' + key + '.plc')
+            writeplc(plcfile, tmpplc, os.path.relpath(partial, plcdir))
+            try:
+                code = subprocess.call([os.path.relpath(pylineread, plcdir),
+                                        '-c', os.path.basename(tmpplc)],
+                                       cwd=plcdir)
+            finally:
+                os.remove(tmpplc)
+            if code != 0 or not os.path.isfile(partial):
+                raise RuntimeError("pylineread failed on '" + plcfile +
+                                   "' (exit code " + str(code) + ").")
+            os.rename(partial, tlifile)
+            built = True
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    link(tlifile, output)
+    return tlifile, built
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: ./tliregistry.py file.plc [file.plc ...]")
+        sys.exit(1)
+    for plcfile in sys.argv[1:]:
+        tlifile, built = build(plcfile)
+        print(("Built " if built else "Reusing ") +
+              os.path.relpath(tlifile, os.getcwd()) + " for " + plcfile + ".")
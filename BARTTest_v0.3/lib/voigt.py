@@ -1,3 +1,4 @@
+import warnings
 import numpy as np
 from scipy.special import wofz
 
@@ -26,3 +27,222 @@ def V(x, alpha, gamma, shift=0):
                                                            /np.sqrt(2*np.pi)
 
 
+
+def _windows(x, center, halfwidth, chunk):
+    """
+    Yields, for chunks of lines, the indices of the (sorted) `x` samples that
+    fall within `halfwidth` of each line center, padded to a common length.
+
+    Yields (lines, idx, valid), where `lines` indexes the lines in the chunk,
+    `idx` is an int array of shape (nlines, npad), and `valid` marks which
+    entries of `idx` are real samples.
+    """
+    lo = np.searchsorted(x, center - halfwidth, side='left')
+    hi = np.searchsorted(x, center + halfwidth, side='right')
+    # Process lines in order of window size so the padding stays small
+    order = np.argsort(hi - lo)
+    for i in range(0, len(order), chunk):
+        lines = order[i:i+chunk]
+        npad  = np.amax(hi[lines] - lo[lines])
+        if npad == 0:
+            continue
+        idx   = lo[lines, None] + np.arange(npad)
+        valid = idx < hi[lines, None]
+        yield lines, np.where(valid, idx, 0), valid
+
+
+def Vlines(x, alpha, gamma, center, strength=1.0, nwidth=None, table=None,
+           chunk=1000):
+    """
+    Return the sum of the Voigt line shapes of many lines, sampled at `x`.
+
+    Inputs
+    ------
+    x       : 1D array. Sorted, increasing positions at which to evaluate.
+    alpha   : array.    Doppler (Gaussian) HWHM of each line.
+    gamma   : array.    Lorentzian HWHM of each line.
+    center  : array.    Center of each line.
+    strength: array.    Multiplies the profile of each line. Default is 1.
+    nwidth  : float.    If not None, each profile is cut off at `nwidth` times
+                        the larger of its two HWHMs, as done by Transit.
+    table   : VoigtTable. If not None, interpolate the profiles from this
+                          table of pre-tabulated profiles. Requires `nwidth`.
+    chunk   : int.      Number of lines evaluated at a time.
+
+    Outputs
+    -------
+    spec    : 1D array. Summed line profiles at `x`.
+    """
+    x      = np.asarray(x, dtype=float)
+    center = np.atleast_1d(center).astype(float)
+    alpha, gamma, strength = [np.broadcast_to(np.asarray(arr, dtype=float),
+                                              center.shape)
+                              for arr in (alpha, gamma, strength)]
+    spec   = np.zeros(len(x))
+
+    if nwidth is None:
+        if table is not None:
+            raise ValueError("Tabulated profiles require `nwidth`.")
+        for i in range(0, len(center), chunk):
+            s = slice(i, i+chunk)
+            spec += np.sum(strength[s, None] *
+                           V(x, alpha[s, None], gamma[s, None],
+                             center[s, None]), axis=0)
+        return spec
+
+    halfwidth = nwidth * np.maximum(alpha, gamma)
+    for lines, idx, valid in _windows(x, center, halfwidth, chunk):
+        if table is None:
+            prof = V(x[idx], alpha[lines, None], gamma[lines, None],
+                     center[lines, None])
+        else:
+            prof = table(x[idx] - center[lines, None],
+                         alpha[lines, None], gamma[lines, None])
+        prof *= strength[lines, None] * valid
+        spec += np.bincount(idx.ravel(), weights=prof.ravel(),
+                            minlength=len(x))
+    return spec
+
+
+class VoigtTable(object):
+    """
+    Pre-tabulated Voigt profiles, interpolated to arbitrary widths.
+
+    With `w` = max(alpha, gamma), w * V(x, alpha, gamma) depends only on
+    x / w and on the ratio gamma / alpha, so the (Doppler, Lorentz) width grid
+    reduces to a grid of width ratios.  Profiles are tabulated out to
+    `nwidth` * w on a log-spaced grid of ratios, and are refined until linear
+    interpolation between them is accurate to `accuracy`, relative to the
+    peak of the profile.
+
+    Example
+    -------
+    >>> table = VoigtTable(nwidth=20, accuracy=1e-4)
+    >>> spec  = Vlines(wn, alpha, gamma, wnline, S, nwidth=20, table=table)
+    """
+    def __init__(self, nwidth=20., accuracy=1e-3, ratios=(1e-3, 1e3),
+                 nsamp=200, nratio=20, maxiter=10, maxsize=2**22):
+        """
+        Inputs
+        ------
+        nwidth  : float. Profile half width, in units of max(alpha, gamma).
+        accuracy: float. Target maximum interpolation error, relative to the
+                         profile peak.
+        ratios  : tuple. Range of gamma/alpha to tabulate. Ratios outside
+                         this range use the profile at the nearest edge.
+        nsamp   : int.   Initial number of samples along the profile.
+        nratio  : int.   Initial number of tabulated ratios.
+        maxiter : int.   Maximum number of refinements.
+        maxsize : int.   Maximum number of tabulated values (8 bytes each).
+
+        Notes
+        -----
+        Each refinement doubles the resolution of the axis (samples or
+        ratios) with the larger interpolation error. A RuntimeWarning is
+        issued if `accuracy` is not met within `maxiter` refinements and
+        `maxsize` values.
+        """
+        self.nwidth   = nwidth
+        self.accuracy = accuracy
+        self.lograt   = np.log10(ratios)
+        self.tabulate(nsamp, nratio)
+        self.error = self.testerror()
+        for i in range(maxiter):
+            if self.error <= accuracy:
+                break
+            serror, rerror = self.axiserror()
+            if serror >= rerror:
+                nsamp  = 2*nsamp - 1
+            else:
+                nratio = 2*nratio - 1
+            if nsamp * nratio > maxsize:
+                break
+            self.tabulate(nsamp, nratio)
+            self.error = self.testerror()
+        if self.error > accuracy:
+            warnings.warn("VoigtTable: accuracy target not met with " +
+                          str(len(self.logr)) + " ratios and " +
+                          str(len(self.s)) + " samples, max error is " +
+                          str(self.error), RuntimeWarning)
+
+    def profile(self, s, logratio):
+        """
+        Return w * V at distances `s` from the center in units of w, for
+        log10(gamma/alpha) = `logratio`.
+        """
+        ratio = 10.0**logratio
+        alpha = 1.0 / np.maximum(ratio, 1.0)
+        return V(s, alpha, alpha*ratio)
+
+    def tabulate(self, nsamp, nratio):
+        """
+        Fill the table with `nratio` profiles of `nsamp` samples each.
+        """
+        self.s      = np.linspace(0, self.nwidth, nsamp)
+        self.logr   = np.linspace(self.lograt[0], self.lograt[1], nratio)
+        self.ds     = self.s[1]    - self.s[0]
+        self.dlogr  = self.logr[1] - self.logr[0]
+        self.values = self.profile(self.s[None, :], self.logr[:, None])
+
+    def testerror(self):
+        """
+        Return the maximum interpolation error relative to the profile peak,
+        measured halfway between the tabulated samples and ratios.
+        """
+        s    = 0.5 * (self.s[1:]    + self.s[:-1])
+        logr = 0.5 * (self.logr[1:] + self.logr[:-1])
+        exact  = self.profile(s[None, :], logr[:, None])
+        interp = self.interp(np.tile(s, (len(logr), 1)), logr)
+        return np.amax(np.abs(interp - exact) / exact[:, :1])
+
+    def axiserror(self):
+        """
+        Return the maximum interpolation errors relative to the profile peak
+        along each axis of the table: halfway between the samples at the
+        tabulated ratios, and halfway between the ratios at the tabulated
+        samples.
+        """
+        s      = 0.5 * (self.s[1:]    + self.s[:-1])
+        logr   = 0.5 * (self.logr[1:] + self.logr[:-1])
+        exact  = self.profile(s[None, :], self.logr[:, None])
+        interp = self.interp(np.tile(s, (len(self.logr), 1)), self.logr)
+        serror = np.amax(np.abs(interp - exact) / self.values[:, :1])
+        exact  = self.profile(self.s[None, :], logr[:, None])
+        rerror = np.amax(np.abs(self.rows(logr) - exact) / exact[:, :1])
+        return serror, rerror
+
+    def rows(self, logratio):
+        """
+        Return the tabulated profiles interpolated, linearly in
+        log10(gamma/alpha), to each value of the 1D array `logratio`.
+        """
+        fr = np.clip((logratio - self.logr[0]) / self.dlogr, 0,
+                     len(self.logr) - 1)
+        j0 = np.minimum(fr.astype(int), len(self.logr) - 2)
+        wr = (fr - j0)[:, None]
+        return (1-wr) * self.values[j0] + wr * self.values[j0+1]
+
+    def interp(self, s, logratio):
+        """
+        Bilinear interpolation of the table, in `s` and log10(gamma/alpha).
+        `s` has shape (n, m), and `logratio` has shape (n,).
+        """
+        rows = self.rows(logratio)
+        s    = np.abs(s)
+        fs   = np.clip(s / self.ds, 0, len(self.s) - 1)
+        i0   = np.minimum(fs.astype(int), len(self.s) - 2)
+        ws   = fs - i0
+        val  = (1-ws) * np.take_along_axis(rows, i0,   axis=1) +              \
+                  ws  * np.take_along_axis(rows, i0+1, axis=1)
+        # Zero beyond the cutoff
+        return np.where(s <= self.nwidth, val, 0.0)
+
+    def __call__(self, x, alpha, gamma):
+        """
+        Return the interpolated Voigt line shapes of n lines at `x` from the
+        line centers. `x` has shape (n, m); `alpha` and `gamma` have n values.
+        """
+        alpha = np.ravel(alpha)
+        gamma = np.ravel(gamma)
+        w     = np.maximum(alpha, gamma)[:, None]
+        return self.interp(x / w, np.log10(gamma / alpha)) / w
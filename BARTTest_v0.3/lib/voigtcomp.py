@@ -3,10 +3,9 @@
 import sys
 import numpy as np
 import matplotlib.pyplot as plt
-plt.ion()
 import scipy.constants   as const
 import scipy.interpolate as si
-from opacityconv import bin2np
+from opacityconv import OpacityInterpolator
 import voigt
 
 """
@@ -24,7 +23,7 @@ def comp(molmass=18.0105646, press=3.3516e-01, temp=1442.58,
          ratio=0.9973, 
          Elow=2183.6851, gf=7.026386513565115e-08, Z=2525.51990555, 
          opacity='../code-output/01BART/f04broadening/broadening.opt', 
-         ipress=35, itemp=9, imol=0, 
+         imol=0, 
          savename='../results/01BART/f04voigt_comp'):
     """
     molmass : float.  Molar mass of the molecule responsible for the spectral 
@@ -41,8 +40,6 @@ def comp(molmass=18.0105646, press=3.3516e-01, temp=1442.58,
     Z       : float.  Partition function for the given conditions.
     opacity : string of path/to/file for the binary opacity file produced by 
                       Transit.
-    ipress  : int.    Index of the pressure in the opacity array.
-    itemp   : int.    Index of the closest temperature in the opacity array.
     imol    : int.    Index of the molecule in the opacity array.
 	savename: string. Name of produced plot of comparison of profiles.
     """
@@ -61,21 +58,11 @@ def comp(molmass=18.0105646, press=3.3516e-01, temp=1442.58,
     presscgs = press * 1000000      # pressure in cgs units
     nd       = presscgs/(k*temp)    # number density in cm-3
 
-    # Load Transit opacity file info
-    hdr, molID, temps, press, wns, optable = bin2np(opacity, 
-                                                    opacity.rsplit('/', 1)[0]+\
-                                                    '/opacity')
-
-    # Transit profile -- interpolate to the conditions
-    opa   = optable[ipress,itemp,imol]
-    if round(temp, -2) < temp:
-        weight = (temp - round(temp, -2)) / 100
-        opa    = (1-weight) * optable[ipress,itemp,imol] + \
-                    weight  * optable[ipress,itemp+1,imol]
-    else:
-        weight = (round(temp, -2) - temp) / 100
-        opa    = (1-weight) * optable[ipress,itemp,imol] + \
-                    weight  * optable[ipress,itemp-1,imol]
+    # Transit profile -- interpolate the opacity table to the conditions,
+    # within 0.5 cm-1 of the line
+    interp = OpacityInterpolator(opacity, wn=(wavenum - 0.5, wavenum + 0.5))
+    wns    = interp.wns
+    opa    = interp(press, temp)[imol]
 
     # Theoretical Voigt profile calculation (in wavenumber space)
     # Equation for Doppler HWHM:
@@ -101,7 +88,7 @@ def comp(molmass=18.0105646, press=3.3516e-01, temp=1442.58,
     prof2  = resamp(wns)
 
     # Make plot
-    fig1 = plt.figure(1)
+    fig1 = plt.figure()
     frame1 = fig1.add_axes((.1, .3, .8, .6))
     plt.plot(wns, prof2, "-", lw=1.5, \
              color="blue", label="Theoretical")
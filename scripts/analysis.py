@@ -0,0 +1,263 @@
+#! /usr/bin/env python
+
+import sys, os
+import json
+import multiprocessing as mp
+import numpy as np
+try:
+    import ConfigParser as configparser
+except ImportError:
+    import configparser
+sys.path.append('../BARTTest_v0.3/lib/')
+sys.path.append('../BART/code/')
+import cache
+import mc3out
+import retrievalplots as rp
+import ess as es
+import credregion as cr
+
+"""
+This file runs the posterior analyses of every retrieval under
+code-output/01BART/: the effective sample size (ess.py), the credible regions
+(credregion.py), and the PT-profile credible bands (retrievalplots.py).
+
+The burn-in, parameter names, and uniform abundances of each run are read
+from the run's .brt and MCMC.log files. Each run is a job for a process pool.
+A job loads the run's posterior once, stacks its chains once, and passes them
+to the three analyses. The results of each run are written to one JSON file,
+<run>-analysis.json, in results/01BART/. The result of each analysis is
+cached (see cache.py), so a rerun on unchanged runs does not load the
+posteriors at all.
+
+Usage: ./analysis.py [ncpu]
+"""
+
+datadir = '../BARTTest_v0.3/code-output/01BART/'
+testdir = '../BARTTest_v0.3/tests/'
+outdir  = '../BARTTest_v0.3/results/01BART/'
+
+
+def readrun(rundir):
+    """
+    Reads the configuration of a retrieval run.
+
+    Inputs
+    ------
+    rundir: string. Path/to/directory of the run, containing MCMC.log,
+                    output.npy, and the .brt file.
+
+    Outputs
+    -------
+    run   : dict. Name, paths, burn-in, parameter names, fitted molecules,
+                  uniform abundances (None if not uniform), geometry, and PT
+                  model of the run.
+    """
+    rundir = os.path.join(rundir, '')
+    name   = os.path.basename(os.path.dirname(rundir))
+    # Prefer the user's .brt over the copy written by BART
+    brts   = sorted([f for f in os.listdir(rundir) if f.endswith('.brt')],
+                    key=lambda f: f.startswith('MCMC_'))
+    if len(brts) == 0:
+        raise ValueError("No .brt file found in " + rundir)
+    config = configparser.RawConfigParser()
+    config.read(rundir + brts[0])
+    cfg    = dict(config.items('MCMC'))
+
+    # The .brt paths are relative to the test directory
+    tdir   = os.path.join(testdir, name.rsplit('-', 1)[0]
+                                   if name[-4:] in ['-ecl', '-tra'] else name)
+    def resolve(path):
+        # Use the copy in the run directory if there is one
+        if os.path.isfile(rundir + os.path.basename(path)):
+            return rundir + os.path.basename(path)
+        return os.path.normpath(os.path.join(tdir, path))
+
+    # Burn-in, as reported by MC3
+    burnin = int(cfg.get('burnin', 0))
+    with open(rundir + 'MCMC.log', 'r') as foo:
+        for line in foo:
+            if " Burned in iterations per chain:" in line:
+                burnin = int(line.split()[-1])
+                break
+
+    # Uniform abundance of each fitted molecule
+    molfit   = cfg['molfit'].split()
+    out_spec = [spec.split('_')[0] for spec in cfg['out_spec'].split()]
+    uniform  = cfg.get('uniform', 'None').split()
+    if uniform[0] == 'None':
+        uniform = [None] * len(molfit)
+    else:
+        uniform = [float(uniform[out_spec.index(mol)]) for mol in molfit]
+
+    return {'name'    : name,
+            'dir'     : rundir,
+            'output'  : rundir + 'output.npy',
+            'burnin'  : burnin,
+            'parnames': cfg['parnames'].split(),
+            'molfit'  : molfit,
+            'uniform' : uniform,
+            'solution': cfg.get('solution', 'eclipse').strip(),
+            'PTtype'  : cfg.get('pttype', 'line').strip(),
+            'tepfile' : resolve(cfg['tep_name'].strip()),
+            'atmfile' : resolve(cfg['atmfile'].strip())}
+
+
+def findruns(datadir=datadir):
+    """
+    Finds the retrieval runs, i.e., the directories of `datadir` that have an
+    MC3 output.npy and MCMC.log.
+
+    Outputs
+    -------
+    runs: list of dicts. See readrun().
+    """
+    runs = []
+    for name in sorted(os.listdir(datadir)):
+        rundir = os.path.join(datadir, name, '')
+        if os.path.isfile(rundir + 'output.npy') and                          \
+           os.path.isfile(rundir + 'MCMC.log'):
+            runs.append(readrun(rundir))
+    return runs
+
+
+class _Posterior(object):
+    """
+    Posterior of a run, loaded on first use and shared by its analyses.
+    """
+    def __init__(self, run):
+        self.run    = run
+        self.chains = None
+        self.stack  = None
+
+    def load(self):
+        # (nchains, nparams, niter) view of output.npy, without the burn-in
+        if self.chains is None:
+            self.chains = mc3out.load(self.run['output'], self.run['burnin'])
+        return self.chains
+
+    def flatten(self):
+        # (nparams, nsamples) stacked chains
+        if self.stack is None:
+            self.stack = mc3out.flatten(self.load())
+        return self.stack
+
+
+def _cached(func, run, args, compute):
+    # Result of func(*args), where the first argument is the run's
+    # output.npy, from the cache, else from compute() on the loaded posterior
+    store = cache.Cache()
+    key   = store.key(func, [run['output']], args, {})
+    found, result = store.get(key)
+    if not found:
+        result = compute()
+        store.put(key, result)
+    return result
+
+
+def _ess(run, post):
+    args = (run['output'], run['burnin'])
+    speis, totiter, parspeis = _cached(es.ess, run, args,
+                                       lambda: es.esschains(post.load()))
+    return {'speis'   : speis,
+            'totiter' : totiter,
+            'ess'     : totiter//speis,
+            'parspeis': dict(zip(run['parnames'], parspeis.tolist())),
+            'sig'     : es.sig(totiter/speis).tolist()}
+
+
+def _credregion(run, post):
+    percentile = [0.6827, 0.9545, 0.9973]
+    args = (run['output'], run['burnin'], run['uniform'], percentile)
+    def compute():
+        # Shifts the stacked posterior in place, so it runs last
+        posterior = cr.shiftuniform(post.flatten(), run['uniform'])
+        return cr.credregions(posterior, percentile)[2:]
+    CRlo, CRhi = _cached(cr.credregionfile, run, args, compute)
+    # Each region as a list of (lo, hi) pairs
+    return dict((run['parnames'][n],
+                 dict((str(percentile[j]),
+                       np.column_stack((CRlo[n][j], CRhi[n][j])).tolist())
+                      for j in range(len(percentile))))
+                for n in range(len(CRlo)))
+
+
+def _PTbands(run, post, T_int=100.):
+    if run['PTtype'] != 'line':
+        return None
+    grav, Rp = rp.ma.get_g(run['tepfile'])
+    R_star, T_star, sma, gstar = rp.bf.get_starData(run['tepfile'])
+    mols, atminfo = rp.readatm(run['atmfile'])
+    pressure = atminfo[:, 1]
+    args     = (run['output'], run['burnin'], 5, pressure, R_star, T_star,
+                T_int, sma, grav*1e2)
+    bands    = _cached(rp.PTbandsfile, run, args,
+                       lambda: rp.PTbands(post.flatten()[:5], *args[3:]))
+    return dict(zip(['pressure', 'low2', 'low1', 'median', 'hi1', 'hi2'],
+                    [pressure.tolist()] + bands.tolist()))
+
+
+# In the order they run, see _credregion()
+_jobs = [('ess', _ess), ('PTbands', _PTbands), ('credregion', _credregion)]
+
+def _job(run):
+    post    = _Posterior(run)
+    results = {}
+    for name, func in _jobs:
+        try:
+            results[name] = func(run, post)
+        except Exception as e:
+            results[name] = {'error': str(e)}
+    return results
+
+
+def analysis(runs=None, ncpu=None, outdir=outdir):
+    """
+    Runs every analysis of every run on a process pool, and writes one JSON
+    report per run.
+
+    Inputs
+    ------
+    runs  : list of dicts. Runs to analyze, see readrun(). Default is all the
+                           runs found by findruns().
+    ncpu  : int.    Number of processes. Default is all CPUs.
+    outdir: string. Path/to/directory for the reports.
+
+    Outputs
+    -------
+    reports: list of dicts. Report of each run.
+    """
+    if runs is None:
+        runs = findruns()
+    pool = mp.Pool(ncpu)
+    try:
+        results = pool.map(_job, runs)
+    finally:
+        pool.close()
+        pool.join()
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    reports = []
+    for i in range(len(runs)):
+        report = dict((key, runs[i][key]) for key in
+                      ['name', 'burnin', 'parnames', 'molfit', 'uniform',
+                       'solution'])
+        report.update(results[i])
+        with open(os.path.join(outdir, runs[i]['name'] + '-analysis.json'),
+                  'w') as foo:
+            json.dump(report, foo, indent=1, sort_keys=True)
+        reports.append(report)
+    return reports
+
+
+if __name__ == '__main__':
+    ncpu    = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    reports = analysis(ncpu=ncpu)
+    for report in reports:
+        print(report['name'])
+        if 'error' in report['ess']:
+            print("  ESS  : " + report['ess']['error'])
+        else:
+            print("  SPEIS: " + str(report['ess']['speis']))
+            print("  ESS  : " + str(report['ess']['ess']))
+    print("Reports written to " + outdir)
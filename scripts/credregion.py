@@ -4,6 +4,10 @@ import sys, os
 import numpy as np
 import scipy.stats as stats
 import scipy.interpolate as si
+import multiprocessing as mp
+sys.path.append('../BARTTest_v0.3/lib/')
+import mc3out
+import cache
 
 
 def load_data(output, burnin, uniform):
@@ -14,54 +18,91 @@ def load_data(output, burnin, uniform):
                           specified values for each species.
     """
     # Load and stack results, excluding burn-in
-    allparams = np.load(output)
-    posterior = allparams[0, :, burnin:]
-    for c in np.arange(1, allparams.shape[0]):
-        posterior = np.hstack((posterior, allparams[c, :, burnin:]))
+    posterior = mc3out.flatten(mc3out.load(output, burnin))
+    return shiftuniform(posterior, uniform)
 
-    # Shift by initial abundances if uniform, so that plots are log(abundance)
+
+def shiftuniform(posterior, uniform):
+    """
+    Shifts the abundances of a stacked posterior by the initial abundances
+    if uniform, so that plots are log(abundance). `posterior` is modified in
+    place.
+
+    Inputs
+    ------
+    posterior: 2D array. Shape (nparams, nsamples), the abundances last.
+    uniform  : see load_data().
+    """
     for n in range(len(uniform)):
         if uniform[n] is not None:
             posterior[-len(uniform)+n] += np.log10(uniform[n])
-
     return posterior
 
 
-def credregion(posterior, percentile=[0.6827, 0.9545, 0.9973], 
-               lims=(None,None), numpts=100):
+def fftpdf(posterior, lo, hi, npts, chunksize=1000000):
     """
-    posterior: see load_data()
-    percentile: 1D float ndarray, list, or float.
-                The percentile (actually the fraction) of the credible region.
-                A value in the range: (0, 1).
-    lims: tuple, floats. Minimum and maximum allowed values for posterior. 
-                         Should only be used if there are physically-imposed 
-                         limits.
-    numpts: int. Number of points to use when calculating the PDF.
+    Gaussian kernel density estimate of each row of `posterior` on a regular
+    grid. The samples are binned into a histogram, which is convolved with
+    the kernel via FFTs: O(N + M log(M)) instead of O(N M) for N samples and
+    M grid points. The bandwidth follows Scott's rule, as for
+    scipy.stats.gaussian_kde.
+
+    Inputs
+    ------
+    posterior: 2D array. Shape (nparams, nsamples).
+    lo, hi   : 1D arrays. Grid limits of each parameter.
+    npts     : int.       Number of grid points.
+    chunksize: int.       Number of samples binned at once, to bound memory.
+
+    Outputs
+    -------
+    pdf      : 2D array. Shape (nparams, npts). PDF of each parameter.
+    xpdf     : 2D array. Shape (nparams, npts). Grid of each parameter.
     """
-    # Make sure `percentile` is a list or array
-    if type(percentile) == float:
-        percentile = np.array([percentile])
+    npars, nsamp = posterior.shape
+    lo   = np.asarray(lo, dtype=float)
+    hi   = np.asarray(hi, dtype=float)
+    hi   = np.where(hi > lo, hi, lo + 1.0)
+    xpdf = lo[:, None] + (hi - lo)[:, None] * np.linspace(0, 1, npts)
+    dx   = (hi - lo) / (npts - 1.0)
 
-    # Compute the posterior's PDF:
-    kernel = stats.gaussian_kde(posterior)
-    # Use a Gaussian kernel density estimate to trace the PDF:
-    # Interpolate-resample over finer grid (because kernel.evaluate
-    #  is expensive):
-    if lims[0] is not None:
-        lo = min(np.amin(posterior), lims[0])
-    else:
-        lo = np.amin(posterior)
-    if lims[1] is not None:
-        hi = max(np.amax(posterior), lims[1])
-    else:
-        hi = np.amax(posterior)
-    x    = np.linspace(lo, hi, numpts)
-    f    = si.interp1d(x, kernel.evaluate(x))
-    xpdf = np.linspace(lo, hi, 100*numpts)
-    pdf  = f(xpdf)
+    # Histogram with one bin centered on each grid point
+    hist   = np.zeros(npars * npts)
+    offset = np.arange(npars)[:, None] * npts
+    for i in range(0, nsamp, chunksize):
+        ibin = np.rint((posterior[:, i:i+chunksize] - lo[:, None]) /
+                       dx[:, None]).astype(int)
+        ibin = np.clip(ibin, 0, npts - 1) + offset
+        hist += np.bincount(ibin.ravel(), minlength=npars * npts)
+    hist = hist.reshape(npars, npts)
 
+    # Kernel width in grid points (Scott's rule)
+    sigma = np.std(posterior, axis=1) * nsamp**(-1./5) / dx
+    # Zero-pad so that the convolution does not wrap around
+    nfft  = 2**int(np.ceil(np.log2(npts + 2*np.ceil(4*np.amax(sigma)) + 1)))
+    freq  = np.fft.rfftfreq(nfft)
+    kern  = np.exp(-2 * (np.pi * sigma[:, None] * freq)**2)
+    pdf   = np.fft.irfft(np.fft.rfft(hist, n=nfft, axis=1) * kern,
+                         n=nfft, axis=1)[:, :npts]
+    pdf   = np.clip(pdf, 0, None) / (nsamp * dx[:, None])
+    return pdf, xpdf
 
+
+def hpdregion(pdf, xpdf, percentile):
+    """
+    Finds the (possibly disconnected) highest posterior density regions of
+    a PDF.
+
+    Inputs
+    ------
+    pdf, xpdf : 1D arrays. PDF and the grid where it is evaluated.
+    percentile: 1D array.  Fractions of the credible regions.
+
+    Outputs
+    -------
+    CRlo, CRhi: lists. Lower and upper boundaries of the regions of each
+                       percentile.
+    """
     # Sort the PDF in descending order:
     ip = np.argsort(pdf)[::-1]
     # Sorted CDF:
@@ -76,7 +117,7 @@ def credregion(posterior, percentile=[0.6827, 0.9545, 0.9973],
         # Indices of the highest posterior density:
         iHPD = np.where(cdf >= percentile[i]*cdf[-1])[0][0]
         # Minimum density in the HPD region:
-        HPDmin   = np.amin(pdf[ip][0:iHPD])
+        HPDmin   = np.amin(pdf[ip][0:max(iHPD, 1)])
         # Find the contiguous areas of the PDF greater than or equal to HPDmin
         HPDbool  = pdf >= HPDmin
         idiff    = np.diff(HPDbool) # True where HPDbool changes T to F or F to T
@@ -94,9 +135,151 @@ def credregion(posterior, percentile=[0.6827, 0.9545, 0.9973],
         CRlo.append(xpdf[iregion[:,0]])
         CRhi.append(xpdf[iregion[:,1]])
 
+    return CRlo, CRhi
+
+
+def limits(posterior, lims=(None,None)):
+    """
+    Grid limits of each row of `posterior`, extended to `lims` if given.
+    """
+    lo = np.amin(posterior, axis=-1)
+    hi = np.amax(posterior, axis=-1)
+    if lims[0] is not None:
+        lo = np.minimum(lo, lims[0])
+    if lims[1] is not None:
+        hi = np.maximum(hi, lims[1])
+    return lo, hi
+
+
+def credregions(posterior, percentile=[0.6827, 0.9545, 0.9973], 
+                lims=(None,None), numpts=100):
+    """
+    Credible regions of every parameter of a posterior at once, using
+    fftpdf().
+
+    Inputs
+    ------
+    posterior: 2D array. Shape (nparams, nsamples). See load_data().
+    percentile, lims, numpts: see credregion().
+
+    Outputs
+    -------
+    pdf, xpdf : 2D arrays. Shape (nparams, 100*numpts).
+    CRlo, CRhi: lists. CRlo[n] and CRhi[n] are the regions of parameter n,
+                       as returned by credregion().
+    """
+    if type(percentile) == float:
+        percentile = np.array([percentile])
+    posterior = np.atleast_2d(posterior)
+    lo, hi    = limits(posterior, lims)
+    pdf, xpdf = fftpdf(posterior, lo, hi, 100*numpts)
+    CRlo, CRhi = [], []
+    for n in range(len(pdf)):
+        lo, hi = hpdregion(pdf[n], xpdf[n], percentile)
+        CRlo.append(lo)
+        CRhi.append(hi)
+    return pdf, xpdf, CRlo, CRhi
+
+
+def credregion(posterior, percentile=[0.6827, 0.9545, 0.9973], 
+               lims=(None,None), numpts=100, method='fft'):
+    """
+    posterior: see load_data()
+    percentile: 1D float ndarray, list, or float.
+                The percentile (actually the fraction) of the credible region.
+                A value in the range: (0, 1).
+    lims: tuple, floats. Minimum and maximum allowed values for posterior. 
+                         Should only be used if there are physically-imposed 
+                         limits.
+    numpts: int. Number of points to use when calculating the PDF.
+    method: string. 'fft' bins the posterior and smooths the histogram with 
+                    FFTs, see fftpdf(). 'kde' evaluates scipy's 
+                    gaussian_kde, which is much slower for large posteriors.
+    """
+    # Make sure `percentile` is a list or array
+    if type(percentile) == float:
+        percentile = np.array([percentile])
+
+    if method == 'fft':
+        pdf, xpdf, CRlo, CRhi = credregions(posterior, percentile, lims,
+                                            numpts)
+        return pdf[0], xpdf[0], CRlo[0], CRhi[0]
+    elif method != 'kde':
+        raise ValueError("Unknown method '" + str(method) + "'. Use 'fft' " +
+                         "or 'kde'.")
+
+    # Compute the posterior's PDF:
+    kernel = stats.gaussian_kde(posterior)
+    # Use a Gaussian kernel density estimate to trace the PDF:
+    # Interpolate-resample over finer grid (because kernel.evaluate
+    #  is expensive):
+    lo, hi = limits(posterior, lims)
+    x    = np.linspace(lo, hi, numpts)
+    f    = si.interp1d(x, kernel.evaluate(x))
+    xpdf = np.linspace(lo, hi, 100*numpts)
+    pdf  = f(xpdf)
+
+    CRlo, CRhi = hpdregion(pdf, xpdf, percentile)
+
     return pdf, xpdf, CRlo, CRhi
 
 
+def credregionfile(output, burnin, uniform, 
+                   percentile=[0.6827, 0.9545, 0.9973], numpts=100):
+    """
+    Credible regions of all parameters of an MC3 run.
+
+    Inputs
+    ------
+    output, burnin, uniform: see load_data().
+    percentile, numpts     : see credregion().
+
+    Outputs
+    -------
+    CRlo, CRhi: lists. See credregions().
+    """
+    posterior = load_data(output, burnin, uniform)
+    pdf, xpdf, CRlo, CRhi = credregions(posterior, percentile, numpts=numpts)
+    return CRlo, CRhi
+
+
+def _runcredregion(args):
+    output, burnin, uniform, percentile, numpts = args
+    return cache.call(credregionfile, [output], output, burnin, uniform, 
+                      percentile, numpts)
+
+
+def multicredregion(outputs, burnins, uniforms, 
+                    percentile=[0.6827, 0.9545, 0.9973], numpts=100, 
+                    ncpu=None):
+    """
+    Credible regions of all parameters of several MC3 runs, one process per
+    run. Results are cached, see cache.py.
+
+    Inputs
+    ------
+    outputs : list of strings. Path/to/output.npy file of each run.
+    burnins : list of ints.    Burn-in iterations of each run.
+    uniforms: list.            `uniform` of each run, see load_data().
+    percentile, numpts: see credregion().
+    ncpu    : int.             Number of processes. Default is all CPUs.
+
+    Outputs
+    -------
+    regions : list of tuples. (CRlo, CRhi) of each run, as returned by 
+                              credregions().
+    """
+    jobs = [(outputs[i], burnins[i], uniforms[i], percentile, numpts)
+            for i in range(len(outputs))]
+    pool = mp.Pool(ncpu)
+    try:
+        regions = pool.map(_runcredregion, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    return regions
+
+
 if __name__ == '__main__':
     # Set data paths
     data_dir   = '../BARTTest_v0.3/code-output/01BART/'
@@ -133,13 +316,12 @@ if __name__ == '__main__':
 
     modelnames = ['iso-ecl', 'iso-tra', 'noinv-ecl', 'noinv-tra', 
                   'inv-ecl', 'inv-tra', 'hd189']
+    regions = multicredregion(data_files, burnin, uniform)
     for i in range(len(data_files)):
-        # Load the data
-        posterior = load_data(data_files[i], burnin[i], uniform[i])
+        CRlos, CRhis = regions[i]
         print(modelnames[i])
-        for n in range(posterior.shape[0]):
-            # Get credible region
-            pdf, xpdf, CRlo, CRhi = credregion(posterior[n])
+        for n in range(len(CRlos)):
+            CRlo, CRhi = CRlos[n], CRhis[n]
             # Format it for printing
             creg = [' U '.join(['({:10.4e}, {:10.4e})'.format(CRlo[j][k], 
                                                               CRhi[j][k])
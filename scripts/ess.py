@@ -3,6 +3,9 @@
 import sys, os
 import numpy as np
 from scipy import stats
+sys.path.append('../BARTTest_v0.3/lib/')
+import mc3out
+import cache
 
 
 def convergetest(chains):
@@ -77,6 +80,93 @@ def gelmanrubin(chains):
 
 
 
+class RunningGR(object):
+    """
+    Running Gelman & Rubin (1992) test. Keeps the mean and variance of each
+    chain and parameter (Welford/Chan updates), so that the PSRF after each
+    new block of iterations costs O(block) instead of a pass over the whole
+    chain. Blocks can come from an array in post-processing, or from a
+    process that follows a live run.
+
+    Example
+    -------
+    gr = RunningGR()
+    for block in blocks:      # each of shape (nchains, nparams, niter)
+        gr.update(block)
+        print(gr.n, gr.psrf())
+    """
+    def __init__(self):
+        self.n    = 0
+        self.mean = None
+        self.M2   = None
+
+    def update(self, block):
+        """
+        Adds the next iterations of every chain.
+
+        Inputs
+        ------
+        block: 3D array. Shape (nchains, nparams, niter).
+        """
+        block = np.asarray(block, dtype=float)
+        m     = block.shape[-1]
+        if m == 0:
+            return
+        bmean = np.mean(block, axis=-1)
+        bM2   = np.sum((block - bmean[..., None])**2, axis=-1)
+        if self.n == 0:
+            self.mean, self.M2 = bmean, bM2
+        else:
+            n     = self.n + m
+            delta = bmean - self.mean
+            self.mean = self.mean + delta * m / n
+            self.M2   = self.M2 + bM2 + delta**2 * self.n * m / n
+        self.n += m
+
+    def psrf(self):
+        """
+        Potential scale reduction factor of each parameter for all the
+        iterations added so far. Same as convergetest() on those iterations.
+
+        Outputs
+        -------
+        psrf: 1D array. Shape (nparams,).
+        """
+        nchains  = self.mean.shape[0]
+        chainlen = float(self.n)
+        # Within-chain, between-chain, and posterior marginal variances
+        W = np.mean(self.M2 / chainlen, axis=0)
+        B = (chainlen/(nchains-1.0)) *                                        \
+            np.sum((self.mean - np.mean(self.mean, axis=0))**2, axis=0)
+        V = W*((chainlen - 1.0)/chainlen) + B*((nchains + 1.0)/(chainlen*nchains))
+        return np.sqrt(V/W)
+
+
+def psrfcurve(allparams, step=10000):
+    """
+    Computes the PSRF of every parameter every `step` iterations, in one
+    pass over the chains.
+
+    Inputs
+    ------
+    allparams: 3D array. Shape (nchains, nparams, niter). See mc3out.load().
+    step     : int.      Number of iterations between PSRF evaluations.
+
+    Outputs
+    -------
+    niter    : 1D array. Number of iterations of each evaluation.
+    psrf     : 2D array. Shape (len(niter), nparams). PSRF of each parameter.
+    """
+    gr    = RunningGR()
+    niter = []
+    psrf  = []
+    for i in range(0, allparams.shape[-1], step):
+        gr.update(allparams[:, :, i:i+step])
+        niter.append(gr.n)
+        psrf .append(gr.psrf())
+    return np.array(niter), np.array(psrf)
+
+
 def sig(ess, p_est=np.array([0.68269, 0.86639, 0.95450, 0.98758, 0.99730])):
     """
     Computes the 1, 1.5, 2, 2.5, 3 sigma uncertainties given an effective 
@@ -95,50 +185,150 @@ def sig(ess, p_est=np.array([0.68269, 0.86639, 0.95450, 0.98758, 0.99730])):
     return ((1.-p_est)*p_est/(ess+3))**0.5
 
 
-def ess(output, burnin, step=10000):
+def autocorr(x, maxsize=2**25):
+    """
+    Computes the normalized autocorrelation function of many series at once
+    with FFTs, in O(n log(n)) per series.
+
+    Inputs
+    ------
+    x      : array. Series along the last axis, e.g., (nchains, nparams, n).
+    maxsize: int.   Maximum number of FFT elements transformed at once, to
+                    bound memory.
+
+    Outputs
+    -------
+    acf    : array. Same shape as `x`. acf[..., t] is the autocorrelation at
+                    lag t, with acf[..., 0] = 1.
+    """
+    x     = np.asarray(x, dtype=float)
+    shape = x.shape
+    n     = shape[-1]
+    x     = x.reshape(-1, n)
+    # Zero-pad to avoid the circular wrap-around
+    nfft  = 2**int(np.ceil(np.log2(2*n)))
+    nser  = max(1, maxsize//nfft)
+    acf   = np.empty(x.shape)
+    for i in range(0, len(x), nser):
+        dx  = x[i:i+nser] - np.mean(x[i:i+nser], axis=1)[:, None]
+        f   = np.fft.rfft(dx, n=nfft, axis=1)
+        acov = np.fft.irfft(f * np.conj(f), n=nfft, axis=1)[:, :n]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            acf[i:i+nser] = acov / acov[:, :1]
+    # Constant series are uncorrelated
+    acf[np.isnan(acf)] = 0.0
+    acf[:, 0] = 1.0
+    return acf.reshape(shape)
+
+
+def speis(acf, window='fixed', cutoff=0.01, c=5.0):
+    """
+    Computes the steps per effective independent sample (the integrated
+    autocorrelation time) of each series from its autocorrelation function.
+
+    Inputs
+    ------
+    acf   : array. Autocorrelation functions along the last axis. See
+                   autocorr().
+    window: string. How the sum over lags is truncated:
+                    'fixed': up to the first lag where acf < `cutoff`, as in
+                             Ryan Challener's MCcubed pull request.
+                    'geyer': Geyer (1992) initial monotone sequence.
+                    'sokal': Sokal (1997) automatic window, the smallest lag
+                             M with M >= c*tau(M).
+    cutoff: float.  Autocorrelation threshold of the 'fixed' window.
+    c     : float.  Window constant of the 'sokal' window.
+
+    Outputs
+    -------
+    speis : array. Shape of `acf` without the last axis.
+    """
+    acf = np.asarray(acf)
+    n   = acf.shape[-1]
+    if   window == 'fixed':
+        below  = acf < cutoff
+        # First lag below the cutoff, or all but the last lag if none is
+        ilag   = np.where(np.any(below, axis=-1), np.argmax(below, axis=-1),
+                          n - 1)
+        keep   = np.arange(n) < ilag[..., None]
+        return 1 + 2 * np.sum(acf * keep, axis=-1)
+    elif window == 'geyer':
+        npair  = n//2
+        pairs  = acf[..., :2*npair].reshape(acf.shape[:-1] + (npair, 2))
+        gamma  = np.sum(pairs, axis=-1)
+        # Initial positive sequence, made monotone
+        keep   = np.cumprod(gamma > 0, axis=-1).astype(bool)
+        gamma  = np.minimum.accumulate(np.where(keep, gamma, 0), axis=-1)
+        return np.maximum(-1 + 2 * np.sum(gamma, axis=-1), 1.0)
+    elif window == 'sokal':
+        tau    = 1 + 2 * np.cumsum(acf[..., 1:], axis=-1)
+        lags   = np.arange(1, n)
+        ok     = lags >= c * tau
+        ilag   = np.where(np.any(ok, axis=-1), np.argmax(ok, axis=-1), n - 2)
+        return np.maximum(np.take_along_axis(tau, ilag[..., None],
+                                             axis=-1)[..., 0], 1.0)
+    raise ValueError("Unknown window '" + str(window) + "'. Use 'fixed', " +
+                     "'geyer', or 'sokal'.")
+
+
+def ess(output, burnin, step=10000, window='fixed'):
     """
     Inputs
     ------
     output: string. Path/to/output.npy file from MCcubed.
     burnin: int.    Number of burned iterations.
     step  : int.    Step size between each GR test calculation
+    window: string. Truncation of the autocorrelation sum. See speis().
+
+    Outputs
+    -------
+    See esschains().
+    """
+    # Load the output, discard burnin
+    return esschains(mc3out.load(output, burnin), step, window)
+
+
+def esschains(allparams, step=10000, window='fixed'):
+    """
+    ess() of a posterior that is already loaded.
+
+    Inputs
+    ------
+    allparams: 3D array. Shape (nchains, nparams, niter), without the
+                         burn-in. See mc3out.load().
+    step, window: see ess().
+
+    Outputs
+    -------
+    speis  : int.   Maximum steps per effective independent sample.
+    totiter: int.   Total number of iterations after burn-in.
+    parspeis: array. Steps per effective independent sample of each
+                     parameter, the maximum over the chains.
 
     Notes
     -----
     This code is adapted from Ryan Challener's MCcubed pull request.
     """
-    # Load the output, discard burnin
-    allparams = np.load(output)
-    allparams = allparams[:, :, burnin:]
     totiter   = allparams.shape[-1] * allparams.shape[0]
 
-    # Loop through iterations in steps of `step`
-    for i in range(1, int(np.ceil(allparams.shape[-1]/step))):
-        psrf = convergetest(allparams[:, :, :i*step])
-        if np.all(psrf < 1.01):
-            print("All parameters converged to within 1% of unity.")
-            print("Iteration:", i*step)
-            break
-
-    # Calculate the ESS
-    nisamp = np.zeros((allparams.shape[0], allparams.shape[1]))
-    for nc in range(allparams.shape[0]):
-        k      = 0
-        allpac = np.zeros((allparams.shape[1], i*step))
-        for p in range(allparams.shape[1]):
-            meanapi   = np.mean(     allparams[nc,p,:i*step])
-            autocorr  = np.correlate(allparams[nc,p,:i*step]-meanapi,
-                                     allparams[nc,p,:i*step]-meanapi, mode='full')
-            allpac[k] = autocorr[np.size(autocorr)//2:] / np.max(autocorr)
-            
-            if np.min(allpac[k]) < 0.01:
-                cutoff = np.where(allpac[k] < 0.01)[0][0]
-            else:
-                cutoff = -1
-            nisamp[nc, k]  = 1 + 2 * np.sum(allpac[k,:cutoff])
-            k += 1
-
-    return int(np.ceil(np.amax(nisamp))), totiter
+    # PSRF every `step` iterations, except for the full chain
+    niter, psrf = psrfcurve(allparams, step)
+    niter, psrf = niter[:-1], psrf[:-1]
+    converged   = np.where(np.all(psrf < 1.01, axis=1))[0]
+    if len(converged) > 0:
+        nconv = niter[converged[0]]
+        print("All parameters converged to within 1% of unity.")
+        print("Iteration:", nconv)
+    elif len(niter) > 0:
+        nconv = niter[-1]
+    else:
+        nconv = allparams.shape[-1]
+
+    # Calculate the ESS of all chains and parameters at once
+    nisamp   = speis(autocorr(allparams[:, :, :nconv]), window)
+    parspeis = np.amax(nisamp, axis=0)
+
+    return int(np.ceil(np.amax(parspeis))), totiter, parspeis
 
 
 if __name__ == '__main__':
@@ -156,7 +346,11 @@ if __name__ == '__main__':
     for foo in runs:
         print('')
         print(foo.split('/')[-2])
-        speis, totiter = ess(foo, burnin=5000)
+        speis, totiter, parspeis = cache.call(ess, [foo], foo, burnin=5000)
+        print("  Parameter    SPEIS        ESS")
+        for p in range(len(parspeis)):
+            print("  {:9d}  {:9.1f}  {:9d}".format(p, parspeis[p],
+                                     int(totiter//np.ceil(parspeis[p]))))
         print("  SPEIS:", speis)
         print("  ESS  :", totiter//speis)
         siggy = sig(totiter/speis)